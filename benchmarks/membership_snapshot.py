@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+"""
+Measures the memory used by a membership snapshot of 100,000 users and 5,000
+organisations, and how many role lookups per second it can answer, both in process
+memory and shared between processes in a memory-mapped file. Each user is given a
+handful of memberships in random organisations.
+
+Run with: python benchmarks/membership_snapshot.py
+"""
+
+import os
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+import uuid
+
+from ckanext.userdatasets.lib.shared_snapshot import MappedSnapshot, write_snapshot
+from ckanext.userdatasets.lib.snapshot import ROLES, MembershipSnapshot
+
+USERS = 100000
+ORGS = 5000
+MEMBERSHIPS_PER_USER = 5
+NUMBER = 1000000
+
+
+def main():
+    rng = random.Random(42)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(USERS)]
+    org_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(ORGS)]
+    rows = [
+        (user_id, org_id, rng.choice(ROLES))
+        for user_id in user_ids
+        for org_id in rng.sample(org_ids, MEMBERSHIPS_PER_USER)
+    ]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    snapshot = MembershipSnapshot()
+    snapshot.add_users((user_id, f'user-{i}') for i, user_id in enumerate(user_ids))
+    snapshot.add_orgs((org_id, f'org-{i}') for i, org_id in enumerate(org_ids))
+    snapshot.set_memberships(rows)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f'{USERS} users x {ORGS} orgs, {len(snapshot)} memberships: '
+        f'built in {elapsed:.2f}s, {size / 1024 / 1024:.1f}MiB '
+        f'(including the interned ID and name strings)'
+    )
+
+    lookups = [(rng.choice(org_ids), rng.choice(user_ids)) for _ in range(1000)]
+    lookups += [(org_id, user_id) for user_id, org_id, _ in rng.sample(rows, 1000)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot')
+        start = time.perf_counter()
+        write_snapshot(snapshot, path, 1, 0)
+        print(
+            f'mapped: written in {time.perf_counter() - start:.2f}s, '
+            f'{os.path.getsize(path) / 1024 / 1024:.1f}MiB shared by all processes'
+        )
+        mapped = MappedSnapshot(path)
+        for name, get_role in (
+            ('in memory', snapshot.get_role),
+            ('mapped', mapped.get_role),
+        ):
+
+            def run():
+                for org_id, user_id in lookups:
+                    get_role(org_id, user_id)
+
+            elapsed = timeit.timeit(run, number=NUMBER // len(lookups))
+            print(f'{name} lookups: {NUMBER / elapsed:,.0f} per second')
+
+
+if __name__ == '__main__':
+    main()
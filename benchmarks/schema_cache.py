@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+"""
+Compares building and patching the package schemas on every call (as package_create
+and package_update used to) with getting them from the schema cache.
+
+Run with: python benchmarks/schema_cache.py
+"""
+
+import timeit
+
+import ckan.lib.plugins as lib_plugins
+
+from ckanext.userdatasets.logic.schema import (
+    _build_package_schema,
+    clear_schema_cache,
+    get_package_schema,
+)
+
+NUMBER = 20000
+
+
+def main():
+    # with no other plugins loaded this just sets up the default dataset form
+    lib_plugins.register_package_plugins()
+    clear_schema_cache()
+
+    for action in ('create', 'update'):
+        uncached = timeit.timeit(
+            lambda: _build_package_schema(None, action), number=NUMBER
+        )
+        cached = timeit.timeit(lambda: get_package_schema(None, action), number=NUMBER)
+        print(
+            f'{action}: uncached {uncached / NUMBER * 1e6:.1f}us, '
+            f'cached {cached / NUMBER * 1e6:.1f}us per call '
+            f'({uncached / cached:.1f}x)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from ckan.plugins import toolkit
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the back-pressure policies, applied when the queue is full
+DROP = 'drop'
+BLOCK = 'block'
+
+# put on the queue to stop the writer thread
+_stop = object()
+
+
+class AuditLog(object):
+    """
+    Records audit events without making the caller wait for them to be written. Events
+    are put on a bounded queue and a background thread appends them, in batches, to a
+    JSON lines file.
+
+    The thread is started on the first event in each process, so that an audit log
+    configured before the server forks its workers still works in each of them.
+    """
+
+    def __init__(self, path, queue_size, batch_size, flush_interval, policy):
+        """
+        :param path: the path of the JSON lines file to append events to
+        :param queue_size: the maximum number of events waiting to be written
+        :param batch_size: the maximum number of events to write at once
+        :param flush_interval: the maximum number of seconds to wait for a batch to
+            fill up before writing it
+        :param policy: what to do when the queue is full, either DROP the event or
+            BLOCK until there's room
+        """
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f'Unknown audit queue policy: {policy}')
+        self.path = path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        # the number of events written and dropped by this process
+        self.written = 0
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._thread = threading.Thread(
+                    target=self._run, name='userdatasets-audit', daemon=True
+                )
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def record(self, event):
+        """
+        Queue an event to be written. If the queue is full, the event is dropped or
+        this blocks until there's room, depending on the policy.
+
+        :param event: a dict which can be serialised as JSON
+        """
+        if self._pid != os.getpid():
+            self._start()
+        if self.policy == BLOCK:
+            self._queue.put(event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            log.warning('Audit queue is full, dropped event: %s', event)
+
+    def _next_batch(self):
+        events = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(events) < self.batch_size and events[-1] is not _stop:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                events.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            events = self._next_batch()
+            stopping = events[-1] is _stop
+            batch = [event for event in events if event is not _stop]
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception:
+                log.exception('Failed to write %d audit events', len(batch))
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+
+    def _write(self, events):
+        lines = ''.join(f'{json.dumps(event, sort_keys=True)}\n' for event in events)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        self.written += len(events)
+
+    def flush(self):
+        """
+        Wait until all the events queued so far have been written.
+        """
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self, timeout=5):
+        """
+        Write any queued events and stop the writer thread. This is called when the
+        process exits.
+
+        :param timeout: the maximum number of seconds to wait for the events to be
+            written
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_stop)
+            self._thread.join(timeout)
+
+
+_audit_log = None
+
+
+def configure(config):
+    """
+    Set up the audit log using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _audit_log
+    if _audit_log is not None:
+        _audit_log.close()
+    if toolkit.asbool(config.get('ckanext.userdatasets.audit.enabled')):
+        path = config.get('ckanext.userdatasets.audit.path')
+        if not path:
+            raise ValueError('ckanext.userdatasets.audit.path must be set')
+        _audit_log = AuditLog(
+            path,
+            toolkit.asint(config.get('ckanext.userdatasets.audit.queue_size', 10000)),
+            toolkit.asint(config.get('ckanext.userdatasets.audit.batch_size', 100)),
+            float(config.get('ckanext.userdatasets.audit.flush_interval', 1)),
+            config.get('ckanext.userdatasets.audit.policy', DROP),
+        )
+    else:
+        _audit_log = None
+
+
+def get_audit_log():
+    """
+    Returns the AuditLog, or None if auditing is disabled.
+    """
+    return _audit_log
+
+
+def record_ownership_decision(action, user, ownership):
+    """
+    Record that the given action was allowed because the user owns the package as a
+    member of its organisation.
+
+    :param action: the name of the action
+    :param user: A user object
+    :param ownership: the PackageOwnership the decision was made on
+    """
+    if _audit_log is not None:
+        _audit_log.record(
+            {
+                'timestamp': datetime.utcnow().isoformat(),
+                'action': action,
+                'user_id': user.id,
+                'user_name': user.name,
+                'package_id': ownership.package_id,
+                'owner_org': ownership.owner_org,
+                'role': ownership.role,
+            }
+        )
+
+
+def record_ownership_transfer(
+    requested_by, from_user_id, to_user_id, owner_org_id, package_ids
+):
+    """
+    Record that a chunk of packages was transferred from one creator to another by
+    userdatasets_transfer_ownership.
+
+    :param requested_by: the ID of the user who started the transfer
+    :param from_user_id: the ID of the previous creator
+    :param to_user_id: the ID of the new creator
+    :param owner_org_id: the ID of the organisation the transfer was limited to, or None
+        if it covered every organisation the new creator is a member of
+    :param package_ids: the IDs of the packages transferred
+    """
+    if _audit_log is not None:
+        _audit_log.record(
+            {
+                'timestamp': datetime.utcnow().isoformat(),
+                'action': 'userdatasets_transfer_ownership',
+                'user_id': requested_by,
+                'from_user_id': from_user_id,
+                'to_user_id': to_user_id,
+                'owner_org': owner_org_id,
+                'package_ids': list(package_ids),
+            }
+        )
+
+
+@atexit.register
+def _close():
+    if _audit_log is not None:
+        _audit_log.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import functools
+
+from ckanext.userdatasets.lib.memo import clear_request_memo, get_request_memo
+
+# the name of the request memo used to store auth decisions
+AUTH_MEMO = 'auth'
+# if this is set to a truthy value in the context, the auth memo isn't used
+SKIP_AUTH_MEMO = 'userdatasets_skip_auth_memo'
+# the data dict keys which identify the object an auth function is deciding on
+OBJECT_KEYS = ('id', 'package_id', 'resource_id')
+
+
+def not_memoised(function):
+    """
+    Decorator which marks an auth function as one whose decisions must never be
+    memoised, e.g. because they depend on more than the object and the user.
+
+    :param function: the auth function
+    :returns: the same function
+    """
+    function.userdatasets_not_memoised = True
+    return function
+
+
+def memo_key(name, context, data_dict):
+    """
+    Creates the key an auth decision is memoised under, or None if the decision
+    shouldn't be memoised. Only data dicts which hold nothing but the object's ID are
+    memoised, as auth functions can also depend on the rest of the data dict (e.g.
+    package_update checks the groups a dataset is being added to).
+
+    :param name: the name of the auth function
+    :param context: the context dict
+    :param data_dict: the data dict
+    :returns: a (name, object ID, user) tuple or None
+    """
+    if context.get(SKIP_AUTH_MEMO) or not isinstance(data_dict, dict):
+        return None
+    user = context.get('user')
+    if not user or len(data_dict) != 1:
+        return None
+    key, ref = next(iter(data_dict.items()))
+    if key in OBJECT_KEYS and ref and isinstance(ref, str):
+        return name, ref, user
+    return None
+
+
+def memoise(name, function):
+    """
+    Wraps the given auth function so that its decisions are memoised for the rest of
+    the request, keyed on the function name, the ID of the object and the user. Calls
+    whose data dict holds anything other than the object ID, or which opt out (see
+    not_memoised and SKIP_AUTH_MEMO), are passed straight through. Exceptions are
+    never memoised.
+
+    Both chained and plain auth functions can be wrapped; the attributes CKAN uses to
+    tell them apart are copied onto the wrapper.
+
+    :param name: the name the auth function is registered under
+    :param function: the auth function
+    :returns: the wrapped function
+    """
+    if getattr(function, 'userdatasets_not_memoised', False):
+        return function
+
+    def memoised(args, context, data_dict):
+        key = memo_key(name, context, data_dict)
+        memo = None if key is None else get_request_memo(AUTH_MEMO)
+        if memo is None:
+            return function(*args, context, data_dict)
+        result = memo.get(key)
+        if result is None:
+            result = function(*args, context, data_dict)
+            # store a copy so the caller can't alter the memoised decision
+            memo[key] = dict(result)
+        return dict(result)
+
+    if getattr(function, 'chained_auth_function', False):
+
+        @functools.wraps(function)
+        def wrapper(next_auth, context, data_dict=None):
+            return memoised((next_auth,), context, data_dict)
+
+    else:
+
+        @functools.wraps(function)
+        def wrapper(context, data_dict=None):
+            return memoised((), context, data_dict)
+
+    return wrapper
+
+
+def clear_auth_memo():
+    """
+    Forget all the auth decisions made so far in this request. This should be called
+    after anything which could change an auth decision is written.
+    """
+    clear_request_memo(AUTH_MEMO)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A thread safe, size bounded, least recently used cache where each entry also
+    expires after a fixed number of seconds.
+    """
+
+    def __init__(self, size, ttl, clock=time.monotonic):
+        """
+        :param size: the maximum number of entries to hold
+        :param ttl: the number of seconds after which an entry expires, if this is 0 or
+            less the entries never expire
+        :param clock: the function used to get the current time (optional)
+        """
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Retrieve the value associated with the given key.
+
+        :param key: the key
+        :param default: the value to return if the key isn't present or has expired
+        :returns: the cached value or the default
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.clock():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Add the given key and value to the cache, evicting the least recently used
+        entry if the cache is full.
+
+        :param key: the key
+        :param value: the value
+        """
+        expires = self.clock() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove the given key from the cache, if it is present. This doesn't count as a
+        hit or a miss.
+
+        :param key: the key
+        :param default: the value to return if the key isn't present
+        :returns: the removed value (even if it had expired) or the default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def invalidate(self, predicate):
+        """
+        Remove all the entries whose keys match the given predicate.
+
+        :param predicate: a function which is passed a key and returns True if the
+            entry should be removed
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
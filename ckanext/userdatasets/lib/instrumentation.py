@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from ckan.plugins import toolkit
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the key the start time of each query is stored under in the connection's info dict
+QUERY_START = 'userdatasets_query_start'
+
+# set as the current scope while a call which wasn't sampled is running, so that the
+# calls it makes aren't sampled either
+_skipped = object()
+
+
+class Scope(object):
+    """
+    The queries made during one call of an instrumented function.
+    """
+
+    __slots__ = ('name', 'queries', 'db_time')
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+
+
+class QueryStats(object):
+    """
+    Totals of the queries made by each instrumented function in this process.
+
+    Queries are attributed to the innermost instrumented function running when they
+    are made, so an action's totals don't include the queries made by the auth
+    functions it calls (if they're instrumented too).
+    """
+
+    def __init__(self, sample_rate, query_threshold, time_threshold):
+        """
+        :param sample_rate: the proportion of calls to instrument, from 0 to 1
+        :param query_threshold: calls making at least this many queries are logged (0
+            to disable)
+        :param time_threshold: calls spending at least this many milliseconds in the
+            database are logged (0 to disable)
+        """
+        self.sample_rate = sample_rate
+        self.query_threshold = query_threshold
+        self.time_threshold = time_threshold
+        self.since = time.time()
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def scope(self):
+        return getattr(self._local, 'scope', None)
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Context manager which attributes the queries made inside it to the given name,
+        if this call is sampled.
+
+        :param name: the name of the function being called
+        """
+        parent = self.scope
+        if parent is None and random.random() >= self.sample_rate:
+            scope = _skipped
+        elif parent is _skipped:
+            scope = parent
+        else:
+            scope = Scope(name)
+        self._local.scope = scope
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.scope = parent
+            if scope is not _skipped:
+                self.record(scope, time.perf_counter() - start)
+
+    def add_query(self, duration):
+        """
+        Attribute a query to the current scope, if there is one.
+
+        :param duration: the number of seconds the query took
+        """
+        scope = self.scope
+        if scope is not None and scope is not _skipped:
+            scope.queries += 1
+            scope.db_time += duration
+
+    def record(self, scope, duration):
+        """
+        Add a finished call to the totals, logging it if it crossed a threshold.
+
+        :param scope: the call's Scope
+        :param duration: the number of seconds the call took
+        """
+        db_time_ms = scope.db_time * 1000
+        with self._lock:
+            totals = self._totals.get(scope.name)
+            if totals is None:
+                totals = self._totals[scope.name] = {
+                    'calls': 0,
+                    'queries': 0,
+                    'db_time_ms': 0.0,
+                    'max_queries': 0,
+                    'max_db_time_ms': 0.0,
+                    'slow_calls': 0,
+                }
+            totals['calls'] += 1
+            totals['queries'] += scope.queries
+            totals['db_time_ms'] += db_time_ms
+            totals['max_queries'] = max(totals['max_queries'], scope.queries)
+            totals['max_db_time_ms'] = max(totals['max_db_time_ms'], db_time_ms)
+            slow = (0 < self.query_threshold <= scope.queries) or (
+                0 < self.time_threshold <= db_time_ms
+            )
+            if slow:
+                totals['slow_calls'] += 1
+        if slow:
+            log.warning(
+                json.dumps(
+                    {
+                        'event': 'userdatasets.queries',
+                        'function': scope.name,
+                        'queries': scope.queries,
+                        'db_time_ms': round(db_time_ms, 3),
+                        'duration_ms': round(duration * 1000, 3),
+                    }
+                )
+            )
+
+    def get_totals(self):
+        """
+        Returns a copy of the totals for each function.
+
+        :returns: a dict of function names -> dicts of totals
+        """
+        with self._lock:
+            return {name: dict(totals) for name, totals in self._totals.items()}
+
+
+_stats = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _stats is not None and _stats.scope is not None:
+        conn.info.setdefault(QUERY_START, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(QUERY_START)
+    if _stats is not None and starts:
+        _stats.add_query(time.perf_counter() - starts.pop())
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute isn't called for failed queries, so count them here
+    connection = exception_context.connection
+    starts = None if connection is None else connection.info.get(QUERY_START)
+    if _stats is not None and starts:
+        _stats.add_query(time.perf_counter() - starts.pop())
+
+
+def configure(config):
+    """
+    Set up the query instrumentation using the options in the given CKAN config. When
+    it's enabled, listeners are added to every SQLAlchemy engine.
+
+    :param config: the CKAN config
+    """
+    global _stats
+    enabled = toolkit.asbool(config.get('ckanext.userdatasets.instrumentation.enabled'))
+    if enabled:
+        _stats = QueryStats(
+            float(config.get('ckanext.userdatasets.instrumentation.sample_rate', 1)),
+            toolkit.asint(
+                config.get('ckanext.userdatasets.instrumentation.query_threshold', 20)
+            ),
+            float(
+                config.get('ckanext.userdatasets.instrumentation.time_threshold', 200)
+            ),
+        )
+    else:
+        _stats = None
+    for name, listener in (
+        ('before_cursor_execute', _before_cursor_execute),
+        ('after_cursor_execute', _after_cursor_execute),
+        ('handle_error', _handle_error),
+    ):
+        if enabled and not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+        elif not enabled and event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+
+def get_query_stats():
+    """
+    Returns the QueryStats, or None if instrumentation is disabled.
+    """
+    return _stats
+
+
+def instrument(name, function):
+    """
+    Wraps the given action or auth function so that the queries it makes are counted
+    and timed. The function's attributes (e.g. chained_action) are copied onto the
+    wrapper so CKAN still treats it the same way.
+
+    :param name: the name to record the function's queries under
+    :param function: the function
+    :returns: the wrapped function
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _stats is None:
+            return function(*args, **kwargs)
+        with _stats.measure(name):
+            return function(*args, **kwargs)
+
+    return wrapper
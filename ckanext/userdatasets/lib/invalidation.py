@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import json
+import logging
+import threading
+import time
+
+from ckan import model
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins import toolkit
+from flask import g, has_app_context
+from redis.exceptions import RedisError
+from sqlalchemy import event
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the session info key invalidations are kept under until the transaction commits
+PENDING = 'userdatasets_invalidations'
+# the g attribute the time of the current request's last sync is stored under
+LAST_SYNC = 'userdatasets_invalidations_synced'
+# the maximum number of seconds between syncs during one request (or job, or command)
+SYNC_INTERVAL = 1
+# the number of events read from the stream at once
+BATCH_SIZE = 500
+# the kind of event added to an empty stream so that there's an event to start from
+MARKER = 'marker'
+
+# the kind of event published when users' memberships change, the refs are the names
+# and IDs of the users
+USER_EVENT = 'user'
+
+# event kind -> list of (apply, reset) functions
+_handlers = {}
+
+
+def register(kind, apply, reset):
+    """
+    Register the functions which keep one of this process's caches in step with the
+    invalidations published by other processes. Several caches can register for the
+    same kind of event. The functions are called while the channel is being synced, so
+    they must not use anything which syncs it again.
+
+    :param kind: the kind of event the cache is invalidated by
+    :param apply: a function which is passed the refs in each event of that kind and
+        removes them from the cache
+    :param reset: a function which clears the cache, called when some events may have
+        been missed
+    """
+    _handlers.setdefault(kind, []).append((apply, reset))
+
+
+def _reset_all():
+    for handlers in _handlers.values():
+        for _, reset in handlers:
+            reset()
+
+
+class InvalidationChannel(object):
+    """
+    Shares cache invalidations between all the processes serving a site, through a
+    capped Redis stream.
+
+    Each process applies its own invalidations straight away and publishes them to the
+    stream. Before using its caches, each process reads the events added since it last
+    looked and applies them too. If events may have been missed (because the stream was
+    trimmed past the last one seen, or Redis can't be reached) every cache is cleared
+    instead, so a cache is never used without being up to date with the stream.
+    """
+
+    def __init__(self, key, max_length):
+        """
+        :param key: the Redis key of the stream
+        :param max_length: the number of events to keep in the stream, a process which
+            falls further behind than this clears its caches
+        """
+        self.key = key
+        self.max_length = max_length
+        # the ID of the last event this process has applied
+        self.last_id = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return connect_to_redis()
+
+    def _add(self, client, kind, refs):
+        return client.xadd(
+            self.key,
+            {'kind': kind, 'refs': json.dumps(refs)},
+            maxlen=self.max_length,
+            approximate=True,
+        )
+
+    def publish(self, kind, *refs):
+        """
+        Add an invalidation event to the stream.
+
+        :param kind: the kind of event
+        :param refs: the IDs and/or names of the objects to invalidate
+        """
+        try:
+            self._add(self.client, kind, refs)
+        except RedisError:
+            log.error('Failed to publish %s invalidation', kind, exc_info=True)
+
+    def sync(self):
+        """
+        Apply the events published since the last sync, or clear every cache if some
+        may have been missed.
+        """
+        with self._lock:
+            try:
+                if self._read():
+                    return
+                # start again from the latest event
+                client = self.client
+                latest = client.xrevrange(self.key, count=1)
+                self.last_id = latest[0][0] if latest else self._add(client, MARKER, ())
+            except RedisError:
+                self.last_id = None
+                log.warning('Failed to read invalidations', exc_info=True)
+            _reset_all()
+
+    def _read(self):
+        """
+        Read and apply the events after the last one applied.
+
+        :returns: True if the events were applied, False if some may have been missed
+        """
+        if self.last_id is None:
+            return False
+        while True:
+            # the range includes the last event applied, which shows that the stream
+            # hasn't been trimmed past it
+            events = self.client.xrange(
+                self.key, min=self.last_id, count=BATCH_SIZE + 1
+            )
+            if not events:
+                # nothing can have been trimmed without newer events being added
+                return True
+            if events[0][0] != self.last_id:
+                return False
+            for event_id, fields in events[1:]:
+                handlers = _handlers.get(fields[b'kind'].decode('utf-8'), ())
+                for apply, _ in handlers:
+                    apply(*json.loads(fields[b'refs']))
+                self.last_id = event_id
+            if len(events) <= BATCH_SIZE:
+                return True
+
+
+_channel = None
+
+
+def _after_commit(session):
+    pending = session.info.pop(PENDING, None)
+    if pending and _channel is not None:
+        for kind, refs in pending:
+            _channel.publish(kind, *refs)
+
+
+def configure(config):
+    """
+    Set up the invalidation channel using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _channel
+    enabled = toolkit.asbool(
+        config.get('ckanext.userdatasets.invalidation.enabled', True)
+    )
+    if enabled:
+        site_id = config.get('ckan.site_id', 'default')
+        _channel = InvalidationChannel(
+            f'ckanext-userdatasets:{site_id}:invalidations',
+            toolkit.asint(
+                config.get('ckanext.userdatasets.invalidation.max_length', 10000)
+            ),
+        )
+    else:
+        _channel = None
+    listening = event.contains(model.Session, 'after_commit', _after_commit)
+    if enabled and not listening:
+        event.listen(model.Session, 'after_commit', _after_commit)
+    elif not enabled and listening:
+        event.remove(model.Session, 'after_commit', _after_commit)
+
+
+def get_invalidation_channel():
+    """
+    Returns the InvalidationChannel, or None if invalidations aren't shared.
+    """
+    return _channel
+
+
+def sync_invalidations():
+    """
+    Bring this process's caches up to date with the invalidations published by other
+    processes. This is called whenever a cache is about to be used, but only reads from
+    Redis at the start of each request and then at most every SYNC_INTERVAL seconds.
+    """
+    if _channel is None:
+        return
+    if has_app_context():
+        now = time.monotonic()
+        last_sync = g.get(LAST_SYNC)
+        if last_sync is not None and now - last_sync < SYNC_INTERVAL:
+            return
+        setattr(g, LAST_SYNC, now)
+    _channel.sync()
+
+
+def publish(kind, *refs):
+    """
+    Tell the other processes to remove the given objects from their caches. The event
+    is published straight away and again when the current transaction commits, so a
+    process which reloads an object from the database in between (and so still sees
+    the old version) doesn't keep it.
+
+    :param kind: the kind of event, as registered by the cache
+    :param refs: the IDs and/or names of the objects (optional, some kinds of event
+        clear the whole cache)
+    """
+    if _channel is None:
+        return
+    _channel.publish(kind, *refs)
+    session = model.Session()
+    # SQLAlchemy 1.3 sessions are always in a transaction
+    in_transaction = getattr(session, 'in_transaction', None)
+    if in_transaction is None or in_transaction():
+        session.info.setdefault(PENDING, []).append((kind, refs))
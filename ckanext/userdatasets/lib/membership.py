@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import logging
+
+from ckan import model
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins import toolkit
+from redis.exceptions import RedisError
+from sqlalchemy import and_
+
+from ckanext.userdatasets.lib import invalidation
+from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+from ckanext.userdatasets.lib.cache import LRUCache
+from ckanext.userdatasets.lib.memo import clear_request_memo
+from ckanext.userdatasets.lib.org_list import get_org_list_cache
+from ckanext.userdatasets.lib.snapshot import get_snapshot_manager
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the name of the request memo used to store role lookups
+ROLE_MEMO = 'roles'
+
+
+class MemoryMembershipCache(object):
+    """
+    A per-process cache of user roles in groups and organisations.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        :param size: the maximum number of (group, user) roles to hold
+        :param ttl: the number of seconds to hold each role for
+        """
+        self.cache = LRUCache(size, ttl)
+
+    def get(self, group_or_org_id, username, default=None):
+        """
+        Retrieve the cached role for the given user in the given group.
+
+        :param group_or_org_id: ID or name of a group or organisation
+        :param username: the user's name or ID
+        :param default: the value to return if the role isn't cached
+        :returns: the cached role (which may be None) or the default
+        """
+        return self.cache.get((group_or_org_id, username), default)
+
+    def set(self, group_or_org_id, username, role):
+        """
+        Cache the role for the given user in the given group.
+
+        :param group_or_org_id: ID or name of a group or organisation
+        :param username: the user's name or ID
+        :param role: the role (or None if the user has no role)
+        """
+        self.cache.set((group_or_org_id, username), role)
+
+    def invalidate_user(self, *user_refs):
+        """
+        Remove all cached roles for the user.
+
+        :param user_refs: the names and/or IDs the user might have been cached under
+        """
+        user_refs = set(user_refs)
+        self.cache.invalidate(lambda key: key[1] in user_refs)
+
+    def clear(self):
+        """
+        Remove all cached roles.
+        """
+        self.cache.clear()
+
+
+class RedisMembershipCache(object):
+    """
+    A cache of user roles in groups and organisations which is stored in Redis and is
+    therefore shared between all worker processes.
+
+    The roles for each user are stored in a single hash so that all of them can be
+    removed with one command when the user's memberships change. As every worker reads
+    from the same hash, an invalidation in one worker takes effect in all of them.
+    """
+
+    # stored in place of None as Redis can't store nulls
+    no_role = ''
+
+    def __init__(self, ttl, prefix):
+        """
+        :param ttl: the number of seconds to hold each user's roles for
+        :param prefix: the prefix to use for all the keys this cache creates
+        """
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def client(self):
+        return connect_to_redis()
+
+    def _key(self, username):
+        return f'{self.prefix}:roles:{username}'
+
+    def get(self, group_or_org_id, username, default=None):
+        """
+        Retrieve the cached role for the given user in the given group.
+
+        :param group_or_org_id: ID or name of a group or organisation
+        :param username: the user's name or ID
+        :param default: the value to return if the role isn't cached
+        :returns: the cached role (which may be None) or the default
+        """
+        try:
+            role = self.client.hget(self._key(username), group_or_org_id)
+        except RedisError:
+            log.warning('Failed to read role from Redis', exc_info=True)
+            return default
+        if role is None:
+            return default
+        role = role.decode('utf-8')
+        return None if role == self.no_role else role
+
+    def set(self, group_or_org_id, username, role):
+        """
+        Cache the role for the given user in the given group.
+
+        :param group_or_org_id: ID or name of a group or organisation
+        :param username: the user's name or ID
+        :param role: the role (or None if the user has no role)
+        """
+        key = self._key(username)
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hset(key, group_or_org_id, self.no_role if role is None else role)
+            pipeline.ttl(key)
+            _, ttl = pipeline.execute()
+            # only set the expiry when the hash is first created, otherwise roles would
+            # be kept for as long as the user kept making new lookups
+            if self.ttl > 0 and ttl < 0:
+                self.client.expire(key, self.ttl)
+        except RedisError:
+            log.warning('Failed to write role to Redis', exc_info=True)
+
+    def invalidate_user(self, *user_refs):
+        """
+        Remove all cached roles for the user.
+
+        :param user_refs: the names and/or IDs the user might have been cached under
+        """
+        try:
+            self.client.delete(*(self._key(ref) for ref in user_refs))
+        except RedisError:
+            log.error('Failed to invalidate roles in Redis', exc_info=True)
+
+    def clear(self):
+        """
+        Remove all cached roles.
+        """
+        client = self.client
+        for key in client.scan_iter(match=self._key('*')):
+            client.delete(key)
+
+
+_cache = None
+
+
+def configure(config):
+    """
+    Set up the membership cache using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _cache
+    if toolkit.asbool(config.get('ckanext.userdatasets.membership_cache.enabled')):
+        backend = config.get('ckanext.userdatasets.membership_cache.backend', 'memory')
+        ttl = toolkit.asint(
+            config.get('ckanext.userdatasets.membership_cache.ttl', 300)
+        )
+        if backend == 'redis':
+            site_id = config.get('ckan.site_id', 'default')
+            _cache = RedisMembershipCache(ttl, f'ckanext-userdatasets:{site_id}')
+        elif backend == 'memory':
+            size = toolkit.asint(
+                config.get('ckanext.userdatasets.membership_cache.size', 10000)
+            )
+            _cache = MemoryMembershipCache(size, ttl)
+        else:
+            raise ValueError(f'Unknown membership cache backend: {backend}')
+    else:
+        _cache = None
+
+
+def get_membership_cache():
+    """
+    Returns the configured membership cache, or None if it is disabled. A memory cache
+    is brought up to date with the invalidations made by other processes first.
+    """
+    if _cache is not None:
+        invalidation.sync_invalidations()
+    return _cache
+
+
+def _apply(*user_refs):
+    # the redis backend is shared, so it's already been invalidated
+    if isinstance(_cache, MemoryMembershipCache):
+        _cache.invalidate_user(*user_refs)
+
+
+def _reset():
+    if isinstance(_cache, MemoryMembershipCache):
+        _cache.clear()
+
+
+invalidation.register(invalidation.USER_EVENT, _apply, _reset)
+
+
+def get_user_refs(user_name_or_id):
+    """
+    Find all the references a user's roles could have been looked up with.
+
+    :param user_name_or_id: the user's name or ID
+    :returns: a set of names and IDs
+    """
+    refs = {user_name_or_id}
+    user = model.User.get(user_name_or_id)
+    if user is not None:
+        refs.update((user.id, user.name))
+    return refs
+
+
+def get_org_member_refs(org_name_or_id):
+    """
+    Find all the references the roles of the given organisation's members could have
+    been looked up with. Members whose membership has been deleted are included.
+
+    :param org_name_or_id: the organisation's name or ID
+    :returns: a set of names and IDs
+    """
+    org = model.Group.get(org_name_or_id)
+    if org is None:
+        return set()
+    rows = model.Session.query(model.User.id, model.User.name).join(
+        model.Member,
+        and_(
+            model.Member.table_id == model.User.id,
+            model.Member.table_name == 'user',
+            model.Member.group_id == org.id,
+        ),
+    )
+    return {ref for row in rows for ref in row}
+
+
+def invalidate_user(user_name_or_id):
+    """
+    Forget any cached roles, organisation lists and auth decisions for the given user.
+    This should be called whenever the user's memberships change.
+
+    :param user_name_or_id: the user's name or ID
+    """
+    refs = set()
+    # only look the user up if there's a cache to remove them from
+    if user_name_or_id and (
+        _cache is not None
+        or get_org_list_cache() is not None
+        or get_snapshot_manager() is not None
+    ):
+        refs = get_user_refs(user_name_or_id)
+    invalidate_user_refs(refs)
+
+
+def invalidate_user_refs(refs):
+    """
+    Forget any cached roles, organisation lists and auth decisions for the users with
+    the given references, in this process and every other. This should be called with
+    the references of an organisation's members whenever the organisation is deleted or
+    its state or name changes, as that changes whether they are a member of any
+    organisation.
+
+    :param refs: the names and IDs the users might have been cached under
+    """
+    clear_request_memo(ROLE_MEMO)
+    clear_auth_memo()
+    org_list_cache = get_org_list_cache()
+    snapshot_manager = get_snapshot_manager()
+    if not refs or (
+        _cache is None and org_list_cache is None and snapshot_manager is None
+    ):
+        return
+    log.debug('Invalidating cached roles for %s', refs)
+    if _cache is not None:
+        _cache.invalidate_user(*refs)
+    if org_list_cache is not None:
+        org_list_cache.invalidate_user(*refs)
+    if snapshot_manager is not None:
+        snapshot_manager.mark_dirty(*refs)
+    invalidation.publish(invalidation.USER_EVENT, *refs)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import threading
+from collections import Counter
+
+from flask import g, has_app_context
+
+# running totals of hits and misses across all requests, keyed on (memo name, outcome)
+totals = Counter()
+# guards totals, which is shared by every request thread in the process
+_totals_lock = threading.Lock()
+
+
+def _count(name, outcome):
+    with _totals_lock:
+        totals[(name, outcome)] += 1
+
+
+def get_totals():
+    """
+    Returns a copy of the running hit and miss totals.
+
+    :returns: a dict of (memo name, outcome) -> count
+    """
+    with _totals_lock:
+        return dict(totals)
+
+
+class RequestMemo(object):
+    """
+    A simple dict-backed memo which counts how often it is able to answer a lookup.
+
+    Instances live on the Flask g object so they only last for the current request.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: the name of the memo, used when recording hit/miss totals
+        """
+        self.name = name
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Retrieve the value for the given key, recording a hit or a miss.
+
+        :param key: the key to look up
+        :param default: the value to return if the key isn't in the memo
+        :returns: the memoised value or the default
+        """
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.misses += 1
+            _count(self.name, 'misses')
+            return default
+        self.hits += 1
+        _count(self.name, 'hits')
+        return value
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        """
+        Remove all the values from the memo (the hit and miss counts are kept).
+        """
+        self.values.clear()
+
+
+def get_request_memo(name):
+    """
+    Returns the memo with the given name for the current request, creating it if
+    necessary. If there is no request (or app) context then None is returned and the
+    caller should just do the lookup itself.
+
+    :param name: the name of the memo
+    :returns: a RequestMemo or None
+    """
+    if not has_app_context():
+        return None
+    memos = g.setdefault('userdatasets_memos', {})
+    if name not in memos:
+        memos[name] = RequestMemo(name)
+    return memos[name]
+
+
+def clear_request_memo(name):
+    """
+    Clears the memo with the given name for the current request, if there is one.
+
+    :param name: the name of the memo
+    """
+    if has_app_context():
+        memo = g.get('userdatasets_memos', {}).get(name)
+        if memo is not None:
+            memo.clear()
@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import atexit
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins import toolkit
+from redis.exceptions import RedisError
+
+from ckanext.userdatasets.lib import memo
+from ckanext.userdatasets.lib.audit import get_audit_log
+from ckanext.userdatasets.lib.membership import get_membership_cache
+from ckanext.userdatasets.lib.negative import get_negative_cache
+from ckanext.userdatasets.lib.org_list import get_org_list_cache
+from ckanext.userdatasets.lib.packages import get_package_record_cache
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# the outcomes of an auth function call
+ALLOW = 'allow'
+DENY = 'deny'
+NEXT = 'next'
+ERROR = 'error'
+
+
+class Histogram(object):
+    """
+    A latency histogram with the fixed BUCKETS.
+    """
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        # the last count is for values over the largest bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Record a value.
+
+        :param value: the number of seconds taken
+        """
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """
+    The latency histograms and auth decision counts for this process.
+    """
+
+    def __init__(self):
+        # (kind, name) -> Histogram
+        self.histograms = {}
+        # (name, outcome) -> count
+        self.decisions = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, duration, outcome=None):
+        """
+        Record a call of an action or auth function.
+
+        :param kind: either 'action' or 'auth'
+        :param name: the name of the function
+        :param duration: the number of seconds the call took
+        :param outcome: for auth functions, one of ALLOW, DENY, NEXT or ERROR
+        """
+        with self._lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.observe(duration)
+            if outcome is not None:
+                self.decisions[(name, outcome)] += 1
+        if _shared is not None and _shared.pid != os.getpid():
+            _shared.start()
+
+
+class SharedMetrics(object):
+    """
+    Adds up the metrics of every worker process serving a site in Redis, so that
+    scraping any one of them reports the totals for all of them.
+
+    Each worker adds the increase in each of its counters since it last flushed to a
+    hash shared by all the workers, and replaces its gauges in a hash of its own which
+    expires if the worker stops flushing. Gauges are summed over the live workers. A
+    background thread flushes every flush_interval seconds, and the scraped worker
+    flushes before reading the totals, so a worker which dies loses at most that many
+    seconds of its counts. The thread is started on the first observation in each
+    process, so that metrics configured before the server forks its workers still
+    work in each of them.
+    """
+
+    def __init__(self, prefix, flush_interval):
+        """
+        :param prefix: the prefix to use for all the keys this creates
+        :param flush_interval: the number of seconds between flushes
+        """
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.counters_key = f'{prefix}:counters'
+        # the pid of the process the flushing thread was started in
+        self.pid = None
+        # field -> the value of the counter when it was last flushed
+        self._flushed = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return connect_to_redis()
+
+    @property
+    def gauges_key(self):
+        return f'{self.prefix}:gauges:{socket.gethostname()}:{os.getpid()}'
+
+    def start(self):
+        """
+        Start the flushing thread in this process if it isn't already running.
+        """
+        with self._lock:
+            if self.pid != os.getpid():
+                # counts flushed by the parent process aren't this process's
+                self._flushed = {}
+                threading.Thread(
+                    target=self._run, name='userdatasets-metrics', daemon=True
+                ).start()
+                self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to flush metrics')
+
+    def flush(self, families=None):
+        """
+        Add this process's counter increases to the shared totals and replace its
+        gauges.
+
+        :param families: the families returned by collect (optional, they are
+            collected if not given)
+        """
+        if families is None:
+            families = collect()
+        with self._lock:
+            flushed = {}
+            gauges = {}
+            increments = {}
+            for name, metric_type, _, samples in families:
+                for suffix, labels, value in samples:
+                    field = json.dumps([name, suffix, labels])
+                    if metric_type == 'gauge':
+                        gauges[field] = value
+                        continue
+                    last = self._flushed.get(field, 0)
+                    # a counter which has gone down has been reset, e.g. because its
+                    # cache was replaced, so all of its value is new
+                    delta = value - last if value >= last else value
+                    if delta:
+                        increments[field] = delta
+                    flushed[field] = value
+            gauges_key = self.gauges_key
+            try:
+                pipeline = self.client.pipeline(transaction=False)
+                for field, delta in increments.items():
+                    pipeline.hincrbyfloat(self.counters_key, field, delta)
+                pipeline.delete(gauges_key)
+                if gauges:
+                    pipeline.hset(gauges_key, mapping=gauges)
+                    pipeline.expire(gauges_key, max(1, int(self.flush_interval * 3)))
+                pipeline.execute()
+            except RedisError:
+                log.warning('Failed to flush metrics to Redis', exc_info=True)
+                return
+            self._flushed.update(flushed)
+
+    def aggregate(self, families):
+        """
+        Flush this process's metrics and replace their samples with the totals for all
+        the workers. If Redis can't be reached, the families are returned unchanged.
+
+        :param families: the families returned by collect
+        :returns: a list of families in the same form
+        """
+        self.flush(families)
+        totals = {}
+        try:
+            client = self.client
+            for field, value in client.hgetall(self.counters_key).items():
+                totals[field.decode('utf-8')] = float(value)
+            for key in client.scan_iter(match=f'{self.prefix}:gauges:*'):
+                for field, value in client.hgetall(key).items():
+                    field = field.decode('utf-8')
+                    totals[field] = totals.get(field, 0) + float(value)
+        except RedisError:
+            log.warning('Failed to read metrics from Redis', exc_info=True)
+            return families
+
+        samples_by_name = {}
+        for field, value in totals.items():
+            name, suffix, labels = json.loads(field)
+            samples_by_name.setdefault(name, {})[(suffix, labels)] = _number(value)
+        aggregated = []
+        for name, metric_type, description, samples in families:
+            shared = samples_by_name.get(name, {})
+            # keep this process's order, then add the samples only other workers have
+            order = [(suffix, labels) for suffix, labels, _ in samples]
+            order += sorted(set(shared) - set(order), key=_sample_order)
+            aggregated.append(
+                (
+                    name,
+                    metric_type,
+                    description,
+                    [
+                        (suffix, labels, shared[(suffix, labels)])
+                        for suffix, labels in order
+                        if (suffix, labels) in shared
+                    ],
+                )
+            )
+        return aggregated
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def _sample_order(sample):
+    # sorts histogram samples by their labels, then buckets by their bound
+    suffix, labels = sample
+    rest, _, bound = labels.partition(',le="')
+    bound = bound.rstrip('"')
+    return (
+        rest,
+        suffix != '_bucket',
+        float('inf') if bound in ('', '+Inf') else float(bound),
+        suffix,
+    )
+
+
+_metrics = None
+_shared = None
+
+
+def configure(config):
+    """
+    Set up the metrics using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _metrics, _shared
+    if toolkit.asbool(config.get('ckanext.userdatasets.metrics.enabled')):
+        _metrics = Metrics()
+    else:
+        _metrics = None
+    if _metrics is not None and toolkit.asbool(
+        config.get('ckanext.userdatasets.metrics.shared')
+    ):
+        site_id = config.get('ckan.site_id', 'default')
+        _shared = SharedMetrics(
+            f'ckanext-userdatasets:{site_id}:metrics',
+            toolkit.asint(
+                config.get('ckanext.userdatasets.metrics.flush_interval', 10)
+            ),
+        )
+    else:
+        _shared = None
+
+
+@atexit.register
+def _flush():
+    if _shared is not None and _shared.pid == os.getpid():
+        _shared.flush()
+
+
+def get_metrics():
+    """
+    Returns the Metrics, or None if metrics are disabled.
+    """
+    return _metrics
+
+
+def timed_action(name, function):
+    """
+    Wraps the given action so that its latency is recorded.
+
+    :param name: the name the action is registered under
+    :param function: the action function
+    :returns: the wrapped function
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _metrics is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _metrics.observe('action', name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def timed_auth(name, function):
+    """
+    Wraps the given auth function so that its latency and decisions are recorded. For
+    chained auth functions, calls which are passed on to the next auth function are
+    counted as NEXT rather than by the next function's decision.
+
+    :param name: the name the auth function is registered under
+    :param function: the auth function
+    :returns: the wrapped function
+    """
+
+    def timed(args, context, data_dict):
+        if _metrics is None:
+            return function(*args, context, data_dict)
+        outcome = ERROR
+        start = time.perf_counter()
+        try:
+            result = function(*args, context, data_dict)
+            if args and args[0].called:
+                outcome = NEXT
+            else:
+                outcome = ALLOW if result.get('success') else DENY
+            return result
+        finally:
+            _metrics.observe('auth', name, time.perf_counter() - start, outcome)
+
+    if getattr(function, 'chained_auth_function', False):
+
+        @functools.wraps(function)
+        def wrapper(next_auth, context, data_dict=None):
+            return timed((_TrackedNext(next_auth),), context, data_dict)
+
+    else:
+
+        @functools.wraps(function)
+        def wrapper(context, data_dict=None):
+            return timed((), context, data_dict)
+
+    return wrapper
+
+
+class _TrackedNext(object):
+    """
+    Wraps the next auth function in a chain to record whether it was called.
+    """
+
+    __slots__ = ('next_auth', 'called')
+
+    def __init__(self, next_auth):
+        self.next_auth = next_auth
+        self.called = False
+
+    def __call__(self, *args, **kwargs):
+        self.called = True
+        return self.next_auth(*args, **kwargs)
+
+
+def get_caches():
+    """
+    Find the caches which are currently enabled.
+
+    :returns: a dict of cache names -> LRUCaches
+    """
+    caches = {}
+    for name, cache in (
+        ('membership', get_membership_cache()),
+        ('org_list', get_org_list_cache()),
+        ('package', get_package_record_cache()),
+        ('negative', get_negative_cache()),
+    ):
+        # the redis membership cache is shared so it's up to redis to report on it
+        lru = getattr(cache, 'cache', None)
+        if lru is not None:
+            caches[name] = lru
+    return caches
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _family(families, name, metric_type, description, samples):
+    """
+    Add a metric family to the families.
+
+    :param families: the list of families to add to
+    :param name: the metric name
+    :param metric_type: the Prometheus metric type
+    :param description: the help text
+    :param samples: a list of (suffix, labels string, value) tuples
+    """
+    families.append((name, metric_type, description, samples))
+
+
+def render():
+    """
+    Renders all of the metrics in the Prometheus text exposition format. If the
+    metrics are shared, these are the totals for all the worker processes.
+
+    :returns: the metrics text
+    """
+    families = collect()
+    if _shared is not None:
+        families = _shared.aggregate(families)
+    lines = []
+    for name, metric_type, description, samples in families:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for suffix, labels, value in samples:
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{name}{suffix}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def collect():
+    """
+    Collects all of this process's metrics.
+
+    :returns: a list of (name, type, description, samples) families, where samples is
+        a list of (suffix, labels string, value) tuples
+    """
+    families = []
+    if _metrics is not None:
+        with _metrics._lock:
+            histograms = {
+                key: (list(histogram.counts), histogram.sum)
+                for key, histogram in _metrics.histograms.items()
+            }
+            decisions = dict(_metrics.decisions)
+        for kind, label, description in (
+            ('auth', 'function', 'Time taken by each auth function.'),
+            ('action', 'action', 'Time taken by each action.'),
+        ):
+            samples = []
+            for (histogram_kind, name), (counts, total) in sorted(histograms.items()):
+                if histogram_kind != kind:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    samples.append(
+                        ('_bucket', _labels(**{label: name, 'le': bound}), cumulative)
+                    )
+                samples.append(('_sum', _labels(**{label: name}), total))
+                samples.append(('_count', _labels(**{label: name}), cumulative))
+            _family(
+                families,
+                f'userdatasets_{kind}_duration_seconds',
+                'histogram',
+                description,
+                samples,
+            )
+        _family(
+            families,
+            'userdatasets_auth_decisions_total',
+            'counter',
+            'Auth function calls by outcome (allow, deny, next or error).',
+            [
+                ('', _labels(function=name, decision=outcome), count)
+                for (name, outcome), count in sorted(decisions.items())
+            ],
+        )
+
+    caches = get_caches()
+    for attribute, metric_type, description in (
+        ('hits', 'counter', 'Cache lookups which found a value.'),
+        ('misses', 'counter', 'Cache lookups which found nothing.'),
+        ('evictions', 'counter', 'Entries removed to keep caches within their size.'),
+    ):
+        _family(
+            families,
+            f'userdatasets_cache_{attribute}_total',
+            metric_type,
+            description,
+            [
+                ('', _labels(cache=name), getattr(cache, attribute))
+                for name, cache in sorted(caches.items())
+            ],
+        )
+    _family(
+        families,
+        'userdatasets_cache_entries',
+        'gauge',
+        'The number of entries in each cache.',
+        [
+            ('', _labels(cache=name), len(cache))
+            for name, cache in sorted(caches.items())
+        ],
+    )
+    negative = get_negative_cache()
+    if negative is not None:
+        _family(
+            families,
+            'userdatasets_negative_cache_avoided_queries_total',
+            'counter',
+            'Lookups of missing objects answered without a query.',
+            [('', '', negative.avoided)],
+        )
+    audit_log = get_audit_log()
+    if audit_log is not None:
+        for outcome, description in (
+            ('written', 'Audit events written.'),
+            ('dropped', 'Audit events dropped because the queue was full.'),
+        ):
+            _family(
+                families,
+                f'userdatasets_audit_events_{outcome}_total',
+                'counter',
+                description,
+                [('', '', getattr(audit_log, outcome))],
+            )
+    memo_totals = memo.get_totals()
+    for outcome, description in (
+        ('hits', 'Request memo lookups which found a value.'),
+        ('misses', 'Request memo lookups which found nothing.'),
+    ):
+        _family(
+            families,
+            f'userdatasets_request_memo_{outcome}_total',
+            'counter',
+            description,
+            [
+                ('', _labels(memo=name), count)
+                for (name, memo_outcome), count in sorted(memo_totals.items())
+                if memo_outcome == outcome
+            ],
+        )
+    return families
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from functools import partial
+
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import invalidation
+from ckanext.userdatasets.lib.cache import LRUCache
+
+# the types of object whose missing IDs are remembered
+PACKAGE = 'package'
+RESOURCE = 'resource'
+RESOURCE_VIEW = 'resource_view'
+# the prefix of the kind of invalidation event published when objects are created
+MISSING_EVENT = 'missing'
+
+
+class NegativeCache(object):
+    """
+    A per-process cache of the IDs of objects which were looked up and found not to
+    exist, so that repeated requests for them (from crawlers, broken clients, etc.)
+    don't each cost a database query.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        :param size: the maximum number of missing IDs to hold
+        :param ttl: the number of seconds to remember each missing ID for
+        """
+        self.cache = LRUCache(size, ttl)
+        # the number of database queries avoided by this cache
+        self.avoided = 0
+
+    def is_missing(self, object_type, ref):
+        """
+        Check whether the given object is known not to exist.
+
+        :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+        :param ref: the ID (or name, for packages) that was looked up
+        :returns: True if the object is known not to exist, False if it may exist
+        """
+        if self.cache.get((object_type, ref), False):
+            self.avoided += 1
+            return True
+        return False
+
+    def add(self, object_type, ref):
+        """
+        Record that the given object doesn't exist.
+
+        :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+        :param ref: the ID (or name, for packages) that was looked up
+        """
+        self.cache.set((object_type, ref), True)
+
+    def discard(self, object_type, *refs):
+        """
+        Forget that the given objects don't exist, e.g. because they've been created.
+
+        :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+        :param refs: the IDs (or names, for packages) of the objects
+        """
+        for ref in refs:
+            self.cache.pop((object_type, ref))
+
+    def clear(self):
+        """
+        Forget all the missing IDs.
+        """
+        self.cache.clear()
+
+
+_cache = None
+
+
+def configure(config):
+    """
+    Set up the negative cache using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _cache
+    if toolkit.asbool(config.get('ckanext.userdatasets.negative_cache.enabled')):
+        _cache = NegativeCache(
+            toolkit.asint(
+                config.get('ckanext.userdatasets.negative_cache.size', 10000)
+            ),
+            toolkit.asint(config.get('ckanext.userdatasets.negative_cache.ttl', 30)),
+        )
+    else:
+        _cache = None
+
+
+def get_negative_cache():
+    """
+    Returns the configured negative cache, or None if it is disabled. The cache is
+    brought up to date with the objects created by other processes first.
+    """
+    if _cache is not None:
+        invalidation.sync_invalidations()
+    return _cache
+
+
+def _apply(object_type, *refs):
+    if _cache is not None:
+        _cache.discard(object_type, *refs)
+
+
+def _reset():
+    if _cache is not None:
+        _cache.clear()
+
+
+for _object_type in (PACKAGE, RESOURCE, RESOURCE_VIEW):
+    invalidation.register(
+        f'{MISSING_EVENT}:{_object_type}', partial(_apply, _object_type), _reset
+    )
+
+
+def check_missing(object_type, ref):
+    """
+    Raise ObjectNotFound if the given object is known not to exist.
+
+    :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+    :param ref: the ID (or name, for packages) being looked up
+    """
+    cache = get_negative_cache()
+    if cache is not None and cache.is_missing(object_type, ref):
+        raise toolkit.ObjectNotFound
+
+
+def not_found(object_type, ref):
+    """
+    Record that the given object doesn't exist and return the exception to raise.
+
+    :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+    :param ref: the ID (or name, for packages) that was looked up
+    :returns: an ObjectNotFound exception
+    """
+    if _cache is not None:
+        _cache.add(object_type, ref)
+    return toolkit.ObjectNotFound()
+
+
+def discard_missing(object_type, *refs):
+    """
+    Forget that the given objects don't exist, in this process and every other. This
+    should be called whenever an object is created.
+
+    :param object_type: one of PACKAGE, RESOURCE or RESOURCE_VIEW
+    :param refs: the IDs (or names, for packages) of the objects
+    """
+    refs = [ref for ref in refs if ref]
+    if _cache is not None and refs:
+        _cache.discard(object_type, *refs)
+        invalidation.publish(f'{MISSING_EVENT}:{object_type}', *refs)
+
+
+def discard_missing_package(pkg_dict):
+    """
+    Forget that the given package, and any of its resources, don't exist. This should
+    be called whenever a package is created or updated (as updates can rename the
+    package and add resources).
+
+    :param pkg_dict: the package dict
+    """
+    if _cache is not None:
+        discard_missing(PACKAGE, pkg_dict.get('id'), pkg_dict.get('name'))
+        resources = pkg_dict.get('resources') or []
+        discard_missing(RESOURCE, *(resource.get('id') for resource in resources))
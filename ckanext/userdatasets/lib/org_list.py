@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from ckan import authz, model
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import invalidation
+from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+from ckanext.userdatasets.lib.cache import LRUCache
+
+# the kind of invalidation event published when all the lists are cleared
+ORG_LISTS_EVENT = 'org_lists'
+
+
+class OrgListCache(object):
+    """
+    A per-process cache of the results of organization_list_for_user.
+
+    Entries are keyed on the user (name or ID, as passed to the action), whether they
+    are a sysadmin, the permission, and the options which change the shape of the
+    result.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        :param size: the maximum number of lists to hold
+        :param ttl: the number of seconds to hold each list for
+        """
+        self.cache = LRUCache(size, ttl)
+
+    def get(self, key, default=None):
+        """
+        Retrieve a cached organisation list. A copy of the list is returned so that the
+        caller can modify it.
+
+        :param key: the cache key, the first element of which must be the user
+        :param default: the value to return if the list isn't cached
+        :returns: the list of organisation dicts or the default
+        """
+        orgs = self.cache.get(key, None)
+        if orgs is None:
+            return default
+        return [dict(org) for org in orgs]
+
+    def set(self, key, orgs):
+        """
+        Cache an organisation list. A copy of the list is stored so that the caller can
+        modify the original.
+
+        :param key: the cache key, the first element of which must be the user
+        :param orgs: the list of organisation dicts
+        """
+        self.cache.set(key, [dict(org) for org in orgs])
+
+    def invalidate_user(self, *user_refs):
+        """
+        Remove all cached lists for the user.
+
+        :param user_refs: the names and/or IDs the user might have been cached under
+        """
+        user_refs = set(user_refs)
+        self.cache.invalidate(lambda key: key[0] in user_refs)
+
+    def clear(self):
+        """
+        Remove all cached lists.
+        """
+        self.cache.clear()
+
+
+_cache = None
+
+
+def configure(config):
+    """
+    Set up the organisation list cache using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _cache
+    if toolkit.asbool(config.get('ckanext.userdatasets.org_list_cache.enabled')):
+        _cache = OrgListCache(
+            toolkit.asint(config.get('ckanext.userdatasets.org_list_cache.size', 1000)),
+            toolkit.asint(config.get('ckanext.userdatasets.org_list_cache.ttl', 60)),
+        )
+    else:
+        _cache = None
+
+
+def get_org_list_cache():
+    """
+    Returns the configured organisation list cache, or None if it is disabled. The
+    cache is brought up to date with the invalidations made by other processes first.
+    """
+    if _cache is not None:
+        invalidation.sync_invalidations()
+    return _cache
+
+
+def _reset(*refs):
+    if _cache is not None:
+        _cache.clear()
+
+
+def _apply_user(*user_refs):
+    if _cache is not None:
+        _cache.invalidate_user(*user_refs)
+
+
+invalidation.register(ORG_LISTS_EVENT, _reset, _reset)
+invalidation.register(invalidation.USER_EVENT, _apply_user, _reset)
+
+
+def clear_org_lists():
+    """
+    Forget all cached organisation lists, in this process and every other. This should
+    be called whenever an organisation is created, changed, or deleted, as this can
+    affect every user's list (sysadmins see every organisation, and the hierarchy
+    affects cascading roles).
+    """
+    # organisation changes can also affect the auth decisions made in this request
+    clear_auth_memo()
+    if _cache is not None:
+        _cache.clear()
+        invalidation.publish(ORG_LISTS_EVENT)
+
+
+def query_organisations_for_user(user, permission):
+    """
+    Finds the organisations in which the given user has the given permission, in the
+    same way as organization_list_for_user but returning only each organisation's ID
+    and name rather than fully dictizing each one.
+
+    :param user: the user's name or ID
+    :param permission: the permission to check for
+    :returns: a list of dicts with id and name keys, ordered by name
+    """
+    orgs_q = model.Session.query(model.Group.id, model.Group.name).filter(
+        model.Group.is_organization == True,  # noqa: E712
+        model.Group.state == 'active',
+    )
+    user_obj = model.User.get(user)
+    if user_obj is None:
+        return []
+    if not authz.is_sysadmin(user_obj.name):
+        roles = authz.get_roles_with_permission(permission)
+        if not roles:
+            return []
+        memberships = (
+            model.Session.query(model.Member.capacity, model.Group)
+            .join(model.Group, model.Group.id == model.Member.group_id)
+            .filter(
+                model.Member.table_name == 'user',
+                model.Member.capacity.in_(roles),
+                model.Member.table_id == user_obj.id,
+                model.Member.state == 'active',
+            )
+        )
+        roles_that_cascade = authz.check_config_permission(
+            'roles_that_cascade_to_sub_groups'
+        )
+        group_ids = set()
+        for capacity, group in memberships:
+            group_ids.add(group.id)
+            if capacity in roles_that_cascade:
+                group_ids.update(
+                    child[0]
+                    for child in group.get_children_group_hierarchy(type='organization')
+                )
+        if not group_ids:
+            return []
+        orgs_q = orgs_q.filter(model.Group.id.in_(group_ids))
+    return [
+        {'id': org_id, 'name': name}
+        for org_id, name in orgs_q.order_by(model.Group.name)
+    ]
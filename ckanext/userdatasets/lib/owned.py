@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import base64
+import json
+from datetime import datetime
+
+from ckan import model
+from sqlalchemy import and_, or_
+
+from ckanext.userdatasets.logic.utils import VALID_ROLES
+
+# the fields returned for each package if none are requested
+DEFAULT_FIELDS = ('id', 'name', 'metadata_modified')
+# the fields which can be requested, mapped to the package columns they come from
+FIELDS = {
+    'id': model.Package.id,
+    'name': model.Package.name,
+    'metadata_modified': model.Package.metadata_modified,
+    'title': model.Package.title,
+    'owner_org': model.Package.owner_org,
+    'private': model.Package.private,
+    'type': model.Package.type,
+}
+# the format of the timestamp in a cursor, which unlike isoformat always includes the
+# microseconds
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(modified, package_id):
+    """
+    Creates an opaque cursor pointing just after the given package in the listing.
+
+    :param modified: the package's metadata_modified datetime
+    :param package_id: the package's ID
+    :returns: the cursor string
+    """
+    position = json.dumps([modified.strftime(CURSOR_TIME_FORMAT), package_id])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Reads a cursor created by encode_cursor.
+
+    :param cursor: the cursor string
+    :returns: a (metadata_modified datetime, package ID) tuple
+    :raises ValueError: if the cursor isn't valid
+    """
+    try:
+        modified, package_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.strptime(modified, CURSOR_TIME_FORMAT), str(package_id)
+    except (TypeError, ValueError) as e:
+        # binascii.Error and json.JSONDecodeError are both ValueErrors
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+
+def build_owned_packages_query(
+    user, owner_org_id=None, fields=DEFAULT_FIELDS, limit=100, cursor=None
+):
+    """
+    Creates the query query_owned_packages runs. Each row holds the package's
+    metadata_modified and ID followed by the requested fields, and one more row than
+    the limit is requested to find out whether there's another page.
+
+    :param user: A user object
+    :param owner_org_id: the ID of an organisation to limit the packages to (optional)
+    :param fields: the FIELDS to include for each package
+    :param limit: the maximum number of packages to return
+    :param cursor: the next_cursor returned with the previous page (optional)
+    :returns: the query
+    :raises ValueError: if the cursor isn't valid
+    """
+    modified = model.Package.metadata_modified
+    query = (
+        model.Session.query(modified, model.Package.id, *(FIELDS[f] for f in fields))
+        .join(
+            model.Member,
+            and_(
+                model.Member.group_id == model.Package.owner_org,
+                model.Member.table_name == 'user',
+                model.Member.table_id == user.id,
+                model.Member.state == 'active',
+                model.Member.capacity.in_(VALID_ROLES),
+            ),
+        )
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Package.creator_user_id == user.id,
+            model.Package.state == 'active',
+            model.Group.is_organization == True,  # noqa: E712
+            model.Group.state == 'active',
+        )
+    )
+    if owner_org_id is not None:
+        query = query.filter(model.Package.owner_org == owner_org_id)
+    if cursor is not None:
+        last_modified, last_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                modified < last_modified,
+                and_(modified == last_modified, model.Package.id < last_id),
+            )
+        )
+    # fetch one more than needed to find out whether there's another page
+    return query.order_by(modified.desc(), model.Package.id.desc()).limit(limit + 1)
+
+
+def query_owned_packages(
+    user, owner_org_id=None, fields=DEFAULT_FIELDS, limit=100, cursor=None
+):
+    """
+    Finds the active packages the user owns under the userdatasets rules, i.e. the ones
+    they created in an organisation they're currently a member, editor or admin of.
+
+    The packages are ordered from the most recently modified and paged with a keyset
+    cursor on (metadata_modified, id), so each page costs the same however far into
+    the listing it is, and packages modified while the listing is being paged through
+    don't shift the pages which follow.
+
+    :param user: A user object
+    :param owner_org_id: the ID of an organisation to limit the packages to (optional)
+    :param fields: the FIELDS to include for each package
+    :param limit: the maximum number of packages to return
+    :param cursor: the next_cursor returned with the previous page (optional)
+    :returns: a (list of package dicts, next cursor or None) tuple
+    :raises ValueError: if the cursor isn't valid
+    """
+    rows = list(build_owned_packages_query(user, owner_org_id, fields, limit, cursor))
+
+    packages = []
+    for row in rows[:limit]:
+        package = dict(zip(fields, row[2:]))
+        if package.get('metadata_modified') is not None:
+            package['metadata_modified'] = package['metadata_modified'].isoformat()
+        packages.append(package)
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(*rows[limit - 1][:2])
+    return packages, next_cursor
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from collections import namedtuple
+
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import invalidation
+from ckanext.userdatasets.lib.cache import LRUCache
+
+# the kind of invalidation event published when packages change
+PACKAGE_EVENT = 'package'
+
+
+class PackageRecord(
+    namedtuple('PackageRecord', ['id', 'name', 'owner_org', 'creator_user_id'])
+):
+    """
+    The only details of a package the auth functions need to decide whether a user
+    owns it. This is a lot smaller than a Package object and isn't tied to a session.
+    """
+
+    __slots__ = ()
+
+
+class PackageRecordCache(object):
+    """
+    A per-process cache of PackageRecords. Each record is stored under both the
+    package's ID and its name, as either can be passed to the actions.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        :param size: the maximum number of records to hold (each record takes two
+            entries, one for the ID and one for the name)
+        :param ttl: the number of seconds to hold each record for
+        """
+        self.cache = LRUCache(size * 2, ttl)
+
+    def get(self, package_id_or_name):
+        """
+        Retrieve the record for the given package.
+
+        :param package_id_or_name: the package's ID or name
+        :returns: a PackageRecord or None if it isn't cached
+        """
+        return self.cache.get(package_id_or_name)
+
+    def set(self, record):
+        """
+        Cache the given record under the package's ID and name.
+
+        :param record: a PackageRecord
+        """
+        self.cache.set(record.id, record)
+        if record.name:
+            self.cache.set(record.name, record)
+
+    def invalidate(self, *package_ids_or_names):
+        """
+        Remove the records for the given packages. Both the ID and name the record was
+        stored under are removed, even if only one of them is passed.
+
+        :param package_ids_or_names: the IDs and/or names of the packages
+        """
+        for ref in package_ids_or_names:
+            record = self.cache.pop(ref)
+            if record is not None:
+                self.cache.pop(record.id)
+                self.cache.pop(record.name)
+
+    def clear(self):
+        """
+        Remove all cached records.
+        """
+        self.cache.clear()
+
+
+_cache = None
+
+
+def configure(config):
+    """
+    Set up the package record cache using the options in the given CKAN config.
+
+    :param config: the CKAN config
+    """
+    global _cache
+    if toolkit.asbool(config.get('ckanext.userdatasets.package_cache.enabled')):
+        _cache = PackageRecordCache(
+            toolkit.asint(config.get('ckanext.userdatasets.package_cache.size', 10000)),
+            toolkit.asint(config.get('ckanext.userdatasets.package_cache.ttl', 300)),
+        )
+    else:
+        _cache = None
+
+
+def get_package_record_cache():
+    """
+    Returns the configured package record cache, or None if it is disabled. The cache
+    is brought up to date with the invalidations made by other processes first.
+    """
+    if _cache is not None:
+        invalidation.sync_invalidations()
+    return _cache
+
+
+def _apply(*refs):
+    if _cache is not None:
+        _cache.invalidate(*refs)
+
+
+def _reset():
+    if _cache is not None:
+        _cache.clear()
+
+
+invalidation.register(PACKAGE_EVENT, _apply, _reset)
+
+
+def invalidate_packages(*package_ids_or_names):
+    """
+    Forget the cached records for the given packages, in this process and every other.
+
+    :param package_ids_or_names: the IDs and/or names of the packages
+    """
+    if _cache is not None and package_ids_or_names:
+        _cache.invalidate(*package_ids_or_names)
+        invalidation.publish(PACKAGE_EVENT, *package_ids_or_names)
+
+
+def invalidate_package(pkg_dict):
+    """
+    Forget the cached record for the given package, in this process and every other.
+    This should be called whenever a package is created, updated, or deleted.
+
+    :param pkg_dict: the package dict (or data dict) passed to the action, which must
+        include at least one of the package's ID or name
+    """
+    refs = [pkg_dict.get(key) for key in ('id', 'name')]
+    invalidate_packages(*(ref for ref in refs if ref))
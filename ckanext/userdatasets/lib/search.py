@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from ckan import authz, model
+from ckan.plugins import toolkit
+from flask import has_app_context
+
+from ckanext.userdatasets.logic.auth.batch import BatchDecider
+from ckanext.userdatasets.logic.utils import VALID_ROLES, remember_role
+
+# the search parameter which limits results to the datasets the user can edit
+EDITABLE_PARAM = 'editable_by_me'
+# a filter query which matches nothing
+MATCH_NOTHING = '-*:*'
+
+
+def ensure_index_fields(pkg_dict):
+    """
+    Makes sure the creator_user_id and owner_org fields are in the dict being indexed
+    so that the editable_by_me filter can use them. They're part of the default
+    package schema but a custom schema may drop them.
+
+    :param pkg_dict: the dict about to be sent to Solr
+    :returns: the dict
+    """
+    if 'creator_user_id' not in pkg_dict or 'owner_org' not in pkg_dict:
+        package = model.Package.get(pkg_dict['id'])
+        if package is not None:
+            pkg_dict.setdefault('creator_user_id', package.creator_user_id)
+            pkg_dict.setdefault('owner_org', package.owner_org)
+    return pkg_dict
+
+
+def build_org_roles_query(user):
+    """
+    Creates the query get_org_roles runs.
+
+    :param user: A user object
+    :returns: a query for (organisation ID, role name) rows
+    """
+    return (
+        model.Session.query(model.Member.group_id, model.Member.capacity)
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Member.table_name == 'user',
+            model.Member.table_id == user.id,
+            model.Member.state == 'active',
+            model.Group.is_organization == True,  # noqa: E712
+            model.Group.state == 'active',
+        )
+    )
+
+
+def get_org_roles(user):
+    """
+    Retrieve the user's role in each of the organisations they belong to, in one query.
+
+    :param user: A user object
+    :returns: a dict of organisation IDs -> role names
+    """
+    roles = {}
+    for org_id, role in build_org_roles_query(user):
+        roles[org_id] = role
+        remember_role(org_id, user.name, role)
+    return roles
+
+
+def get_collaborations(user):
+    """
+    Retrieve the IDs of the packages the user can edit as a collaborator.
+
+    :param user: A user object
+    :returns: a list of package IDs
+    """
+    query = model.Session.query(model.PackageMember.package_id).filter(
+        model.PackageMember.user_id == user.id,
+        model.PackageMember.capacity.in_(('admin', 'editor')),
+    )
+    return [package_id for (package_id,) in query]
+
+
+def _terms(values):
+    return ' OR '.join(f'"{value}"' for value in sorted(values))
+
+
+def build_editable_filter(user):
+    """
+    Creates a Solr filter query which matches the datasets the given user can edit.
+
+    The filter follows the same rules as the package_update auth function, so a
+    dataset matches if any of these are true:
+
+        - the user created it and is a member of its organisation
+        - the user is an editor or admin of its organisation
+        - the user is an editor or admin collaborator on it
+        - it has no organisation and CKAN allows the user to edit such datasets
+
+    :param user: A user object, or None for anonymous users
+    :returns: a filter query string, or None if the user can edit every dataset
+    """
+    if user is None or user.is_deleted():
+        return MATCH_NOTHING
+    if authz.is_sysadmin(user.name):
+        return None
+
+    roles = get_org_roles(user)
+    update_roles = authz.get_roles_with_permission('update_dataset')
+    member_orgs = [org_id for org_id, role in roles.items() if role in VALID_ROLES]
+    editor_orgs = [org_id for org_id, role in roles.items() if role in update_roles]
+
+    clauses = []
+    if member_orgs:
+        clauses.append(
+            f'(creator_user_id:"{user.id}" AND owner_org:({_terms(member_orgs)}))'
+        )
+    if editor_orgs:
+        clauses.append(f'owner_org:({_terms(editor_orgs)})')
+    if authz.check_config_permission('allow_dataset_collaborators'):
+        collaborations = get_collaborations(user)
+        if collaborations:
+            clauses.append(f'id:({_terms(collaborations)})')
+    decider = BatchDecider(user, {})
+    if decider.can_create_unowned or decider.can_create_in_some_org:
+        clauses.append('(*:* -owner_org:[* TO *])')
+
+    if not clauses:
+        return MATCH_NOTHING
+    return ' OR '.join(clauses)
+
+
+def apply_editable_filter(search_params):
+    """
+    If the editable_by_me parameter is set, replaces it with a filter query limiting
+    the results to the datasets the current user can edit. The parameter can be passed
+    as editable_by_me or, from the dataset search page, as ext_editable_by_me.
+
+    :param search_params: the package_search parameters
+    :returns: the search parameters
+    """
+    extras = search_params.get('extras') or {}
+    value = search_params.pop(EDITABLE_PARAM, None)
+    if value is None:
+        value = extras.pop(f'ext_{EDITABLE_PARAM}', None)
+    if not toolkit.asbool(value):
+        return search_params
+
+    user = getattr(toolkit.g, 'userobj', None) if has_app_context() else None
+    fq = build_editable_filter(user)
+    if fq is not None:
+        search_params['fq'] = f'{search_params.get("fq", "")} +({fq})'.strip()
+    # the user's private datasets are editable too (permission labels still apply)
+    search_params.setdefault('include_private', True)
+    return search_params
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+
+from ckan import model
+
+from ckanext.userdatasets.lib.snapshot import (
+    ROLE_BITS,
+    ROLE_MASK,
+    ROLES,
+    load_snapshot,
+)
+
+log = logging.getLogger('ckanext.userdatasets')
+
+MAGIC = b'UDSNAP02'
+# magic, generation, the time the build started, number of user keys, number of
+# organisation keys, number of users, number of memberships
+HEADER = struct.Struct('=8sQdIIII')
+# generation
+CONTROL = struct.Struct('=Q')
+# the minimum number of seconds between attempts to start a rebuild in one process
+BUILD_RETRY_INTERVAL = 1
+
+CONTROL_FILE = 'control'
+LOCK_FILE = 'build.lock'
+SNAPSHOT_FILE = 'snapshot-{}'
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _hash(key):
+    return zlib.crc32(key.encode('utf-8'))
+
+
+def _key_sections(refs):
+    """
+    Creates the sections of a key table, which maps strings to indexes. The keys are
+    sorted by their hash so that they can be found with a binary search, and the keys
+    themselves are stored so that hash collisions can be resolved.
+
+    :param refs: a dict of string keys -> indexes
+    :returns: a list of the sections (hashes, indexes, string offsets and strings)
+    """
+    entries = sorted(
+        (_hash(key), key.encode('utf-8'), index) for key, index in refs.items()
+    )
+    offsets = array('I', [0])
+    for _, key, _ in entries:
+        offsets.append(offsets[-1] + len(key))
+    return [
+        array('I', (entry[0] for entry in entries)).tobytes(),
+        array('I', (entry[2] for entry in entries)).tobytes(),
+        offsets.tobytes(),
+        b''.join(entry[1] for entry in entries),
+    ]
+
+
+def write_snapshot(snapshot, path, generation, built_at):
+    """
+    Write the given snapshot to a file in the format read by MappedSnapshot.
+
+    :param snapshot: a MembershipSnapshot
+    :param path: the path to write to
+    :param generation: the snapshot's generation
+    :param built_at: the time (as returned by time.time) the snapshot's data was read
+        from the database
+    """
+    member_offsets = array('I', [0])
+    members = array('I')
+    for memberships in snapshot.memberships:
+        members.extend(memberships)
+        member_offsets.append(len(members))
+    sections = [
+        *_key_sections(snapshot.users),
+        *_key_sections(snapshot.orgs),
+        member_offsets.tobytes(),
+        members.tobytes(),
+    ]
+    with open(path, 'wb') as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                generation,
+                built_at,
+                len(snapshot.users),
+                len(snapshot.orgs),
+                len(snapshot.memberships),
+                len(members),
+            )
+        )
+        for section in sections:
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class _KeyTable(object):
+    """
+    A read-only view of a key table written by _key_sections.
+    """
+
+    def __init__(self, view, offset, count):
+        self.hashes, offset = _section(view, offset, count)
+        self.indexes, offset = _section(view, offset, count)
+        self.offsets, offset = _section(view, offset, count + 1)
+        offset = _align(offset)
+        end = offset + self.offsets[count]
+        self.strings = view[offset:end]
+        self.end = end
+
+    def get(self, key):
+        if not isinstance(key, str):
+            return None
+        key_hash = _hash(key)
+        encoded = key.encode('utf-8')
+        position = bisect_left(self.hashes, key_hash)
+        while position < len(self.hashes) and self.hashes[position] == key_hash:
+            start, end = self.offsets[position], self.offsets[position + 1]
+            if self.strings[start:end] == encoded:
+                return self.indexes[position]
+            position += 1
+        return None
+
+
+def _section(view, offset, count):
+    offset = _align(offset)
+    end = offset + count * 4
+    return view[offset:end].cast('I'), end
+
+
+class MappedSnapshot(object):
+    """
+    A membership snapshot read directly from a memory-mapped file, so that every
+    worker process on a server shares the same copy of it. Lookups behave in the same
+    way as MembershipSnapshot.get_role.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path of a file written by write_snapshot
+        """
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        (
+            magic,
+            self.generation,
+            self.built_at,
+            user_keys,
+            org_keys,
+            users,
+            members,
+        ) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a membership snapshot')
+        self.users = _KeyTable(view, HEADER.size, user_keys)
+        self.orgs = _KeyTable(view, self.users.end, org_keys)
+        self.member_offsets, offset = _section(view, self.orgs.end, users + 1)
+        self.members, _ = _section(view, offset, members)
+
+    def get_role(self, org_ref, user_ref, default=None):
+        """
+        Look up the user's role in the organisation.
+
+        :param org_ref: the organisation's ID or name
+        :param user_ref: the user's ID or name
+        :param default: returned if the user or organisation isn't in the snapshot
+        :returns: the role name, None if the user has no role, or the default
+        """
+        user_index = self.users.get(user_ref)
+        org_index = self.orgs.get(org_ref)
+        if user_index is None or org_index is None:
+            return default
+        start = self.member_offsets[user_index]
+        end = self.member_offsets[user_index + 1]
+        position = bisect_left(self.members, org_index << ROLE_BITS, start, end)
+        if position < end and self.members[position] >> ROLE_BITS == org_index:
+            return ROLES[(self.members[position] & ROLE_MASK) - 1]
+        return None
+
+    def __len__(self):
+        return len(self.members)
+
+
+class OverriddenSnapshot(object):
+    """
+    A view of a snapshot which doesn't answer lookups for the users and organisations
+    which have changed since it was built, so that they fall back to the database.
+    """
+
+    def __init__(self, snapshot, users, orgs):
+        """
+        :param snapshot: a MappedSnapshot
+        :param users: the names and/or IDs of the users which have changed
+        :param orgs: the names and/or IDs of the organisations which have changed
+        """
+        self.snapshot = snapshot
+        self.users = users
+        self.orgs = orgs
+
+    def get_role(self, org_ref, user_ref, default=None):
+        """
+        Look up the user's role in the organisation.
+
+        :param org_ref: the organisation's ID or name
+        :param user_ref: the user's ID or name
+        :param default: returned if the user or organisation isn't in the snapshot or
+            has changed since it was built
+        :returns: the role name, None if the user has no role, or the default
+        """
+        if user_ref in self.users or org_ref in self.orgs:
+            return default
+        return self.snapshot.get_role(org_ref, user_ref, default)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+
+class SharedSnapshotManager(object):
+    """
+    Keeps a snapshot in a directory shared by all the worker processes on a server.
+
+    The directory holds a control file containing the current snapshot's generation,
+    and one file per snapshot generation. Each worker maps the control file and checks
+    it on every lookup, which is just a memory read, and maps a new snapshot file
+    whenever the generation changes.
+
+    Snapshots are never built on the request path. When users' memberships change (in
+    any process, see the invalidation module), each worker stops answering lookups for
+    those users from the current snapshot, so that they fall back to the database,
+    while the other users are still answered from it. A new snapshot is then built in a
+    background thread by whichever worker gets the build lock first, and each worker
+    drops the overrides which are older than the build once it has been published.
+    Expired snapshots are replaced in the same way, and are used until they are.
+    """
+
+    def __init__(self, directory, refresh_interval, clock=time.time):
+        """
+        :param directory: the directory to keep the snapshot files in
+        :param refresh_interval: the number of seconds between full reloads, if this
+            is 0 or less the snapshot is only rebuilt when memberships change
+        :param clock: the function used to get the current time, which must match
+            between the workers (optional)
+        """
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.snapshot = None
+        # user and organisation refs -> the time they were marked as changed
+        self.dirty_users = {}
+        self.dirty_orgs = {}
+        # snapshots built before this time aren't used at all
+        self.distrust_before = 0
+        os.makedirs(directory, exist_ok=True)
+        self._control_path = os.path.join(directory, CONTROL_FILE)
+        self._lock_path = os.path.join(directory, LOCK_FILE)
+        self._control = None
+        self._lock = threading.Lock()
+        self._builder = None
+        self._last_attempt = None
+
+    def _path(self, generation):
+        return os.path.join(self.directory, SNAPSHOT_FILE.format(generation))
+
+    def _open_control(self):
+        if self._control is None:
+            fd = os.open(self._control_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size < CONTROL.size:
+                    os.ftruncate(fd, CONTROL.size)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                self._control = mmap.mmap(fd, CONTROL.size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        return self._control
+
+    def _read_generation(self):
+        return CONTROL.unpack_from(self._open_control())[0]
+
+    def _map(self, generation):
+        if not generation or (
+            self.snapshot is not None and self.snapshot.generation == generation
+        ):
+            return
+        try:
+            snapshot = MappedSnapshot(self._path(generation))
+        except FileNotFoundError:
+            # a newer generation has already replaced it
+            return
+        except ValueError:
+            log.warning('Ignoring unreadable membership snapshot', exc_info=True)
+            return
+        with self._lock:
+            self.snapshot = snapshot
+            # anything which changed before the build started is in the snapshot
+            self.dirty_users = {
+                ref: at
+                for ref, at in self.dirty_users.items()
+                if at >= snapshot.built_at
+            }
+            self.dirty_orgs = {
+                ref: at
+                for ref, at in self.dirty_orgs.items()
+                if at >= snapshot.built_at
+            }
+
+    def _needs_build(self):
+        return (
+            self.snapshot is None
+            or self.snapshot.built_at < self.distrust_before
+            or bool(self.dirty_users)
+            or bool(self.dirty_orgs)
+            or (
+                self.refresh_interval > 0
+                and self.clock() - self.snapshot.built_at >= self.refresh_interval
+            )
+        )
+
+    def get_snapshot(self):
+        """
+        Returns the current snapshot, starting a rebuild in the background first if
+        it's out of date. Lookups for the users and organisations which have changed
+        since the snapshot was built return the default.
+
+        :returns: a MappedSnapshot or OverriddenSnapshot, or None if there isn't a
+            snapshot which can be used
+        """
+        self._map(self._read_generation())
+        if self._needs_build():
+            self._start_build()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.built_at < self.distrust_before:
+            return None
+        if self.dirty_users or self.dirty_orgs:
+            return OverriddenSnapshot(snapshot, self.dirty_users, self.dirty_orgs)
+        return snapshot
+
+    def _start_build(self):
+        with self._lock:
+            now = time.monotonic()
+            if (self._builder is not None and self._builder.is_alive()) or (
+                self._last_attempt is not None
+                and now - self._last_attempt < BUILD_RETRY_INTERVAL
+            ):
+                return
+            self._last_attempt = now
+            self._builder = threading.Thread(
+                target=self._build_in_background,
+                name='userdatasets-snapshot-build',
+                daemon=True,
+            )
+            self._builder.start()
+
+    def _build_in_background(self):
+        try:
+            self._build()
+        except Exception:
+            log.exception('Failed to build the membership snapshot')
+        finally:
+            # the thread has its own database session
+            model.Session.remove()
+
+    def _build(self):
+        with open(self._lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another worker is rebuilding it, the next lookup will try again if
+                # that build started before the latest changes
+                return
+            generation = self._read_generation()
+            self._map(generation)
+            if not self._needs_build():
+                return
+            start = time.perf_counter()
+            built_at = self.clock()
+            snapshot = load_snapshot()
+            generation += 1
+            path = self._path(generation)
+            write_snapshot(snapshot, f'{path}.tmp', generation, built_at)
+            os.replace(f'{path}.tmp', path)
+            self._write_generation(generation)
+            log.info(
+                'Published membership snapshot generation %d with %d memberships in '
+                '%.2fs',
+                generation,
+                len(snapshot),
+                time.perf_counter() - start,
+            )
+            # workers still using the previous generation keep their mapping after
+            # the file is removed, but keep it anyway for workers about to map it
+            for name in os.listdir(self.directory):
+                if name.startswith(SNAPSHOT_FILE.format('')) and name not in (
+                    SNAPSHOT_FILE.format(generation),
+                    SNAPSHOT_FILE.format(generation - 1),
+                ):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _write_generation(self, generation):
+        self._open_control()
+        fd = os.open(self._control_path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.pwrite(fd, CONTROL.pack(generation), 0)
+        finally:
+            os.close(fd)
+
+    def mark_dirty(self, *user_refs):
+        """
+        Stop answering lookups for the given users from the current snapshot because
+        their memberships have changed, until a snapshot built after the change is
+        published.
+
+        :param user_refs: the users' names and/or IDs
+        """
+        with self._lock:
+            now = self.clock()
+            self.dirty_users = {**self.dirty_users, **dict.fromkeys(user_refs, now)}
+
+    def discard_orgs(self, *org_refs):
+        """
+        Stop answering lookups for the given organisations from the current snapshot
+        because they've been renamed or purged, until a snapshot built after the change
+        is published.
+
+        :param org_refs: the organisations' names and/or IDs
+        """
+        with self._lock:
+            now = self.clock()
+            self.dirty_orgs = {**self.dirty_orgs, **dict.fromkeys(org_refs, now)}
+
+    def reset(self):
+        """
+        Stop using the current snapshot until one built after now is published. This
+        is used when some of the changes made by other processes may have been missed.
+        """
+        self.distrust_before = self.clock()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import invalidation
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the roles held in the snapshot, each is stored as its position in this tuple plus 1 so
+# that 0 can mean no role
+ROLES = ('member', 'editor', 'admin')
+ROLE_CODES = {role: code for code, role in enumerate(ROLES, start=1)}
+# the number of bits used to store the role code in each packed membership
+ROLE_BITS = 2
+ROLE_MASK = (1 << ROLE_BITS) - 1
+# the kind of invalidation event published when organisations are renamed or removed
+ORG_EVENT = 'snapshot_orgs'
+
+_no_memberships = array('I')
+
+
+class MembershipSnapshot(object):
+    """
+    A compact in-memory copy of the active user memberships of every organisation.
+
+    User and organisation IDs (and names) are interned to small integers. Each user's
+    memberships are then held in a sorted array of unsigned ints, each packing an
+    organisation's index and the role code, so a lookup is two dict lookups and a
+    binary search over the (usually very short) array.
+
+    Lookups for users or organisations the snapshot doesn't know about return the
+    given default, so that the caller can fall back to the database.
+    """
+
+    def __init__(self):
+        # user ID/name -> user index
+        self.users = {}
+        # organisation ID/name -> organisation index
+        self.orgs = {}
+        # user index -> array of packed memberships
+        self.memberships = []
+        self._org_count = 0
+
+    def _intern_user(self, user_id, name=None):
+        index = self.users.get(user_id)
+        if index is None:
+            index = len(self.memberships)
+            self.memberships.append(_no_memberships)
+            self.users[user_id] = index
+        if name:
+            self.users[name] = index
+        return index
+
+    def _intern_org(self, org_id, name=None):
+        index = self.orgs.get(org_id)
+        if index is None:
+            index = self._org_count
+            self._org_count += 1
+            self.orgs[org_id] = index
+        if name:
+            self.orgs[name] = index
+        return index
+
+    def add_users(self, users):
+        """
+        Add users to the snapshot.
+
+        :param users: an iterable of (id, name) tuples
+        """
+        for user_id, name in users:
+            self._intern_user(user_id, name)
+
+    def add_orgs(self, orgs):
+        """
+        Add organisations to the snapshot.
+
+        :param orgs: an iterable of (id, name) tuples
+        """
+        for org_id, name in orgs:
+            self._intern_org(org_id, name)
+
+    def set_memberships(self, rows, user_ids=None):
+        """
+        Replace the memberships of the users in the given rows (and of the given users,
+        if passed, which allows a user's last membership to be removed).
+
+        :param rows: an iterable of (user ID, organisation ID, role) tuples, roles
+            which aren't in ROLES are ignored
+        :param user_ids: the IDs of the users being refreshed (optional)
+        """
+        packed = {}
+        for user_id in user_ids or ():
+            packed[self._intern_user(user_id)] = set()
+        for user_id, org_id, role in rows:
+            code = ROLE_CODES.get(role)
+            if code is None:
+                continue
+            user_index = self._intern_user(user_id)
+            org_index = self._intern_org(org_id)
+            packed.setdefault(user_index, set()).add((org_index << ROLE_BITS) | code)
+        for user_index, values in packed.items():
+            # replacing the whole array means lookups in other threads see either the
+            # old or the new memberships, never a mix
+            self.memberships[user_index] = array('I', sorted(values))
+
+    def get_role(self, org_ref, user_ref, default=None):
+        """
+        Look up the user's role in the organisation.
+
+        :param org_ref: the organisation's ID or name
+        :param user_ref: the user's ID or name
+        :param default: returned if the user or organisation isn't in the snapshot
+        :returns: the role name, None if the user has no role, or the default
+        """
+        user_index = self.users.get(user_ref)
+        org_index = self.orgs.get(org_ref)
+        if user_index is None or org_index is None:
+            return default
+        memberships = self.memberships[user_index]
+        start = org_index << ROLE_BITS
+        position = bisect_left(memberships, start)
+        if position < len(memberships) and memberships[position] >> ROLE_BITS == (
+            org_index
+        ):
+            return ROLES[(memberships[position] & ROLE_MASK) - 1]
+        return None
+
+    def discard_orgs(self, *org_refs):
+        """
+        Remove the given organisations from the snapshot so that lookups for them
+        return the default. Their packed memberships are left in place but can no
+        longer be reached.
+
+        :param org_refs: the organisations' names and/or IDs
+        """
+        indexes = {self.orgs.get(ref) for ref in org_refs} - {None}
+        for ref in [ref for ref, index in self.orgs.items() if index in indexes]:
+            del self.orgs[ref]
+
+    def __len__(self):
+        return sum(len(memberships) for memberships in self.memberships)
+
+
+def _org_query():
+    return model.Session.query(model.Group.id, model.Group.name).filter(
+        model.Group.is_organization == True  # noqa: E712
+    )
+
+
+def _member_query():
+    return (
+        model.Session.query(
+            model.Member.table_id, model.Member.group_id, model.Member.capacity
+        )
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Member.table_name == 'user',
+            model.Member.state == 'active',
+            model.Member.capacity.in_(ROLES),
+            model.Group.is_organization == True,  # noqa: E712
+        )
+    )
+
+
+def load_snapshot():
+    """
+    Load a full snapshot from the database. This takes three queries, one each for the
+    users, organisations, and memberships.
+
+    :returns: a MembershipSnapshot
+    """
+    snapshot = MembershipSnapshot()
+    snapshot.add_users(model.Session.query(model.User.id, model.User.name))
+    snapshot.add_orgs(_org_query())
+    snapshot.set_memberships(_member_query())
+    return snapshot
+
+
+class SnapshotManager(object):
+    """
+    Keeps a snapshot up to date. Users whose memberships change in this process are
+    marked as dirty and their rows are reloaded before the next lookup; the whole
+    snapshot is reloaded periodically to pick up changes made by other processes.
+    """
+
+    def __init__(self, refresh_interval, clock=time.monotonic):
+        """
+        :param refresh_interval: the number of seconds between full reloads, if this
+            is 0 or less the snapshot is only loaded once
+        :param clock: the function used to get the current time (optional)
+        """
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.snapshot = None
+        self.loaded_at = None
+        self.dirty = set()
+        self._lock = threading.Lock()
+
+    def _needs_reload(self):
+        if self.snapshot is None:
+            return True
+        return (
+            self.refresh_interval > 0
+            and self.clock() - self.loaded_at >= self.refresh_interval
+        )
+
+    def get_snapshot(self):
+        """
+        Returns the snapshot, reloading it or refreshing the dirty users first if
+        needed.
+
+        :returns: a MembershipSnapshot
+        """
+        if self._needs_reload() or self.dirty:
+            with self._lock:
+                if self._needs_reload():
+                    start = time.perf_counter()
+                    self.snapshot = load_snapshot()
+                    self.loaded_at = self.clock()
+                    self.dirty.clear()
+                    log.info(
+                        'Loaded membership snapshot with %d memberships in %.2fs',
+                        len(self.snapshot),
+                        time.perf_counter() - start,
+                    )
+                elif self.dirty:
+                    self._refresh_dirty()
+        return self.snapshot
+
+    def _refresh_dirty(self):
+        refs, self.dirty = list(self.dirty), set()
+        users = (
+            model.Session.query(model.User.id, model.User.name)
+            .filter(model.User.id.in_(refs) | model.User.name.in_(refs))
+            .all()
+        )
+        # forget any names the users no longer have, so that they can't be used to
+        # look up the wrong user's roles
+        current = {ref for user in users for ref in user}
+        for ref in refs:
+            if ref not in current:
+                self.snapshot.users.pop(ref, None)
+        if not users:
+            return
+        user_ids = [user_id for user_id, _ in users]
+        self.snapshot.add_users(users)
+        members = _member_query().filter(model.Member.table_id.in_(user_ids))
+        # pick up the names of any organisations created since the snapshot was loaded
+        self.snapshot.add_orgs(
+            _org_query().filter(
+                model.Group.id.in_(members.with_entities(model.Member.group_id))
+            )
+        )
+        self.snapshot.set_memberships(members, user_ids)
+
+    def mark_dirty(self, *user_refs):
+        """
+        Mark the given users' memberships as changed so that they are reloaded before
+        the next lookup.
+
+        :param user_refs: the users' names and/or IDs
+        """
+        with self._lock:
+            self.dirty.update(user_refs)
+
+    def discard_orgs(self, *org_refs):
+        """
+        Forget the given organisations, e.g. because they've been renamed or purged.
+        Lookups for them will fall back to the database until the next full reload.
+
+        :param org_refs: the organisations' names and/or IDs
+        """
+        with self._lock:
+            if self.snapshot is not None:
+                self.snapshot.discard_orgs(*org_refs)
+
+    def reset(self):
+        """
+        Stop using the snapshot, so that it is reloaded before the next lookup. This is
+        used when some of the changes made by other processes may have been missed.
+        """
+        with self._lock:
+            self.snapshot = None
+
+
+_manager = None
+
+
+def configure(config):
+    """
+    Set up the membership snapshot using the options in the given CKAN config. The
+    snapshot itself isn't loaded until it's first needed.
+
+    :param config: the CKAN config
+    """
+    global _manager
+    if toolkit.asbool(config.get('ckanext.userdatasets.membership_snapshot.enabled')):
+        refresh_interval = toolkit.asint(
+            config.get('ckanext.userdatasets.membership_snapshot.refresh_interval', 300)
+        )
+        if toolkit.asbool(
+            config.get('ckanext.userdatasets.membership_snapshot.shared')
+        ):
+            # imported here as it depends on this module, and on fcntl (so Unix only)
+            from ckanext.userdatasets.lib.shared_snapshot import SharedSnapshotManager
+
+            directory = config.get('ckanext.userdatasets.membership_snapshot.directory')
+            if not directory:
+                site_id = config.get('ckan.site_id', 'default')
+                directory = os.path.join(
+                    config.get('ckan.storage_path') or tempfile.gettempdir(),
+                    f'ckanext-userdatasets-{site_id}',
+                )
+            _manager = SharedSnapshotManager(directory, refresh_interval)
+        else:
+            _manager = SnapshotManager(refresh_interval)
+    else:
+        _manager = None
+
+
+def get_snapshot_manager():
+    """
+    Returns the configured snapshot manager (a SnapshotManager, or a
+    SharedSnapshotManager if the snapshot is shared between processes), or None if the
+    snapshot is disabled.
+    """
+    return _manager
+
+
+def _apply_user(*user_refs):
+    if _manager is not None:
+        _manager.mark_dirty(*user_refs)
+
+
+def _apply_orgs(*org_refs):
+    if _manager is not None:
+        _manager.discard_orgs(*org_refs)
+
+
+def _reset():
+    if _manager is not None:
+        _manager.reset()
+
+
+invalidation.register(invalidation.USER_EVENT, _apply_user, _reset)
+invalidation.register(ORG_EVENT, _apply_orgs, _reset)
+
+
+def discard_snapshot_orgs(*org_refs):
+    """
+    Forget the given organisations in every process's snapshot. This should be called
+    whenever an organisation is renamed or purged, as the snapshot would otherwise
+    answer lookups for its old name.
+
+    :param org_refs: the organisations' names and/or IDs
+    """
+    org_refs = [ref for ref in org_refs if ref]
+    if _manager is not None and org_refs:
+        _manager.discard_orgs(*org_refs)
+        invalidation.publish(ORG_EVENT, *org_refs)
+
+
+def get_snapshot_role(group_or_org_id, user_name_or_id, default=None):
+    """
+    Look up the user's role in the organisation using the membership snapshot. The
+    snapshot is brought up to date with the changes made by other processes first.
+
+    :param group_or_org_id: the organisation's ID or name
+    :param user_name_or_id: the user's name or ID
+    :param default: returned if the snapshot is disabled or can't answer
+    :returns: the role name, None if the user has no role, or the default
+    """
+    if _manager is None:
+        return default
+    invalidation.sync_invalidations()
+    snapshot = _manager.get_snapshot()
+    if snapshot is None:
+        return default
+    return snapshot.get_role(group_or_org_id, user_name_or_id, default)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import logging
+
+from ckan import model
+from ckan.lib import search
+from rq import get_current_job
+
+from ckanext.userdatasets.lib.audit import get_audit_log, record_ownership_transfer
+from ckanext.userdatasets.lib.packages import invalidate_packages
+from ckanext.userdatasets.logic.utils import VALID_ROLES
+
+log = logging.getLogger('ckanext.userdatasets')
+
+# the key the progress of a transfer job is stored under in the job's meta
+PROGRESS = 'userdatasets_transfer'
+
+
+def get_member_org_ids(user_id):
+    """
+    Find the organisations the given user has a valid role in.
+
+    :param user_id: the user's ID
+    :returns: a list of organisation IDs
+    """
+    query = (
+        model.Session.query(model.Member.group_id)
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Member.table_name == 'user',
+            model.Member.table_id == user_id,
+            model.Member.state == 'active',
+            model.Member.capacity.in_(VALID_ROLES),
+            model.Group.is_organization == True,  # noqa: E712
+        )
+    )
+    return [org_id for (org_id,) in query]
+
+
+def build_transfer_query(from_user_id, org_ids):
+    """
+    Creates the query for the IDs of the datasets the given user created in the given
+    organisations, which transfer_ownership pages through.
+
+    :param from_user_id: the ID of the user who created the datasets
+    :param org_ids: the IDs of the organisations
+    :returns: a query for package ID rows
+    """
+    return model.Session.query(model.Package.id).filter(
+        model.Package.creator_user_id == from_user_id,
+        model.Package.owner_org.in_(org_ids),
+    )
+
+
+def _update_progress(**progress):
+    job = get_current_job()
+    if job is not None:
+        job.meta.setdefault(PROGRESS, {}).update(progress)
+        job.save_meta()
+
+
+def _requested_by():
+    job = get_current_job()
+    if job is None:
+        return None
+    return job.meta.get(PROGRESS, {}).get('requested_by')
+
+
+def transfer_ownership(from_user_id, to_user_id, owner_org_id=None, chunk_size=500):
+    """
+    Background job which makes one user the creator of the datasets another user
+    created, so that they can manage them as a member of the datasets' organisation.
+
+    The datasets are found a chunk at a time using keyset pagination on their IDs and
+    each chunk is updated, committed and reindexed before the next is read, so the
+    package table is never locked for long. The chunk's records are removed from the
+    package cache in every process and, if the audit log is enabled, each chunk is
+    recorded in it. Progress is stored in the job's meta under PROGRESS.
+
+    :param from_user_id: the ID of the user who created the datasets
+    :param to_user_id: the ID of the user to make the creator
+    :param owner_org_id: the ID of the organisation to transfer the datasets of, or
+        None to transfer the datasets in every organisation the new creator is a
+        member of
+    :param chunk_size: the number of datasets to update in each transaction
+    :returns: the number of datasets transferred
+    """
+    org_ids = [owner_org_id] if owner_org_id else get_member_org_ids(to_user_id)
+    packages = build_transfer_query(from_user_id, org_ids)
+    total = packages.count()
+    _update_progress(total=total, transferred=0)
+    log.info(
+        'Transferring %d datasets from user %s to user %s',
+        total,
+        from_user_id,
+        to_user_id,
+    )
+
+    requested_by = _requested_by()
+    transferred = 0
+    last_id = ''
+    while True:
+        ids = [
+            package_id
+            for (package_id,) in packages.filter(model.Package.id > last_id)
+            .order_by(model.Package.id)
+            .limit(chunk_size)
+        ]
+        if not ids:
+            break
+        model.Session.query(model.Package).filter(model.Package.id.in_(ids)).update(
+            {'creator_user_id': to_user_id}, synchronize_session=False
+        )
+        # published before and again after the commit, like the actions' invalidations
+        invalidate_packages(*ids)
+        model.Session.commit()
+        search.rebuild(package_ids=ids, defer_commit=True)
+        search.commit()
+        record_ownership_transfer(
+            requested_by, from_user_id, to_user_id, owner_org_id, ids
+        )
+
+        last_id = ids[-1]
+        transferred += len(ids)
+        _update_progress(transferred=transferred)
+        log.info('Transferred %d of %d datasets', transferred, total)
+
+    # job processes can exit without running the atexit hooks which write the queue
+    audit_log = get_audit_log()
+    if audit_log is not None:
+        audit_log.flush()
+    return transferred
@@ -7,11 +7,21 @@
 import logging
 
 import ckan.lib.plugins as lib_plugins
-from ckan.logic.validators import owner_org_validator as default_owner_org_validator
+from ckan.lib import search
+from ckan.lib.search import SearchIndexError
 from ckan.plugins import toolkit
-from ckantools.decorators import basic_action
+from ckantools.decorators import action, basic_action
+from sqlalchemy.exc import SQLAlchemyError
 
-from ckanext.userdatasets.logic.validators import owner_org_validator
+from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+from ckanext.userdatasets.lib.membership import invalidate_user
+from ckanext.userdatasets.lib.negative import RESOURCE_VIEW, discard_missing
+from ckanext.userdatasets.lib.org_list import clear_org_lists
+from ckanext.userdatasets.logic import help, schema
+from ckanext.userdatasets.logic.schema import (
+    get_package_schema,
+    patch_owner_org_validator,
+)
 
 log = logging.getLogger('ckanext.userdatasets')
 
@@ -19,18 +29,201 @@ log = logging.getLogger('ckanext.userdatasets')
 @basic_action
 @toolkit.chained_action
 def package_create(next_action, context, data_dict):
-    package_type = data_dict.get('type')
-    package_plugin = lib_plugins.lookup_package_plugin(package_type)
+    # We modify the schema here to replace owner_org_validator by our own
     if 'schema' in context:
-        schema = context['schema']
+        context['schema'] = patch_owner_org_validator(context['schema'])
     else:
-        schema = package_plugin.create_package_schema()
-    # We modify the schema here to replace owner_org_validator by our own
-    if 'owner_org' in schema:
-        schema['owner_org'] = [
-            owner_org_validator if f is default_owner_org_validator else f
-            for f in schema['owner_org']
-        ]
-    context['schema'] = schema
+        context['schema'] = get_package_schema(data_dict.get('type'), 'create')
 
     return next_action(context, data_dict)
+
+
+@basic_action
+@toolkit.chained_action
+def organization_member_create(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    invalidate_user(data_dict.get('username'))
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def member_create(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    if data_dict.get('object_type') == 'user':
+        invalidate_user(data_dict.get('object'))
+    elif data_dict.get('object_type') == 'group':
+        # the group hierarchy affects which organisations roles cascade to
+        clear_org_lists()
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def organization_create(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    clear_org_lists()
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def resource_view_create(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    discard_missing(RESOURCE_VIEW, result['id'])
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def package_collaborator_create(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    clear_auth_memo()
+    return result
+
+
+def _failure(error):
+    if isinstance(error, toolkit.ValidationError):
+        return {'success': False, 'error': error.error_dict}
+    return {'success': False, 'error': {'message': str(error) or type(error).__name__}}
+
+
+def _validate(item_context, data_dict):
+    """
+    Check the user can create the dataset and validate it, as package_create will.
+    This is done before calling package_create because when validation fails it rolls
+    back the whole transaction, including the datasets created since the last commit,
+    rather than just the dataset's savepoint.
+
+    :param item_context: the context package_create will be called with
+    :param data_dict: the dataset dict
+    :raises NotAuthorized: if the user can't create the dataset
+    :raises ValidationError: if the dataset isn't valid
+    """
+    toolkit.check_access('package_create', dict(item_context), dict(data_dict))
+    package_plugin = lib_plugins.lookup_package_plugin(data_dict.get('type'))
+    _, errors = lib_plugins.plugin_validate(
+        package_plugin,
+        dict(item_context),
+        dict(data_dict),
+        item_context['schema'],
+        'package_create',
+    )
+    if errors:
+        raise toolkit.ValidationError(errors)
+
+
+def _fail_pending(results, pending, error):
+    """
+    Mark the datasets created since the last commit as failed.
+
+    :param results: the list of results
+    :param pending: the indexes of the results created since the last commit, which is
+        cleared
+    :param error: the error dict to report for each of them
+    """
+    for index in pending:
+        results[index] = {'success': False, 'error': dict(error)}
+    pending.clear()
+
+
+def _commit(model, results, pending):
+    """
+    Commit and index the datasets created since the last commit, marking them all as
+    failed if the commit fails. package_create doesn't index datasets when their
+    commit is deferred, so they are indexed here once they're committed.
+    """
+    if not pending:
+        return
+    try:
+        model.repo.commit()
+    except SQLAlchemyError as e:
+        log.error('Failed to commit %d datasets', len(pending), exc_info=True)
+        model.Session.rollback()
+        _fail_pending(results, pending, _failure(e)['error'])
+        return
+    package_ids = [results[index]['id'] for index in pending]
+    pending.clear()
+    try:
+        search.rebuild(package_ids=package_ids, defer_commit=True)
+        search.commit()
+    except SearchIndexError:
+        # the datasets exist, so they're still reported as created
+        log.error('Failed to index datasets %s', package_ids, exc_info=True)
+
+
+@action(
+    schema.userdatasets_package_create_bulk(),
+    help.userdatasets_package_create_bulk,
+)
+def userdatasets_package_create_bulk(context, datasets, chunk_size=None):
+    model = context['model']
+    if chunk_size is None:
+        chunk_size = toolkit.asint(
+            toolkit.config.get('ckanext.userdatasets.bulk.chunk_size', 100)
+        )
+    max_size = toolkit.asint(
+        toolkit.config.get('ckanext.userdatasets.bulk.max_size', 1000)
+    )
+    if len(datasets) > max_size:
+        raise toolkit.ValidationError(
+            {'datasets': [f'No more than {max_size} datasets can be created at once']}
+        )
+
+    create = toolkit.get_action('package_create')
+    # package type -> schema
+    schemas = {}
+    results = []
+    # the indexes of the results created since the last commit
+    pending = []
+    errors = (
+        toolkit.ValidationError,
+        toolkit.NotAuthorized,
+        toolkit.ObjectNotFound,
+        SQLAlchemyError,
+    )
+    for index, data_dict in enumerate(datasets):
+        package_type = data_dict.get('type')
+        if package_type not in schemas:
+            schemas[package_type] = get_package_schema(package_type, 'create')
+        item_context = {
+            'model': model,
+            'session': model.Session,
+            'user': context['user'],
+            'auth_user_obj': context['auth_user_obj'],
+            'schema': schemas[package_type],
+            'defer_commit': True,
+            'return_id_only': True,
+        }
+        try:
+            _validate(item_context, data_dict)
+        except errors as e:
+            results.append(_failure(e))
+            continue
+
+        savepoint = model.Session.begin_nested()
+        try:
+            package_id = create(item_context, dict(data_dict))
+            savepoint.commit()
+        except errors as e:
+            if savepoint.is_active:
+                savepoint.rollback()
+            else:
+                # package_create rolled back the whole transaction, so the datasets
+                # created since the last commit have gone too
+                log.error('Lost %d uncommitted datasets', len(pending))
+                _fail_pending(
+                    results,
+                    pending,
+                    {'message': 'Rolled back when a later dataset failed to save'},
+                )
+            results.append(_failure(e))
+            continue
+        results.append({'success': True, 'id': package_id})
+        pending.append(index)
+        if len(pending) >= chunk_size:
+            _commit(model, results, pending)
+    _commit(model, results, pending)
+
+    created = sum(1 for result in results if result['success'])
+    return {'created': created, 'failed': len(results) - created, 'results': results}
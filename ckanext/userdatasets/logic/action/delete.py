@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from ckan.plugins import toolkit
+from ckantools.decorators import basic_action
+
+from ckanext.userdatasets.lib.audit import record_ownership_decision
+from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+from ckanext.userdatasets.lib.membership import (
+    get_org_member_refs,
+    invalidate_user,
+    invalidate_user_refs,
+)
+from ckanext.userdatasets.lib.org_list import clear_org_lists
+from ckanext.userdatasets.lib.packages import invalidate_package
+from ckanext.userdatasets.lib.snapshot import discard_snapshot_orgs
+from ckanext.userdatasets.logic.auth.auth import get_audited_ownership
+
+
+@basic_action
+@toolkit.chained_action
+def package_delete(next_action, context, data_dict):
+    # the ownership has to be checked before the package is deleted
+    audited = get_audited_ownership(context, data_dict.get('id'))
+    result = next_action(context, data_dict)
+    if audited is not None:
+        record_ownership_decision('package_delete', *audited)
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def organization_member_delete(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    user = data_dict.get('username')
+    invalidate_user(data_dict.get('user_id') if user is None else user)
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def member_delete(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    if data_dict.get('object_type') == 'user':
+        invalidate_user(data_dict.get('object'))
+    elif data_dict.get('object_type') == 'group':
+        # the group hierarchy affects which organisations roles cascade to
+        clear_org_lists()
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def user_delete(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    invalidate_user(data_dict.get('id'))
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def organization_delete(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    clear_org_lists()
+    # the members may no longer belong to any organisation
+    invalidate_user_refs(get_org_member_refs(data_dict.get('id')))
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def organization_purge(next_action, context, data_dict):
+    # the memberships are purged with the organisation, so find the members first
+    member_refs = get_org_member_refs(data_dict.get('id'))
+    result = next_action(context, data_dict)
+    clear_org_lists()
+    invalidate_user_refs(member_refs)
+    discard_snapshot_orgs(data_dict.get('id'))
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def dataset_purge(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    # purging doesn't call the IPackageController hooks
+    invalidate_package(data_dict)
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def package_collaborator_delete(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    clear_auth_memo()
+    return result
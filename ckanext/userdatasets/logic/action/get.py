@@ -4,17 +4,192 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
+from ckan import authz
+from ckan.lib.jobs import job_from_id
 from ckan.plugins import toolkit
-from ckantools.decorators import basic_action
+from ckantools.decorators import action, basic_action
+
+from ckanext.userdatasets.lib.instrumentation import get_query_stats
+from ckanext.userdatasets.lib.org_list import (
+    get_org_list_cache,
+    query_organisations_for_user,
+)
+from ckanext.userdatasets.lib.owned import (
+    DEFAULT_FIELDS,
+    FIELDS,
+    query_owned_packages,
+)
+from ckanext.userdatasets.lib.transfer import PROGRESS
+from ckanext.userdatasets.logic import help, schema
+from ckanext.userdatasets.logic.auth.batch import check_access_batch
+
+# the permissions which are swapped for 'read' when listing a user's organisations
+MEMBER_PERMISSIONS = ('create_dataset', 'update_dataset', 'delete_dataset')
 
 
 @basic_action
 @toolkit.chained_action
 def organization_list_for_user(next_action, context, data_dict):
     perm = data_dict.get('permission')
-    if perm in ['create_dataset', 'update_dataset', 'delete_dataset']:
+    if perm in MEMBER_PERMISSIONS:
         # Create a copy of the data dict, and change the request permission to
         # 'read' which will be granted to all members of a group.
         data_dict = {**data_dict, **{'permission': 'read'}}
 
-    return next_action(context, data_dict)
+    cache = get_org_list_cache()
+    user = data_dict.get('id') or context.get('user')
+    # the counts change whenever a dataset or member is added to or removed from any of
+    # the organisations, so lists including them aren't cached
+    counted = toolkit.asbool(
+        data_dict.get('include_dataset_count', False)
+    ) or toolkit.asbool(data_dict.get('include_member_count', False))
+    if cache is None or not user or counted:
+        return next_action(context, data_dict)
+
+    # the core action checks access before doing anything else, so we need to as well
+    toolkit.check_access('organization_list_for_user', context, data_dict)
+    # sysadmins see every organisation, so the list changes if the user's sysadmin flag
+    # does (which can happen outside the action API, e.g. on the command line)
+    key = (
+        user,
+        authz.is_sysadmin(user),
+        data_dict.get('permission', 'manage_group'),
+    )
+    orgs = cache.get(key)
+    if orgs is None:
+        orgs = next_action(context, data_dict)
+        cache.set(key, orgs)
+    return orgs
+
+
+@action(
+    schema.userdatasets_organization_list_for_user(),
+    help.userdatasets_organization_list_for_user,
+    get=True,
+)
+def userdatasets_organization_list_for_user(
+    context, permission='manage_group', id=None
+):
+    user = id or context.get('user')
+    if not user:
+        return []
+    if permission in MEMBER_PERMISSIONS:
+        permission = 'read'
+
+    cache = get_org_list_cache()
+    if cache is None:
+        return query_organisations_for_user(user, permission)
+    key = (user, authz.is_sysadmin(user), permission, 'ids')
+    orgs = cache.get(key)
+    if orgs is None:
+        orgs = query_organisations_for_user(user, permission)
+        cache.set(key, orgs)
+    return orgs
+
+
+@action(
+    schema.userdatasets_check_access_batch(),
+    help.userdatasets_check_access_batch,
+    get=True,
+)
+def userdatasets_check_access_batch(
+    context, ids, permission='update', object_type='package', user=None
+):
+    max_size = toolkit.asint(
+        toolkit.config.get('ckanext.userdatasets.bulk.max_size', 1000)
+    )
+    if len(ids) > max_size:
+        raise toolkit.ValidationError(
+            {'ids': [f'No more than {max_size} IDs can be checked at once']}
+        )
+    if user is None:
+        user_obj = context['auth_user_obj']
+    else:
+        user_obj = context['model'].User.get(user)
+        if user_obj is None:
+            raise toolkit.ObjectNotFound(toolkit._('User not found'))
+    return check_access_batch(context, user_obj, ids, permission, object_type)
+
+
+@action(
+    schema.userdatasets_query_stats(),
+    help.userdatasets_query_stats,
+    get=True,
+)
+def userdatasets_query_stats(context, function=None):
+    stats = get_query_stats()
+    if stats is None:
+        return {'enabled': False}
+    totals = stats.get_totals()
+    if function is not None:
+        totals = {name: totals[name] for name in totals if function in name}
+    return {
+        'enabled': True,
+        'since': stats.since,
+        'sample_rate': stats.sample_rate,
+        'functions': totals,
+    }
+
+
+@action(
+    schema.userdatasets_transfer_ownership_status(),
+    help.userdatasets_transfer_ownership_status,
+    get=True,
+)
+def userdatasets_transfer_ownership_status(context, job_id):
+    try:
+        job = job_from_id(job_id)
+    except KeyError:
+        raise toolkit.ObjectNotFound(toolkit._('Job not found'))
+    progress = job.meta.get(PROGRESS, {})
+    return {
+        'status': job.get_status(),
+        'total': progress.get('total'),
+        'transferred': progress.get('transferred', 0),
+    }
+
+
+@action(
+    schema.userdatasets_owned_package_list(),
+    help.userdatasets_owned_package_list,
+    get=True,
+)
+def userdatasets_owned_package_list(
+    context, user=None, owner_org=None, fields=None, limit=None, cursor=None
+):
+    model = context['model']
+    if user is None:
+        user_obj = context['auth_user_obj']
+    else:
+        user_obj = model.User.get(user)
+        if user_obj is None:
+            raise toolkit.ObjectNotFound(toolkit._('User not found'))
+
+    owner_org_id = None
+    if owner_org:
+        org = model.Group.get(owner_org)
+        if org is None or not org.is_organization:
+            raise toolkit.ObjectNotFound(toolkit._('Organization not found'))
+        owner_org_id = org.id
+
+    fields = fields or DEFAULT_FIELDS
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise toolkit.ValidationError(
+            {'fields': [f'Unknown fields: {", ".join(unknown)}']}
+        )
+
+    max_limit = toolkit.asint(
+        toolkit.config.get('ckanext.userdatasets.owned_package_list.max_limit', 1000)
+    )
+    if limit is None:
+        limit = toolkit.asint(
+            toolkit.config.get('ckanext.userdatasets.owned_package_list.limit', 100)
+        )
+    try:
+        results, next_cursor = query_owned_packages(
+            user_obj, owner_org_id, fields, min(limit, max_limit), cursor
+        )
+    except ValueError as e:
+        raise toolkit.ValidationError({'cursor': [str(e)]})
+    return {'results': results, 'next_cursor': next_cursor}
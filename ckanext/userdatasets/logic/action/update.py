@@ -5,13 +5,31 @@
 # Created by the Natural History Museum in London, UK
 
 import logging
+from collections import Counter
 
-import ckan.lib.plugins as lib_plugins
-from ckan.logic.validators import owner_org_validator as default_owner_org_validator
 from ckan.plugins import toolkit
-from ckantools.decorators import basic_action
+from ckantools.decorators import action, basic_action
 
-from ckanext.userdatasets.logic.validators import owner_org_validator
+from ckanext.userdatasets.lib.audit import record_ownership_decision
+from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+from ckanext.userdatasets.lib.membership import (
+    get_org_member_refs,
+    invalidate_user_refs,
+)
+from ckanext.userdatasets.lib.org_list import clear_org_lists
+from ckanext.userdatasets.lib.packages import invalidate_package
+from ckanext.userdatasets.lib.snapshot import discard_snapshot_orgs
+from ckanext.userdatasets.lib.transfer import PROGRESS, transfer_ownership
+from ckanext.userdatasets.logic import help, schema
+from ckanext.userdatasets.logic.auth.auth import (
+    PACKAGE_UPDATE_AUTHORISED,
+    get_audited_ownership,
+)
+from ckanext.userdatasets.logic.schema import (
+    get_package_schema,
+    patch_owner_org_validator,
+)
+from ckanext.userdatasets.logic.utils import org_role_is_valid
 
 log = logging.getLogger('ckanext.userdatasets')
 
@@ -25,21 +43,193 @@ def package_update(next_action, context, data_dict):
     pkg = model.Package.get(name_or_id)
     if pkg is None:
         raise toolkit.ObjectNotFound(toolkit._('Package was not found.'))
+    # pass the package on so that the auth functions don't load it again, and use its
+    # ID so that core's lookup is answered from the session rather than the database
+    context['package'] = pkg
+    data_dict['id'] = pkg.id
 
     toolkit.check_access('package_update', context, data_dict)
+    # record that we've made the auth decision so that when core checks it again it
+    # doesn't need to be evaluated a second time
+    context[PACKAGE_UPDATE_AUTHORISED] = pkg.id
+    audited = get_audited_ownership(context, pkg.id)
 
-    # get the schema
-    package_plugin = lib_plugins.lookup_package_plugin(pkg.type)
+    # We modify the schema here to replace owner_org_validator by our own
     if 'schema' in context:
-        schema = context['schema']
+        context['schema'] = patch_owner_org_validator(context['schema'])
     else:
-        schema = package_plugin.update_package_schema()
-    # We modify the schema here to replace owner_org_validator by our own
-    if 'owner_org' in schema:
-        schema['owner_org'] = [
-            owner_org_validator if f is default_owner_org_validator else f
-            for f in schema['owner_org']
-        ]
-    context['schema'] = schema
-
-    return next_action(context, data_dict)
+        context['schema'] = get_package_schema(pkg.type, 'update')
+
+    try:
+        result = next_action(context, data_dict)
+    finally:
+        context.pop(PACKAGE_UPDATE_AUTHORISED, None)
+    if audited is not None:
+        record_ownership_decision('package_update', *audited)
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def package_owner_org_update(next_action, context, data_dict):
+    result = next_action(context, data_dict)
+    # moving a package doesn't call the IPackageController hooks
+    invalidate_package(data_dict)
+    clear_auth_memo()
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def organization_update(next_action, context, data_dict):
+    org = context['model'].Group.get(data_dict.get('id'))
+    old_name = None if org is None else org.name
+    result = next_action(context, data_dict)
+    clear_org_lists()
+    # the organisation's state may have changed, which changes whether its members
+    # belong to any organisation
+    invalidate_user_refs(get_org_member_refs(result['id']))
+    if old_name is not None and old_name != result['name']:
+        # the old name is free for another organisation to take, so the snapshot
+        # mustn't answer lookups for it
+        discard_snapshot_orgs(result['id'], old_name)
+    return result
+
+
+@basic_action
+@toolkit.chained_action
+def user_update(next_action, context, data_dict):
+    user = context['model'].User.get(data_dict.get('id'))
+    old_name = None if user is None else user.name
+    result = next_action(context, data_dict)
+    if old_name is not None and old_name != result['name']:
+        # roles may have been cached under the old name, which another user could now
+        # take
+        invalidate_user_refs({old_name, result['id'], result['name']})
+    return result
+
+
+@action(schema.userdatasets_resource_bulk(), help.userdatasets_resource_bulk)
+def userdatasets_resource_bulk(context, package_id, create=None, update=None):
+    model = context['model']
+    create = create or []
+    update = update or []
+    max_size = toolkit.asint(
+        toolkit.config.get('ckanext.userdatasets.bulk.max_size', 1000)
+    )
+    if len(create) + len(update) > max_size:
+        message = f'No more than {max_size} resources can be changed at once'
+        raise toolkit.ValidationError(
+            {
+                key: [message]
+                for key, resources in (('create', create), ('update', update))
+                if resources
+            }
+        )
+    update_counts = Counter(resource.get('id') for resource in update)
+    duplicates = sorted(
+        (ref for ref, count in update_counts.items() if count > 1), key=str
+    )
+    if duplicates:
+        raise toolkit.ValidationError(
+            {
+                'update': [
+                    f'Resource {resource_id} is updated more than once'
+                    for resource_id in duplicates
+                ]
+            }
+        )
+
+    pkg = model.Package.get(package_id)
+    if pkg is None:
+        raise toolkit.ObjectNotFound(toolkit._('Package was not found.'))
+    # check once for the whole dataset rather than once per resource; the ownership
+    # lookup is stored on the context so the checks share it
+    context['package'] = pkg
+    if create:
+        toolkit.check_access('resource_create', context, {'package_id': pkg.id})
+    if update:
+        toolkit.check_access('package_update', context, {'id': pkg.id})
+
+    pkg_dict = toolkit.get_action('package_show')(
+        dict(context, return_type='dict', use_cache=False, for_update=True),
+        {'id': pkg.id},
+    )
+    positions = {
+        resource['id']: position
+        for position, resource in enumerate(pkg_dict['resources'])
+    }
+    updated_positions = []
+    for resource in update:
+        position = positions.get(resource.get('id'))
+        if position is None:
+            raise toolkit.ValidationError(
+                {
+                    'update': [
+                        f'Resource {resource.get("id")} is not part of this dataset'
+                    ]
+                }
+            )
+        current = pkg_dict['resources'][position]
+        # as in resource_update, keep the datastore flag if it isn't passed
+        if 'datastore_active' in current and 'datastore_active' not in resource:
+            resource = dict(resource, datastore_active=current['datastore_active'])
+        pkg_dict['resources'][position] = resource
+        updated_positions.append(position)
+    first_created = len(pkg_dict['resources'])
+    pkg_dict['resources'].extend(create)
+
+    update_context = {
+        'model': model,
+        'session': model.Session,
+        'user': context['user'],
+        'auth_user_obj': context['auth_user_obj'],
+        'userdatasets_ownership': context.get('userdatasets_ownership', {}),
+    }
+    result = toolkit.get_action('package_update')(update_context, pkg_dict)
+    resources = result['resources']
+    return {
+        'created': resources[first_created:],
+        'updated': [resources[position] for position in updated_positions],
+    }
+
+
+@action(schema.userdatasets_transfer_ownership(), help.userdatasets_transfer_ownership)
+def userdatasets_transfer_ownership(
+    context, from_user, to_user, owner_org=None, chunk_size=None
+):
+    model = context['model']
+    users = {}
+    for key, ref in (('from_user', from_user), ('to_user', to_user)):
+        users[key] = model.User.get(ref)
+        if users[key] is None:
+            raise toolkit.ObjectNotFound(toolkit._('User not found'))
+
+    owner_org_id = None
+    if owner_org:
+        org = model.Group.get(owner_org)
+        if org is None or not org.is_organization:
+            raise toolkit.ObjectNotFound(toolkit._('Organization not found'))
+        if not org_role_is_valid(org.id, users['to_user'].name):
+            raise toolkit.ValidationError(
+                {'to_user': ['The new creator must be a member of the organisation']}
+            )
+        owner_org_id = org.id
+
+    if chunk_size is None:
+        chunk_size = toolkit.asint(
+            toolkit.config.get('ckanext.userdatasets.transfer.chunk_size', 500)
+        )
+    job = toolkit.enqueue_job(
+        transfer_ownership,
+        [users['from_user'].id, users['to_user'].id, owner_org_id, chunk_size],
+        title=f'Transfer datasets from {users["from_user"].name} to '
+        f'{users["to_user"].name}',
+        rq_kwargs={
+            'timeout': toolkit.asint(
+                toolkit.config.get('ckanext.userdatasets.transfer.timeout', 3600)
+            ),
+            'meta': {PROGRESS: {'requested_by': context['auth_user_obj'].id}},
+        },
+    )
+    return {'job_id': job.id}
@@ -4,9 +4,30 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
+from collections import namedtuple
+
 from ckan.plugins import toolkit
+from sqlalchemy import and_, or_
+
+from ckanext.userdatasets.lib.audit import get_audit_log
+from ckanext.userdatasets.lib.negative import (
+    PACKAGE,
+    RESOURCE,
+    RESOURCE_VIEW,
+    check_missing,
+    not_found,
+)
+from ckanext.userdatasets.lib.packages import PackageRecord, get_package_record_cache
+from ckanext.userdatasets.logic.utils import (
+    VALID_ROLES,
+    get_role,
+    org_role_is_valid,
+    remember_role,
+)
 
-from ckanext.userdatasets.logic.utils import org_role_is_valid
+# context key used by the package_update action to record that it has already checked
+# that the user can update the package with the ID stored under it
+PACKAGE_UPDATE_AUTHORISED = 'userdatasets_package_update_authorised'
 
 
 def user_is_member_of_package_org(user, package):
@@ -38,21 +59,242 @@ def user_owns_package_as_member(user, package):
     return False
 
 
-def get_resource_view_object(context, data_dict):
-    try:
-        return context['resource_view']
-    except KeyError:
+class PackageOwnership(
+    namedtuple(
+        'PackageOwnership',
+        ['package_id', 'owner_org', 'creator_user_id', 'user_id', 'role'],
+    )
+):
+    """
+    The details needed to decide whether a user owns a package: the package's
+    organisation and creator, and the role the user holds in that organisation.
+    """
+
+    __slots__ = ()
+
+    @property
+    def user_is_member(self):
+        """
+        True if the package is in an organisation and the user has a valid role in it.
+        """
+        return bool(self.owner_org) and self.role in VALID_ROLES
+
+    @property
+    def user_owns_package(self):
+        """
+        True if the user created the package and has a valid role in the organisation
+        to which the package belongs.
+        """
+        return (
+            self.user_is_member
+            and bool(self.creator_user_id)
+            and self.user_id == self.creator_user_id
+        )
+
+
+def query_ownership(context, user):
+    """
+    Creates a query which selects the package's ownership details along with the
+    user's role in the package's organisation, all in one go.
+
+    :param context: the context dict
+    :param user: A user object
+    :returns: a query object, which needs filtering to the package in question
+    """
+    model = context['model']
+    membership = and_(
+        model.Member.group_id == model.Package.owner_org,
+        model.Member.table_name == 'user',
+        model.Member.state == 'active',
+        model.Member.table_id == user.id,
+    )
+    return model.Session.query(
+        model.Package.id,
+        model.Package.name,
+        model.Package.owner_org,
+        model.Package.creator_user_id,
+        model.Member.capacity,
+    ).outerjoin(model.Member, membership)
+
+
+def ownership_from_row(user, row):
+    """
+    Turns a row from a query_ownership query into a PackageOwnership. The package's
+    details are added to the package record cache (if it's enabled) and the user's
+    role is remembered for the rest of the request.
+
+    :param user: A user object
+    :param row: a row with the columns selected by query_ownership
+    :returns: a PackageOwnership object
+    """
+    records = get_package_record_cache()
+    if records is not None:
+        records.set(PackageRecord(row.id, row.name, row.owner_org, row.creator_user_id))
+    ownership = PackageOwnership(
+        row.id, row.owner_org, row.creator_user_id, user.id, row.capacity
+    )
+    if ownership.owner_org:
+        # let the validators and any later auth checks in this request use the role
+        remember_role(ownership.owner_org, user.name, ownership.role)
+    return ownership
+
+
+def get_package_ownership(context, user, package_id):
+    """
+    Retrieve the ownership details of the given package for the given user. This
+    replaces loading the whole package and then looking up the user's role separately
+    with a single query over the package and member tables.
+
+    The result is cached on the context so repeated checks against the same package
+    are free. If the package record cache is enabled, the package's details are taken
+    from it and only the user's role is looked up.
+
+    :param context: the context dict
+    :param user: A user object
+    :param package_id: the package's ID or name
+    :returns: a PackageOwnership object
+    """
+    if not package_id:
+        raise toolkit.ValidationError(
+            {'message': 'Missing id, can not get Package object'}
+        )
+
+    cache = context.setdefault('userdatasets_ownership', {})
+    key = (package_id, user.id)
+    if key in cache:
+        return cache[key]
+
+    package = context.get('package')
+    if package is None or package_id not in (package.id, package.name):
+        records = get_package_record_cache()
+        package = None if records is None else records.get(package_id)
+
+    if package is not None:
+        # we've already got the package so just look up the role
+        role = get_role(package.owner_org, user.name) if package.owner_org else None
+        ownership = PackageOwnership(
+            package.id, package.owner_org, package.creator_user_id, user.id, role
+        )
+    else:
+        check_missing(PACKAGE, package_id)
         model = context['model']
-        if not data_dict:
-            data_dict = {}
-        id = data_dict.get('id', None)
-        if not id:
-            raise toolkit.ValidationError(
-                'Missing id, can not get {0} object'.format('ResourceView')
+        row = (
+            query_ownership(context, user)
+            .filter(
+                or_(model.Package.id == package_id, model.Package.name == package_id)
             )
-        obj = getattr(model, 'ResourceView').get(id)
-        if not obj:
-            raise toolkit.ObjectNotFound
-        # Save in case we need this again during the request
-        context['resource_view'] = obj
-        return obj
+            .first()
+        )
+        if row is None:
+            raise not_found(PACKAGE, package_id)
+        ownership = ownership_from_row(user, row)
+
+    cache[key] = cache[(ownership.package_id, user.id)] = ownership
+    return ownership
+
+
+def get_audited_ownership(context, package_id):
+    """
+    If auditing is enabled, check whether an action on the given package will be
+    allowed through this extension's ownership rule (i.e. the current user created
+    the package and is a member of its organisation), and so should be audited.
+
+    :param context: the context dict
+    :param package_id: the package's ID or name
+    :returns: a (user, PackageOwnership) tuple if the action should be audited,
+        otherwise None
+    """
+    if get_audit_log() is None or context.get('ignore_auth'):
+        return None
+    user = context.get('auth_user_obj')
+    if user is None and context.get('user'):
+        user = context['model'].User.get(context['user'])
+    # sysadmins are allowed before any auth function is called
+    if user is None or user.sysadmin:
+        return None
+    try:
+        ownership = get_package_ownership(context, user, package_id)
+    except (toolkit.ObjectNotFound, toolkit.ValidationError):
+        return None
+    return (user, ownership) if ownership.user_owns_package else None
+
+
+def get_resource_ownership(context, user, resource_id):
+    """
+    Retrieve the ownership details of the package the given resource belongs to, for
+    the given user, in a single query over the resource, package and member tables.
+
+    :param context: the context dict
+    :param user: A user object
+    :param resource_id: the resource's ID
+    :returns: a PackageOwnership object
+    """
+    if not resource_id:
+        raise toolkit.ValidationError(
+            {'message': 'Missing id, can not get Resource object'}
+        )
+
+    resource = context.get('resource')
+    if resource is not None and resource.id == resource_id:
+        return get_package_ownership(context, user, resource.package_id)
+
+    check_missing(RESOURCE, resource_id)
+    model = context['model']
+    row = (
+        query_ownership(context, user)
+        .join(model.Resource, model.Resource.package_id == model.Package.id)
+        .filter(model.Resource.id == resource_id)
+        .first()
+    )
+    if row is None:
+        raise not_found(RESOURCE, resource_id)
+    ownership = ownership_from_row(user, row)
+    cache = context.setdefault('userdatasets_ownership', {})
+    cache[(ownership.package_id, user.id)] = ownership
+    return ownership
+
+
+def get_resource_view_ownership(context, user, data_dict):
+    """
+    Retrieve the ownership details of the package the given resource view belongs to,
+    for the given user. If the view hasn't already been loaded, this is done in a
+    single query over the resource view, resource, package and member tables, rather
+    than loading each of the view, resource and package objects in turn.
+
+    The result is cached on the context so repeated checks against the same view are
+    free.
+
+    :param context: the context dict
+    :param user: A user object
+    :param data_dict: the data dict, containing the view's ID as 'id'
+    :returns: a PackageOwnership object
+    """
+    resource_view = context.get('resource_view')
+    if resource_view is not None:
+        return get_resource_ownership(context, user, resource_view.resource_id)
+
+    view_id = (data_dict or {}).get('id')
+    if not view_id:
+        raise toolkit.ValidationError(
+            'Missing id, can not get {0} object'.format('ResourceView')
+        )
+
+    cache = context.setdefault('userdatasets_ownership', {})
+    key = ('resource_view', view_id, user.id)
+    if key in cache:
+        return cache[key]
+
+    check_missing(RESOURCE_VIEW, view_id)
+    model = context['model']
+    row = (
+        query_ownership(context, user)
+        .join(model.Resource, model.Resource.package_id == model.Package.id)
+        .join(model.ResourceView, model.ResourceView.resource_id == model.Resource.id)
+        .filter(model.ResourceView.id == view_id)
+        .first()
+    )
+    if row is None:
+        raise not_found(RESOURCE_VIEW, view_id)
+    ownership = ownership_from_row(user, row)
+    cache[key] = cache[(ownership.package_id, user.id)] = ownership
+    return ownership
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from ckan import authz
+from sqlalchemy import or_
+
+from ckanext.userdatasets.logic.auth.auth import (
+    ownership_from_row,
+    query_ownership,
+)
+
+# the permissions which can be checked in bulk, these correspond to the package_update,
+# package_delete, resource_create and package_collaborator_* auth functions
+PERMISSIONS = ('update', 'delete', 'resource_create', 'collaborator')
+OBJECT_TYPES = ('package', 'resource')
+
+
+def get_package_ownerships(context, user, package_ids):
+    """
+    Retrieve the ownership details for each of the given packages in a single query.
+
+    :param context: the context dict
+    :param user: A user object
+    :param package_ids: the IDs and/or names of the packages
+    :returns: a dict of the given IDs/names -> PackageOwnership objects, packages which
+        can't be found are not included
+    """
+    model = context['model']
+    query = query_ownership(context, user).filter(
+        or_(model.Package.id.in_(package_ids), model.Package.name.in_(package_ids))
+    )
+    ownerships = {}
+    for row in query:
+        ownership = ownership_from_row(user, row)
+        ownerships[row.id] = ownership
+        ownerships[row.name] = ownership
+    return ownerships
+
+
+def get_resource_ownerships(context, user, resource_ids):
+    """
+    Retrieve the ownership details of the packages the given resources belong to in a
+    single query.
+
+    :param context: the context dict
+    :param user: A user object
+    :param resource_ids: the IDs of the resources
+    :returns: a dict of resource IDs -> PackageOwnership objects, resources which can't
+        be found are not included
+    """
+    model = context['model']
+    query = (
+        query_ownership(context, user)
+        .join(model.Resource, model.Resource.package_id == model.Package.id)
+        .add_columns(model.Resource.id.label('resource_id'))
+        .filter(model.Resource.id.in_(resource_ids))
+    )
+    return {row.resource_id: ownership_from_row(user, row) for row in query}
+
+
+def _get_collaborator_capacities(context, user, package_ids):
+    model = context['model']
+    query = model.Session.query(
+        model.PackageMember.package_id, model.PackageMember.capacity
+    ).filter(
+        model.PackageMember.user_id == user.id,
+        model.PackageMember.package_id.in_(package_ids),
+    )
+    return {row.package_id: row.capacity for row in query}
+
+
+class BatchDecider(object):
+    """
+    Decides whether a user has a permission on a package using data which has already
+    been loaded, so that the number of queries needed doesn't grow with the number of
+    packages.
+
+    The userdatasets ownership rules are applied first, exactly as in the auth
+    functions. Then CKAN's own rules are applied: the user's role in the owning
+    organisation, dataset collaborators, and the config options for datasets that
+    don't belong to an organisation. Group hierarchies, and auth functions chained by
+    other plugins, are not taken into account.
+    """
+
+    def __init__(self, user, collaborators):
+        """
+        :param user: A user object
+        :param collaborators: a dict of package IDs -> the user's collaborator capacity
+        """
+        self.user = user
+        self.collaborators = collaborators
+        self.update_roles = authz.get_roles_with_permission('update_dataset')
+        self.membership_roles = authz.get_roles_with_permission('membership')
+        self._can_create_unowned = None
+        self._can_create_in_some_org = None
+
+    @property
+    def can_create_unowned(self):
+        if self._can_create_unowned is None:
+            self._can_create_unowned = all(
+                authz.check_config_permission(p)
+                for p in (
+                    'create_dataset_if_not_in_organization',
+                    'create_unowned_dataset',
+                )
+            )
+        return self._can_create_unowned
+
+    @property
+    def can_create_in_some_org(self):
+        if self._can_create_in_some_org is None:
+            self._can_create_in_some_org = authz.has_user_permission_for_some_org(
+                self.user.name, 'create_dataset'
+            )
+        return self._can_create_in_some_org
+
+    def can_update(self, ownership):
+        """
+        Mirrors the package_update auth function.
+        """
+        if ownership.user_owns_package:
+            return True
+        if ownership.owner_org:
+            allowed = ownership.role in self.update_roles
+        else:
+            allowed = self.can_create_unowned or self.can_create_in_some_org
+        if not allowed and authz.check_config_permission('allow_dataset_collaborators'):
+            capacity = self.collaborators.get(ownership.package_id)
+            allowed = capacity in ('admin', 'editor')
+        return allowed
+
+    def can_manage_collaborators(self, ownership):
+        """
+        Mirrors the package_collaborator_* auth functions, which use CKAN's
+        can_manage_collaborators: the creator of a dataset which doesn't belong to an
+        organisation, an admin of the dataset's organisation, or an admin collaborator
+        on the dataset (whether or not allow_admin_collaborators is set) can manage its
+        collaborators.
+        """
+        if ownership.user_owns_package:
+            return True
+        if (
+            not ownership.owner_org
+            and self.can_create_unowned
+            and ownership.creator_user_id == self.user.id
+        ):
+            return True
+        if ownership.owner_org and ownership.role in self.membership_roles:
+            return True
+        return self.collaborators.get(ownership.package_id) == 'admin'
+
+    def decide(self, ownership, permission):
+        """
+        Decide whether the user has the given permission on the package.
+
+        :param ownership: a PackageOwnership object
+        :param permission: one of PERMISSIONS
+        :returns: True if the user has the permission, False if not
+        """
+        if permission == 'collaborator':
+            allowed = self.can_manage_collaborators(ownership)
+        else:
+            # package_delete and resource_create both defer to package_update in CKAN
+            allowed = self.can_update(ownership)
+        # the config permission checks can return None or strings
+        return bool(allowed)
+
+
+def check_access_batch(context, user, ids, permission, object_type='package'):
+    """
+    Decide whether the user has the given permission on each of the given packages (or
+    resources). This uses a fixed number of queries no matter how many IDs are passed.
+
+    :param context: the context dict
+    :param user: A user object
+    :param ids: a list of package IDs/names or resource IDs
+    :param permission: one of PERMISSIONS
+    :param object_type: 'package' or 'resource'
+    :returns: a dict of the given IDs -> True/False
+    """
+    if not ids:
+        return {}
+    if authz.is_sysadmin(user.name):
+        return {ref: True for ref in ids}
+    if user.is_deleted():
+        return {ref: False for ref in ids}
+
+    if object_type == 'resource':
+        ownerships = get_resource_ownerships(context, user, ids)
+    else:
+        ownerships = get_package_ownerships(context, user, ids)
+
+    collaborators = {}
+    # CKAN looks up admin collaborators for the collaborator permission even when
+    # dataset collaborators are disabled
+    if ownerships and (
+        permission == 'collaborator'
+        or authz.check_config_permission('allow_dataset_collaborators')
+    ):
+        package_ids = {ownership.package_id for ownership in ownerships.values()}
+        collaborators = _get_collaborator_capacities(context, user, package_ids)
+
+    decider = BatchDecider(user, collaborators)
+    return {
+        ref: ref in ownerships and decider.decide(ownerships[ref], permission)
+        for ref in ids
+    }
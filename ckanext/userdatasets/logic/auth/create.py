@@ -4,18 +4,19 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
-from ckan.authz import has_user_permission_for_some_org
-from ckan.logic.auth import get_package_object, get_resource_object
 from ckan.plugins import toolkit
 from ckantools.decorators import auth
 
+from ckanext.userdatasets.lib.auth_memo import not_memoised
 from ckanext.userdatasets.logic.auth.auth import (
-    user_owns_package_as_member,
+    get_package_ownership,
+    get_resource_ownership,
 )
-from ckanext.userdatasets.logic.utils import org_role_is_valid
+from ckanext.userdatasets.logic.utils import is_member_of_some_org, org_role_is_valid
 
 
 @auth()
+@not_memoised
 @toolkit.chained_auth_function
 def package_create(next_auth, context, data_dict):
     user = context['auth_user_obj']
@@ -27,7 +28,7 @@ def package_create(next_auth, context, data_dict):
         # create datasets for *some* organisation (see the ckan implementation), so
         # either if anonymous packages are allowed or if we have member status in any
         # organisation.
-        if has_user_permission_for_some_org(user.name, 'read'):
+        if is_member_of_some_org(user):
             return {'success': True}
 
     return next_auth(context, data_dict)
@@ -40,16 +41,16 @@ def resource_create(next_auth, context, data_dict):
 
     # can be routed from other auths without changing the params correctly
     package_id = data_dict.get('package_id')
-    if not package_id and data_dict.get('id'):
-        resource = get_resource_object(context, data_dict)
-        package_id = resource.package_id
-    if not package_id:
+    if package_id:
+        ownership = get_package_ownership(context, user, package_id)
+    elif data_dict.get('id'):
+        ownership = get_resource_ownership(context, user, data_dict['id'])
+    else:
         raise toolkit.ValidationError(
             toolkit._('No dataset id provided, cannot check auth.')
         )
 
-    package = get_package_object(context, {'id': package_id})
-    if user_owns_package_as_member(user, package):
+    if ownership.user_owns_package:
         return {'success': True}
     return next_auth(context, data_dict)
 
@@ -62,13 +63,13 @@ def resource_view_create(next_auth, context, data_dict):
     # not consistent with the rest of the API - so future proof it by catering for both
     # cases in case the API is made consistent (one way or the other) later.
     if data_dict and 'resource_id' in data_dict:
-        dc = {'id': data_dict['resource_id'], 'resource_id': data_dict['resource_id']}
+        resource_id = data_dict['resource_id']
     elif data_dict and 'id' in data_dict:
-        dc = {'id': data_dict['id'], 'resource_id': data_dict['id']}
+        resource_id = data_dict['id']
     else:
-        dc = data_dict
-    resource = get_resource_object(context, dc)
-    if user_owns_package_as_member(user, resource.package):
+        resource_id = None
+    ownership = get_resource_ownership(context, user, resource_id)
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -79,9 +80,16 @@ def resource_view_create(next_auth, context, data_dict):
 def package_collaborator_create(next_auth, context, data_dict):
     user = context['auth_user_obj']
 
-    package_id = data_dict.get('id')
-    package = get_package_object(context, {'id': package_id})
-    if user_owns_package_as_member(user, package):
+    ownership = get_package_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
+
+
+@auth()
+def userdatasets_package_create_bulk(context, data_dict):
+    # the action checks package_create for each organisation in the batch
+    if context['auth_user_obj'] is None:
+        return {'success': False, 'msg': toolkit._('You must be logged in.')}
+    return {'success': True}
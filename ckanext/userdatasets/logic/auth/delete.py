@@ -4,13 +4,13 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
-from ckan.logic.auth import get_package_object, get_resource_object
 from ckan.plugins import toolkit
 from ckantools.decorators import auth
 
 from ckanext.userdatasets.logic.auth.auth import (
-    get_resource_view_object,
-    user_owns_package_as_member,
+    get_package_ownership,
+    get_resource_ownership,
+    get_resource_view_ownership,
 )
 
 
@@ -18,9 +18,8 @@ from ckanext.userdatasets.logic.auth.auth import (
 @toolkit.chained_auth_function
 def package_delete(next_auth, context, data_dict):
     user = context['auth_user_obj']
-    package = get_package_object(context, data_dict)
-
-    if user_owns_package_as_member(user, package):
+    ownership = get_package_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -30,9 +29,8 @@ def package_delete(next_auth, context, data_dict):
 @toolkit.chained_auth_function
 def resource_delete(next_auth, context, data_dict):
     user = context['auth_user_obj']
-    resource = get_resource_object(context, data_dict)
-    package = resource.package
-    if user_owns_package_as_member(user, package):
+    ownership = get_resource_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -42,9 +40,8 @@ def resource_delete(next_auth, context, data_dict):
 @toolkit.chained_auth_function
 def resource_view_delete(next_auth, context, data_dict):
     user = context['auth_user_obj']
-    resource_view = get_resource_view_object(context, data_dict)
-    resource = get_resource_object(context, {'id': resource_view.resource_id})
-    if user_owns_package_as_member(user, resource.package):
+    ownership = get_resource_view_ownership(context, user, data_dict)
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -55,9 +52,8 @@ def resource_view_delete(next_auth, context, data_dict):
 def package_collaborator_delete(next_auth, context, data_dict):
     user = context['auth_user_obj']
 
-    package_id = data_dict.get('id')
-    package = get_package_object(context, {'id': package_id})
-    if user_owns_package_as_member(user, package):
+    ownership = get_package_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
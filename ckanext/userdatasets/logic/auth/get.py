@@ -4,12 +4,13 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
-from ckan.logic.auth import get_package_object
+from ckan.lib.jobs import job_from_id
 from ckan.plugins import toolkit
 from ckantools.decorators import auth
 
+from ckanext.userdatasets.lib.transfer import PROGRESS
 from ckanext.userdatasets.logic.auth.auth import (
-    user_owns_package_as_member,
+    get_package_ownership,
 )
 
 
@@ -18,9 +19,79 @@ from ckanext.userdatasets.logic.auth.auth import (
 def package_collaborator_list(next_auth, context, data_dict):
     user = context['auth_user_obj']
 
-    package_id = data_dict.get('id')
-    package = get_package_object(context, {'id': package_id})
-    if user_owns_package_as_member(user, package):
+    ownership = get_package_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
+
+
+@auth()
+def userdatasets_check_access_batch(context, data_dict):
+    # sysadmins never get this far, so anyone else can only check their own access
+    user = context['auth_user_obj']
+    if user is None:
+        return {'success': False, 'msg': toolkit._('You must be logged in.')}
+    other_user = data_dict.get('user')
+    if other_user and other_user not in (user.id, user.name):
+        return {
+            'success': False,
+            'msg': toolkit._('Only sysadmins can check access for other users.'),
+        }
+    return {'success': True}
+
+
+@auth()
+def userdatasets_organization_list_for_user(context, data_dict):
+    # the same as core's organization_list_for_user
+    return {'success': True}
+
+
+@auth()
+def userdatasets_query_stats(context, data_dict):
+    # sysadmins never get this far
+    return {
+        'success': False,
+        'msg': toolkit._('Only sysadmins can view query stats.'),
+    }
+
+
+@auth()
+def userdatasets_metrics(context, data_dict):
+    # sysadmins never get this far
+    return {
+        'success': False,
+        'msg': toolkit._('Only sysadmins can view metrics.'),
+    }
+
+
+@auth()
+def userdatasets_transfer_ownership_status(context, data_dict):
+    # sysadmins never get this far, anyone else can only see the jobs they started
+    user = context['auth_user_obj']
+    try:
+        job = job_from_id(data_dict.get('job_id'))
+    except KeyError:
+        raise toolkit.ObjectNotFound(toolkit._('Job not found'))
+    progress = job.meta.get(PROGRESS, {})
+    if user is not None and progress.get('requested_by') == user.id:
+        return {'success': True}
+    return {
+        'success': False,
+        'msg': toolkit._('Only the user who started a job can see its progress.'),
+    }
+
+
+@auth()
+def userdatasets_owned_package_list(context, data_dict):
+    # sysadmins never get this far, so anyone else can only list their own datasets
+    user = context['auth_user_obj']
+    if user is None:
+        return {'success': False, 'msg': toolkit._('You must be logged in.')}
+    other_user = data_dict.get('user')
+    if other_user and other_user not in (user.id, user.name):
+        return {
+            'success': False,
+            'msg': toolkit._('Only sysadmins can list the datasets of other users.'),
+        }
+    return {'success': True}
@@ -4,22 +4,30 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
-from ckan.logic.auth import get_package_object, get_resource_object
+from ckan import authz
 from ckan.plugins import toolkit
 from ckantools.decorators import auth
 
 from ckanext.userdatasets.logic.auth.auth import (
-    get_resource_view_object,
-    user_owns_package_as_member,
+    PACKAGE_UPDATE_AUTHORISED,
+    get_package_ownership,
+    get_resource_ownership,
+    get_resource_view_ownership,
 )
 
 
 @auth()
 @toolkit.chained_auth_function
 def package_update(next_auth, context, data_dict):
+    # the package_update action has already run this check, this is core checking
+    # again (the record is removed so that it only applies to this one check)
+    authorised_id = context.pop(PACKAGE_UPDATE_AUTHORISED, None)
+    if authorised_id is not None and authorised_id == data_dict.get('id'):
+        return {'success': True}
+
     user = context['auth_user_obj']
-    package = get_package_object(context, data_dict)
-    if user_owns_package_as_member(user, package):
+    ownership = get_package_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -29,9 +37,8 @@ def package_update(next_auth, context, data_dict):
 @toolkit.chained_auth_function
 def resource_update(next_auth, context, data_dict):
     user = context['auth_user_obj']
-    resource = get_resource_object(context, data_dict)
-    package = resource.package
-    if user_owns_package_as_member(user, package):
+    ownership = get_resource_ownership(context, user, data_dict.get('id'))
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
@@ -41,9 +48,37 @@ def resource_update(next_auth, context, data_dict):
 @toolkit.chained_auth_function
 def resource_view_update(next_auth, context, data_dict):
     user = context['auth_user_obj']
-    resource_view = get_resource_view_object(context, data_dict)
-    resource = get_resource_object(context, {'id': resource_view.resource_id})
-    if user_owns_package_as_member(user, resource.package):
+    ownership = get_resource_view_ownership(context, user, data_dict)
+    if ownership.user_owns_package:
         return {'success': True}
 
     return next_auth(context, data_dict)
+
+
+@auth()
+def userdatasets_resource_bulk(context, data_dict):
+    # the action checks resource_create and package_update for the dataset
+    if context['auth_user_obj'] is None:
+        return {'success': False, 'msg': toolkit._('You must be logged in.')}
+    return {'success': True}
+
+
+@auth()
+def userdatasets_transfer_ownership(context, data_dict):
+    # sysadmins never get this far, anyone else must be an admin of the organisation
+    user = context['auth_user_obj']
+    owner_org = data_dict.get('owner_org')
+    if (
+        user is not None
+        and owner_org
+        and authz.has_user_permission_for_group_or_org(
+            owner_org, user.name, 'manage_group'
+        )
+    ):
+        return {'success': True}
+    return {
+        'success': False,
+        'msg': toolkit._(
+            'Only organisation admins can transfer the ownership of its datasets.'
+        ),
+    }
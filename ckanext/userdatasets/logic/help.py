@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+userdatasets_check_access_batch = """
+Checks whether a user has a permission on each of a list of datasets (or resources),
+using a fixed number of database queries regardless of how many IDs are passed.
+
+The decisions follow the same rules as the package_update, package_delete,
+resource_create and package_collaborator_* auth functions: organisation members can
+manage the datasets they created, and CKAN's own organisation role and collaborator
+rules apply. Group hierarchies and auth functions added by other plugins are not taken
+into account; use check_access for a definitive answer in those cases.
+
+Params:
+
+:param ids: the IDs (or names) of the datasets, or the IDs of the resources (no more
+    than the ckanext.userdatasets.bulk.max_size config option, or 1000)
+:type ids: list of strings
+:param permission: the permission to check, one of "update", "delete",
+    "resource_create" or "collaborator" (optional, default: "update")
+:type permission: string
+:param object_type: the type of object the ids refer to, "package" or "resource"
+    (optional, default: "package")
+:type object_type: string
+:param user: the name or ID of the user to check, only sysadmins can check for users
+    other than themselves (optional, default: the current user)
+:type user: string
+
+Returns:
+
+:rtype: dict
+:returns: a dict of each ID passed -> true or false. IDs which don't exist are false.
+"""
+
+userdatasets_organization_list_for_user = """
+A lighter version of organization_list_for_user which returns only the ID and name of
+each organisation the user has the given permission in, instead of a full
+organisation dict. As with organization_list_for_user, members are treated as having
+the create_dataset, update_dataset and delete_dataset permissions.
+
+Params:
+
+:param id: the name or ID of the user to list the organisations of (optional,
+    default: the current user)
+:type id: string
+:param permission: the permission the user must have in the organisations (optional,
+    default: "manage_group")
+:type permission: string
+
+Returns:
+
+:rtype: list of dicts
+:returns: a list of dicts with "id" and "name" keys, ordered by name
+"""
+
+userdatasets_query_stats = """
+Returns the number of database queries made, and the time spent on them, by each of
+this extension's actions and auth functions. Instrumentation must be enabled in the
+config. The totals are for the process which handles the request only and cover the
+calls sampled since it started. Only sysadmins can call this action.
+
+Queries are attributed to the innermost instrumented function running when they are
+made, so an action's totals don't include the queries made by the auth functions it
+calls. Functions are named "action:<name>" or "auth:<name>".
+
+Params:
+
+:param function: only include functions whose name contains this string (optional)
+:type function: string
+
+Returns:
+
+:rtype: dict
+:returns: a dict with "enabled", "since" (a timestamp), "sample_rate" and "functions"
+    keys. "functions" is a dict of function names -> dicts of "calls", "queries",
+    "db_time_ms", "max_queries", "max_db_time_ms" and "slow_calls" (the number of calls
+    which crossed a threshold and were logged). If instrumentation is disabled, only
+    "enabled" is returned.
+"""
+
+userdatasets_package_create_bulk = """
+Creates many datasets in one call. Each dataset is created by package_create, so the
+same validation, plugin hooks and member-may-create rules apply, but:
+
+    - the user's organisation roles are looked up once per request rather than once
+      per dataset
+    - the package schema is built once per dataset type
+    - the datasets are committed in chunks rather than one at a time, and each chunk is
+      indexed once it's committed
+
+Each dataset is checked and validated before it's created, and is created in its own
+savepoint, so one which fails validation (or hits a database error) doesn't affect the
+others. If committing a chunk fails, every dataset in that chunk is reported as failed,
+as are the earlier datasets in a chunk if package_create rolls back the whole
+transaction.
+
+Params:
+
+:param datasets: the dataset dicts, as they would be passed to package_create
+:type datasets: list of dicts
+:param chunk_size: the number of datasets to create between commits (optional,
+    default: the ckanext.userdatasets.bulk.chunk_size config option, or 100)
+:type chunk_size: int
+
+Returns:
+
+:rtype: dict
+:returns: a dict with "created" and "failed" counts and a "results" list, with one
+    entry for each dataset passed in the same order. Each entry is a dict with a
+    "success" key and either the new dataset's "id" or an "error" dict.
+"""
+
+userdatasets_resource_bulk = """
+Creates and updates many of a dataset's resources at once. Permission is checked
+once for the dataset, using the same rules as resource_create and resource_update, and
+all of the changes are applied with a single package_update, so the dataset is only
+saved (and indexed) once. Either all of the changes are made, or none of them are.
+
+As with package_update, file uploads aren't supported and IResourceController hooks
+aren't called. Updated resources are replaced with the dicts passed, as they are by
+resource_update.
+
+Params:
+
+:param package_id: the ID or name of the dataset
+:type package_id: string
+:param create: the resources to add to the end of the dataset's resources (optional)
+:type create: list of dicts
+:param update: the resources to update, each of which must include the "id" of a
+    different one of the dataset's resources (optional)
+:type update: list of dicts
+
+Returns:
+
+:rtype: dict
+:returns: a dict with "created" and "updated" keys, each a list of the resource dicts
+    after the changes, in the order they were passed
+"""
+
+userdatasets_transfer_ownership = """
+Starts a background job which makes one user the creator of the datasets another user
+created, e.g. because the original creator has left the organisation and so can no
+longer manage them, and nor can the organisation's other members. The datasets are
+updated and reindexed in chunks. Each chunk is removed from the package cache in every
+process and, if the audit log is enabled, recorded in it.
+
+Sysadmins can transfer datasets in any organisation, or in all of them at once;
+organisation admins can transfer the datasets in their organisations. The new creator
+must be a member (or editor or admin) of the organisation.
+
+Params:
+
+:param from_user: the name or ID of the user who created the datasets
+:type from_user: string
+:param to_user: the name or ID of the user to make the creator
+:type to_user: string
+:param owner_org: the name or ID of the organisation to transfer the datasets in
+    (required unless the user is a sysadmin, default: every organisation to_user is
+    a member of)
+:type owner_org: string
+:param chunk_size: the number of datasets to update in each transaction (optional,
+    default: the ckanext.userdatasets.transfer.chunk_size config option, or 500)
+:type chunk_size: int
+
+Returns:
+
+:rtype: dict
+:returns: a dict with the "job_id" of the background job, which can be passed to
+    userdatasets_transfer_ownership_status
+"""
+
+userdatasets_transfer_ownership_status = """
+Reports the progress of a job started by userdatasets_transfer_ownership. Only
+sysadmins and the user who started the job can see it.
+
+Params:
+
+:param job_id: the ID of the job
+:type job_id: string
+
+Returns:
+
+:rtype: dict
+:returns: a dict with the job's "status" (queued, started, finished or failed), the
+    "total" number of datasets to transfer (once the job has started) and the number
+    "transferred" so far
+"""
+
+userdatasets_owned_package_list = """
+Lists the datasets a user owns under the userdatasets rules, i.e. the active datasets
+they created in the organisations they're a member, editor or admin of. The datasets
+are ordered from the most recently modified and paged with a cursor, so each page is
+as quick to fetch as the first however many datasets the user has created.
+
+Only sysadmins can list the datasets of another user.
+
+Params:
+
+:param user: the name or ID of the user (optional, default: the current user)
+:type user: string
+:param owner_org: the name or ID of an organisation to only list the datasets in
+    (optional)
+:type owner_org: string
+:param fields: the fields to return for each dataset, from id, name,
+    metadata_modified, title, owner_org, private and type (optional, default: id,
+    name and metadata_modified)
+:type fields: list of strings
+:param limit: the maximum number of datasets to return (optional, default: the
+    ckanext.userdatasets.owned_package_list.limit config option, or 100, and no more
+    than ckanext.userdatasets.owned_package_list.max_limit, or 1000)
+:type limit: int
+:param cursor: the next_cursor returned with the previous page, to get the page
+    after it (optional)
+:type cursor: string
+
+Returns:
+
+:rtype: dict
+:returns: a dict with the "results", a list of dataset dicts, and the "next_cursor"
+    to pass to get the next page, which is null on the last page
+"""
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import threading
+
+import ckan.lib.plugins as lib_plugins
+from ckan.logic.validators import owner_org_validator as default_owner_org_validator
+from ckan.plugins import toolkit
+from ckantools.validators import list_of_strings
+
+from ckanext.userdatasets.logic.auth.batch import OBJECT_TYPES, PERMISSIONS
+from ckanext.userdatasets.logic.validators import list_of_dicts, owner_org_validator
+
+# patched schemas, keyed on (package type, action)
+_schemas = {}
+_lock = threading.Lock()
+
+
+def patch_owner_org_validator(schema):
+    """
+    Replace CKAN's owner_org_validator with our own in the given schema. The schema is
+    modified in place.
+
+    :param schema: a package schema dict
+    :returns: the schema
+    """
+    if 'owner_org' in schema:
+        schema['owner_org'] = [
+            owner_org_validator if f is default_owner_org_validator else f
+            for f in schema['owner_org']
+        ]
+    return schema
+
+
+def copy_schema(schema):
+    """
+    Copy the given schema so that the copy can be modified without affecting the
+    original. Only the dicts and lists are copied, the validators themselves are shared.
+    This is a lot quicker than a deepcopy.
+
+    :param schema: a schema dict
+    :returns: a copy of the schema
+    """
+    return {
+        key: list(value)
+        if isinstance(value, list)
+        else copy_schema(value)
+        if isinstance(value, dict)
+        else value
+        for key, value in schema.items()
+    }
+
+
+def _build_package_schema(package_type, action):
+    package_plugin = lib_plugins.lookup_package_plugin(package_type)
+    if action == 'create':
+        schema = package_plugin.create_package_schema()
+    else:
+        schema = package_plugin.update_package_schema()
+    return patch_owner_org_validator(schema)
+
+
+def get_package_schema(package_type, action):
+    """
+    Returns the schema for the given package type and action, with our
+    owner_org_validator swapped in. Building the schema can be relatively expensive so
+    the patched schema is cached and a copy of it returned, unless the cache has been
+    disabled in the config.
+
+    :param package_type: the package type (can be None to use the default)
+    :param action: either 'create' or 'update'
+    :returns: a schema dict which the caller is free to modify
+    """
+    if not toolkit.asbool(
+        toolkit.config.get('ckanext.userdatasets.schema_cache.enabled', True)
+    ):
+        return _build_package_schema(package_type, action)
+
+    key = (package_type, action)
+    schema = _schemas.get(key)
+    if schema is None:
+        with _lock:
+            schema = _schemas.get(key)
+            if schema is None:
+                schema = _schemas[key] = _build_package_schema(package_type, action)
+    return copy_schema(schema)
+
+
+def clear_schema_cache():
+    """
+    Remove all the cached schemas. This should be called whenever the set of loaded
+    plugins changes, as a new plugin could provide a different schema.
+    """
+    with _lock:
+        _schemas.clear()
+
+
+def userdatasets_check_access_batch():
+    """
+    Returns the schema for the userdatasets_check_access_batch action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    not_missing = toolkit.get_validator('not_missing')
+    one_of = toolkit.get_validator('one_of')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    return {
+        'ids': [not_missing, list_of_strings()],
+        'permission': [ignore_missing, one_of(PERMISSIONS)],
+        'object_type': [ignore_missing, one_of(OBJECT_TYPES)],
+        'user': [ignore_missing, unicode_safe],
+    }
+
+
+def userdatasets_organization_list_for_user():
+    """
+    Returns the schema for the userdatasets_organization_list_for_user action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    return {
+        'id': [ignore_missing, unicode_safe],
+        'permission': [ignore_missing, unicode_safe],
+    }
+
+
+def userdatasets_query_stats():
+    """
+    Returns the schema for the userdatasets_query_stats action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    return {
+        'function': [ignore_missing, unicode_safe],
+    }
+
+
+def userdatasets_package_create_bulk():
+    """
+    Returns the schema for the userdatasets_package_create_bulk action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    not_missing = toolkit.get_validator('not_missing')
+    int_validator = toolkit.get_validator('int_validator')
+    is_positive_integer = toolkit.get_validator('is_positive_integer')
+    return {
+        'datasets': [not_missing, list_of_dicts],
+        'chunk_size': [ignore_missing, int_validator, is_positive_integer],
+    }
+
+
+def userdatasets_resource_bulk():
+    """
+    Returns the schema for the userdatasets_resource_bulk action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    not_empty = toolkit.get_validator('not_empty')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    return {
+        'package_id': [not_empty, unicode_safe],
+        'create': [ignore_missing, list_of_dicts],
+        'update': [ignore_missing, list_of_dicts],
+    }
+
+
+def userdatasets_transfer_ownership():
+    """
+    Returns the schema for the userdatasets_transfer_ownership action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    not_empty = toolkit.get_validator('not_empty')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    int_validator = toolkit.get_validator('int_validator')
+    is_positive_integer = toolkit.get_validator('is_positive_integer')
+    return {
+        'from_user': [not_empty, unicode_safe],
+        'to_user': [not_empty, unicode_safe],
+        'owner_org': [ignore_missing, unicode_safe],
+        'chunk_size': [ignore_missing, int_validator, is_positive_integer],
+    }
+
+
+def userdatasets_transfer_ownership_status():
+    """
+    Returns the schema for the userdatasets_transfer_ownership_status action.
+    """
+    not_empty = toolkit.get_validator('not_empty')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    return {
+        'job_id': [not_empty, unicode_safe],
+    }
+
+
+def userdatasets_owned_package_list():
+    """
+    Returns the schema for the userdatasets_owned_package_list action.
+    """
+    ignore_missing = toolkit.get_validator('ignore_missing')
+    unicode_safe = toolkit.get_validator('unicode_safe')
+    int_validator = toolkit.get_validator('int_validator')
+    is_positive_integer = toolkit.get_validator('is_positive_integer')
+    return {
+        'user': [ignore_missing, unicode_safe],
+        'owner_org': [ignore_missing, unicode_safe],
+        'fields': [ignore_missing, list_of_strings()],
+        'limit': [ignore_missing, int_validator, is_positive_integer],
+        'cursor': [ignore_missing, unicode_safe],
+    }
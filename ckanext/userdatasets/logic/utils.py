@@ -4,18 +4,134 @@
 # This file is part of ckanext-userdatasets
 # Created by the Natural History Museum in London, UK
 
-from ckan.authz import users_role_for_group_or_org
+from ckan import model
+from ckan.authz import get_roles_with_permission, users_role_for_group_or_org
+
+from ckanext.userdatasets.lib.membership import ROLE_MEMO, get_membership_cache
+from ckanext.userdatasets.lib.memo import get_request_memo
+from ckanext.userdatasets.lib.snapshot import get_snapshot_role
+
+# the roles which allow a user to create datasets and manage their own datasets
+VALID_ROLES = ('member', 'editor', 'admin')
+
+# the pseudo group under which whether the user is in any organisation is stored
+ANY_ORG = '*'
+
+_missing = object()
+
+
+def _cached_lookup(group_key, username, lookup):
+    """
+    Look up a value for the given user using the request memo, then the membership
+    cache, and finally by calling the given lookup function. The value is stored in
+    whichever of the memo and cache are available.
+
+    :param group_key: the group (or pseudo group) part of the key
+    :param username: the user part of the key
+    :param lookup: a function which takes no arguments and returns a role or None
+    :returns: the role name or None
+    """
+    key = (group_key, username)
+    memo = get_request_memo(ROLE_MEMO)
+    if memo is not None:
+        role = memo.get(key, _missing)
+        if role is not _missing:
+            return role
+
+    cache = get_membership_cache()
+    role = _missing if cache is None else cache.get(*key, default=_missing)
+    if role is _missing:
+        role = lookup()
+        if cache is not None:
+            cache.set(group_key, username, role)
+
+    if memo is not None:
+        memo[key] = role
+    return role
+
+
+def get_role(group_or_org_id, username):
+    """
+    Retrieve the given user's role in the specified group or organisation. The result
+    is memoised for the duration of the current request (if there is one) so that the
+    auth functions and validators which check the same membership repeatedly only
+    query the database once. If the membership cache is enabled, it is checked before
+    the database is queried.
+
+    :param group_or_org_id: ID of a group or organisation
+    :param username: username for the user to check
+    :returns: the role name or None if the user has no role
+    """
+    return _cached_lookup(
+        group_or_org_id,
+        username,
+        lambda: users_role_for_group_or_org(group_or_org_id, username),
+    )
+
+
+def _query_any_org_role(user):
+    roles = get_roles_with_permission('read')
+    if not roles:
+        return None
+    return (
+        model.Session.query(model.Member.capacity)
+        .join(model.Group, model.Group.id == model.Member.group_id)
+        .filter(
+            model.Member.table_name == 'user',
+            model.Member.table_id == user.id,
+            model.Member.state == 'active',
+            model.Member.capacity.in_(roles),
+            model.Group.is_organization == True,  # noqa: E712
+            model.Group.state == 'active',
+        )
+        .limit(1)
+        .scalar()
+    )
+
+
+def is_member_of_some_org(user):
+    """
+    Determine whether the given user has a role in any active organisation. This is
+    the same as has_user_permission_for_some_org(user.name, 'read') but stops at the
+    first membership found rather than loading all of them, and the answer is
+    memoised and cached alongside the user's roles (so it is invalidated with them).
+
+    :param user: A user object
+    :returns: True if the user is a member, editor or admin of some organisation
+    """
+    if user.sysadmin:
+        return True
+    role = _cached_lookup(ANY_ORG, user.name, lambda: _query_any_org_role(user))
+    return role is not None
+
+
+def remember_role(group_or_org_id, username, role):
+    """
+    Store a role which has been retrieved by some other means (e.g. as part of a larger
+    query) so that subsequent calls to get_role in this request don't query for it
+    again.
+
+    :param group_or_org_id: ID of a group or organisation
+    :param username: username for the user
+    :param role: the role name or None if the user has no role
+    """
+    memo = get_request_memo(ROLE_MEMO)
+    if memo is not None:
+        memo[(group_or_org_id, username)] = role
 
 
 def org_role_is_valid(group_or_org_id, username):
     """
     Determine whether the given user has a valid role in the specified group or
-    organisation.
+    organisation. If the membership snapshot is enabled and holds the organisation
+    and user, it is used instead of looking up the role.
 
     :param group_or_org_id: ID of a group or organisation
     :param username: username for the user to check
     :returns: True if the role is valid (member, editor, or admin), False otherwise
     :rtype: bool
     """
-    role = users_role_for_group_or_org(group_or_org_id, username)
-    return role in ['member', 'editor', 'admin']
+    role = get_snapshot_role(group_or_org_id, username, _missing)
+    if role is _missing:
+        role = get_role(group_or_org_id, username)
+    return role in VALID_ROLES
@@ -22,3 +22,15 @@ def owner_org_validator(key, data, errors, context):
             return
 
     default_owner_org_validator(key, data, errors, context)
+
+
+def list_of_dicts(value):
+    """
+    Checks that the value is a list of dicts.
+
+    :param value: the value
+    :returns: the value
+    """
+    if not isinstance(value, list) or not all(isinstance(v, dict) for v in value):
+        raise toolkit.Invalid('Must be a list of dicts')
+    return value
@@ -0,0 +1,42 @@
+"""
+Add indexes for the ownership queries.
+
+Revision ID: 3cdd7ffc6022
+Revises:
+Create Date: 2026-10-18 10:12:41.519204
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3cdd7ffc6022'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS is used so that the indexes can be created CONCURRENTLY by hand
+    # beforehand on large sites, as this migration runs in a transaction and will lock
+    # the tables while the indexes are built
+
+    # used to find a user's memberships, both on their own and when joined to the
+    # package table in the ownership queries; the capacity is included so that the role
+    # can be read straight from the index
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS idx_userdatasets_member_user_active '
+        'ON member (table_id, group_id, capacity) '
+        "WHERE table_name = 'user' AND state = 'active'"
+    )
+    # used to find the datasets in an organisation, and the datasets a user created in
+    # an organisation
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS idx_userdatasets_package_owner_org_creator '
+        'ON package (owner_org, creator_user_id)'
+    )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS idx_userdatasets_package_owner_org_creator')
+    op.execute('DROP INDEX IF EXISTS idx_userdatasets_member_user_active')
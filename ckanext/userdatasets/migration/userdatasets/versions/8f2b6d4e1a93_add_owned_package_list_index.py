@@ -0,0 +1,33 @@
+"""
+Add an index for listing the datasets a user owns.
+
+Revision ID: 8f2b6d4e1a93
+Revises: 3cdd7ffc6022
+Create Date: 2026-10-18 16:40:12.308715
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8f2b6d4e1a93'
+down_revision = '3cdd7ffc6022'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # as in the previous migration, IF NOT EXISTS lets the index be created
+    # CONCURRENTLY by hand beforehand on large sites
+
+    # used by userdatasets_owned_package_list to read a user's datasets in the order
+    # they're listed, so each page only reads the rows it returns
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS idx_userdatasets_package_creator_modified '
+        'ON package (creator_user_id, metadata_modified DESC, id DESC) '
+        "WHERE state = 'active'"
+    )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS idx_userdatasets_package_creator_modified')
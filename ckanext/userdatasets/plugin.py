@@ -5,7 +5,7 @@
 # Created by the Natural History Museum in London, UK
 
 
-from ckan.plugins import SingletonPlugin, implements, interfaces
+from ckan.plugins import SingletonPlugin, implements, interfaces, toolkit
 from ckantools.loaders import create_actions, create_auth
 
 
@@ -20,15 +20,37 @@ class UserDatasetsPlugin(SingletonPlugin):
 
     implements(interfaces.IAuthFunctions)
     implements(interfaces.IActions)
+    implements(interfaces.IConfigurable)
+    implements(interfaces.IPluginObserver, inherit=True)
+    implements(interfaces.ITemplateHelpers)
+    implements(interfaces.IPackageController, inherit=True)
+    implements(interfaces.IBlueprint)
 
     # IAuthFunctions
     def get_auth_functions(self):
         """
         Implementation of IAuthFunctions.get_auth_functions.
         """
+        from ckanext.userdatasets.lib.auth_memo import memoise
+        from ckanext.userdatasets.lib.instrumentation import instrument
+        from ckanext.userdatasets.lib.metrics import timed_auth
         from ckanext.userdatasets.logic.auth import create, delete, get, update
 
         auth = create_auth(create, delete, update, get)
+        if toolkit.asbool(toolkit.config.get('ckanext.userdatasets.metrics.enabled')):
+            # timed before memoising so that only real decisions are counted
+            auth = {name: timed_auth(name, function) for name, function in auth.items()}
+        if toolkit.asbool(
+            toolkit.config.get('ckanext.userdatasets.auth_memo.enabled', True)
+        ):
+            auth = {name: memoise(name, function) for name, function in auth.items()}
+        if toolkit.asbool(
+            toolkit.config.get('ckanext.userdatasets.instrumentation.enabled')
+        ):
+            auth = {
+                name: instrument(f'auth:{name}', function)
+                for name, function in auth.items()
+            }
         return auth
 
     # IActions
@@ -36,7 +58,141 @@ class UserDatasetsPlugin(SingletonPlugin):
         """
         Implementation of IActions.get_actions.
         """
-        from ckanext.userdatasets.logic.action import create, get, update
+        from ckanext.userdatasets.lib.instrumentation import instrument
+        from ckanext.userdatasets.lib.metrics import timed_action
+        from ckanext.userdatasets.logic.action import create, delete, get, update
 
-        actions = create_actions(create, get, update)
+        actions = create_actions(create, delete, get, update)
+        if toolkit.asbool(toolkit.config.get('ckanext.userdatasets.metrics.enabled')):
+            actions = {
+                name: timed_action(name, function) for name, function in actions.items()
+            }
+        if toolkit.asbool(
+            toolkit.config.get('ckanext.userdatasets.instrumentation.enabled')
+        ):
+            actions = {
+                name: instrument(f'action:{name}', function)
+                for name, function in actions.items()
+            }
         return actions
+
+    # IConfigurable
+    def configure(self, config):
+        """
+        Implementation of IConfigurable.configure.
+        """
+        from ckanext.userdatasets.lib import (
+            audit,
+            instrumentation,
+            invalidation,
+            membership,
+            metrics,
+            negative,
+            org_list,
+            packages,
+            snapshot,
+        )
+
+        invalidation.configure(config)
+        membership.configure(config)
+        org_list.configure(config)
+        packages.configure(config)
+        negative.configure(config)
+        snapshot.configure(config)
+        instrumentation.configure(config)
+        metrics.configure(config)
+        audit.configure(config)
+
+    # IPluginObserver
+    def after_load(self, service):
+        """
+        Implementation of IPluginObserver.after_load.
+        """
+        from ckanext.userdatasets.logic.schema import clear_schema_cache
+
+        clear_schema_cache()
+
+    def after_unload(self, service):
+        """
+        Implementation of IPluginObserver.after_unload.
+        """
+        from ckanext.userdatasets.logic.schema import clear_schema_cache
+
+        clear_schema_cache()
+
+    # ITemplateHelpers
+    def get_helpers(self):
+        """
+        Implementation of ITemplateHelpers.get_helpers.
+        """
+        from ckanext.userdatasets.lib import helpers
+
+        return {'userdatasets_editable_ids': helpers.userdatasets_editable_ids}
+
+    # IBlueprint
+    def get_blueprint(self):
+        """
+        Implementation of IBlueprint.get_blueprint.
+        """
+        from ckanext.userdatasets import routes
+
+        return routes.blueprints
+
+    # IPackageController
+    def before_dataset_index(self, pkg_dict):
+        """
+        Implementation of IPackageController.before_dataset_index.
+        """
+        from ckanext.userdatasets.lib.search import ensure_index_fields
+
+        return ensure_index_fields(pkg_dict)
+
+    def before_dataset_search(self, search_params):
+        """
+        Implementation of IPackageController.before_dataset_search.
+        """
+        from ckanext.userdatasets.lib.search import apply_editable_filter
+
+        return apply_editable_filter(search_params)
+
+    def after_dataset_create(self, context, pkg_dict):
+        """
+        Implementation of IPackageController.after_dataset_create.
+        """
+        from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+        from ckanext.userdatasets.lib.negative import discard_missing_package
+        from ckanext.userdatasets.lib.packages import invalidate_package
+
+        # the name may have been cached pointing at a purged package
+        invalidate_package(pkg_dict)
+        discard_missing_package(pkg_dict)
+        clear_auth_memo()
+
+    def after_dataset_update(self, context, pkg_dict):
+        """
+        Implementation of IPackageController.after_dataset_update.
+        """
+        from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+        from ckanext.userdatasets.lib.negative import discard_missing_package
+        from ckanext.userdatasets.lib.packages import invalidate_package
+
+        invalidate_package(pkg_dict)
+        discard_missing_package(pkg_dict)
+        clear_auth_memo()
+
+    def after_dataset_delete(self, context, pkg_dict):
+        """
+        Implementation of IPackageController.after_dataset_delete.
+        """
+        from ckanext.userdatasets.lib.auth_memo import clear_auth_memo
+        from ckanext.userdatasets.lib.packages import invalidate_package
+
+        invalidate_package(pkg_dict)
+        clear_auth_memo()
+
+    # CKAN < 2.10 uses the old names for these hooks
+    before_index = before_dataset_index
+    before_search = before_dataset_search
+    after_create = after_dataset_create
+    after_update = after_dataset_update
+    after_delete = after_dataset_delete
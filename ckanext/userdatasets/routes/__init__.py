@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from . import metrics
+
+blueprints = [metrics.blueprint]
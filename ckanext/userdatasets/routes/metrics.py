@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from ckan.plugins import toolkit
+from flask import Blueprint, Response
+
+from ckanext.userdatasets.lib.metrics import get_metrics, render
+
+blueprint = Blueprint(name='userdatasets_metrics', import_name=__name__)
+
+# the content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@blueprint.route('/userdatasets/metrics')
+def metrics():
+    """
+    Serves the metrics in the Prometheus text format, either this process's or, if
+    they're shared, the totals for all the worker processes. Only sysadmins can view
+    them.
+    """
+    if get_metrics() is None:
+        toolkit.abort(404)
+    context = {'user': toolkit.g.user, 'auth_user_obj': toolkit.g.userobj}
+    try:
+        toolkit.check_access('userdatasets_metrics', context, {})
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, toolkit._('Only sysadmins can view metrics.'))
+    return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.userdatasets.lib import audit
+from ckanext.userdatasets.lib.audit import BLOCK, DROP, AuditLog
+from ckanext.userdatasets.logic.action.delete import package_delete
+from ckanext.userdatasets.logic.auth.auth import PackageOwnership
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_events_written_in_batches(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    audit_log = AuditLog(path, 100, 2, 0.01, DROP)
+    with patch.object(audit_log, '_write', wraps=audit_log._write) as write:
+        for i in range(5):
+            audit_log.record({'event': i})
+        audit_log.flush()
+    assert [event['event'] for event in read_events(path)] == list(range(5))
+    assert all(len(call.args[0]) <= 2 for call in write.call_args_list)
+    assert audit_log.written == 5
+    audit_log.close()
+
+
+def test_close_writes_queued_events(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    audit_log = AuditLog(path, 100, 100, 60, DROP)
+    audit_log.record({'event': 1})
+    audit_log.close()
+    assert read_events(path) == [{'event': 1}]
+    assert not audit_log._thread.is_alive()
+
+
+@pytest.mark.parametrize('policy', [DROP, BLOCK])
+def test_full_queue(tmp_path, policy):
+    path = str(tmp_path / 'audit.jsonl')
+    audit_log = AuditLog(path, 1, 1, 0, policy)
+    written = threading.Event()
+    release = threading.Event()
+
+    def slow_write(events):
+        written.set()
+        release.wait()
+
+    with patch.object(audit_log, '_write', side_effect=slow_write):
+        # the first event is taken by the writer, the second fills the queue
+        audit_log.record({'event': 1})
+        written.wait()
+        audit_log.record({'event': 2})
+        recorder = threading.Thread(target=audit_log.record, args=({'event': 3},))
+        recorder.start()
+        recorder.join(0.1)
+        if policy == DROP:
+            assert not recorder.is_alive()
+            assert audit_log.dropped == 1
+        else:
+            assert recorder.is_alive()
+            assert audit_log.dropped == 0
+        release.set()
+        recorder.join()
+        audit_log.close()
+
+
+class TestPackageDelete(object):
+    def teardown_method(self):
+        audit.configure({})
+
+    def test_ownership_deletes_are_audited(self, tmp_path):
+        path = str(tmp_path / 'audit.jsonl')
+        audit.configure(
+            {
+                'ckanext.userdatasets.audit.enabled': 'true',
+                'ckanext.userdatasets.audit.path': path,
+            }
+        )
+        user = MagicMock(id='turtle-id', sysadmin=False)
+        user.name = 'turtle'
+        context = {'auth_user_obj': user}
+        owned = PackageOwnership('pkg-id', 'org-id', 'turtle-id', 'turtle-id', 'member')
+        next_action = MagicMock()
+        with patch(
+            'ckanext.userdatasets.logic.auth.auth.get_package_ownership',
+            return_value=owned,
+        ):
+            package_delete(next_action, context, {'id': 'pkg'})
+        audit.get_audit_log().flush()
+
+        (event,) = read_events(path)
+        assert event['action'] == 'package_delete'
+        assert event['user_name'] == 'turtle'
+        assert event['package_id'] == 'pkg-id'
+        assert event['role'] == 'member'
+
+    def test_other_deletes_are_not_audited(self, tmp_path):
+        path = str(tmp_path / 'audit.jsonl')
+        audit.configure(
+            {
+                'ckanext.userdatasets.audit.enabled': 'true',
+                'ckanext.userdatasets.audit.path': path,
+            }
+        )
+        user = MagicMock(id='crab-id', sysadmin=False)
+        context = {'auth_user_obj': user}
+        not_owned = PackageOwnership(
+            'pkg-id', 'org-id', 'turtle-id', 'crab-id', 'admin'
+        )
+        with patch(
+            'ckanext.userdatasets.logic.auth.auth.get_package_ownership',
+            return_value=not_owned,
+        ):
+            package_delete(MagicMock(), context, {'id': 'pkg'})
+        assert audit.get_audit_log()._queue is None
@@ -7,6 +7,8 @@
 from unittest.mock import MagicMock, patch
 
 from ckanext.userdatasets.logic.auth.auth import (
+    PACKAGE_UPDATE_AUTHORISED,
+    PackageOwnership,
     user_is_member_of_package_org,
     user_owns_package_as_member,
 )
@@ -135,8 +137,30 @@ class TestAuthActionsUnit(object):
             mock_users_role.return_value = t['role']
             assert user_owns_package_as_member(t['user'], t['package']) == t['result']
 
+    def test_package_ownership(self):
+        """
+        Test ckanext.userdatasets.logic.auth.auth.PackageOwnership.
+
+        Ensure the member and owner checks match the ones made by
+        user_is_member_of_package_org and user_owns_package_as_member.
+        """
+        tests = [
+            {'args': (444, 'carrot', 'member'), 'member': True, 'owner': True},
+            {'args': (444, 'carrot', 'editor'), 'member': True, 'owner': True},
+            {'args': (444, 'carrot', 'admin'), 'member': True, 'owner': True},
+            {'args': (445, 'carrot', 'member'), 'member': True, 'owner': False},
+            {'args': (444, None, 'member'), 'member': False, 'owner': False},
+            {'args': (444, 'carrot', None), 'member': False, 'owner': False},
+            {'args': (None, 'carrot', 'member'), 'member': True, 'owner': False},
+        ]
+        for t in tests:
+            creator_user_id, owner_org, role = t['args']
+            ownership = PackageOwnership('pkg', owner_org, creator_user_id, 444, role)
+            assert ownership.user_is_member == t['member']
+            assert ownership.user_owns_package == t['owner']
+
     @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
-    @patch('ckanext.userdatasets.logic.auth.create.has_user_permission_for_some_org')
+    @patch('ckanext.userdatasets.logic.auth.create.is_member_of_some_org')
     def test_package_create(self, mock_has_perm, mock_users_role):
         """
         Test ckanext.userdatasets.logic.auth.create.package_create.
@@ -202,9 +226,8 @@ class TestAuthActionsUnit(object):
             result = package_create(mock_default_auth, t['context'], t['data_dict'])
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.create.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.create.get_package_object')
-    def test_resource_create(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.create.get_package_ownership')
+    def test_resource_create(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_create.
 
@@ -215,18 +238,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_package.return_value = 1
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = resource_create(
                 mock_default_auth, {'auth_user_obj': 1}, MagicMock()
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.create.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.create.get_resource_object')
-    def test_resource_view_create(self, mock_get_resource, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.create.get_resource_ownership')
+    def test_resource_view_create(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_view_create.
 
@@ -238,18 +261,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_resource.return_value = MagicMock(package=1)
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = resource_view_create(
                 mock_default_auth, {'auth_user_obj': 1}, {'resource_id': 1}
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.create.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.create.get_package_object')
-    def test_package_collaborator_create(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.create.get_package_ownership')
+    def test_package_collaborator_create(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.package_collaborator_create.
 
@@ -260,35 +283,57 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_package.return_value = 1
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = package_collaborator_create(
                 mock_default_auth, {'auth_user_obj': 1}, MagicMock()
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.update.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.update.get_package_object')
-    def test_package_update(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.update.get_package_ownership')
+    def test_package_update(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.update.package_update.
 
         Ensure both success and failure routes are tested.
         """
-        mock_get_package.return_value = 1
-        mock_user_owns.return_value = True
+        mock_get_ownership.return_value = MagicMock(user_owns_package=True)
         mock_default_auth = MagicMock(return_value='fallback')
         result = package_update(mock_default_auth, {'auth_user_obj': 1}, MagicMock())
         assert result == {'success': True}
-        mock_user_owns.return_value = False
+        mock_get_ownership.return_value = MagicMock(user_owns_package=False)
         result = package_update(mock_default_auth, {'auth_user_obj': 1}, MagicMock())
         assert result == 'fallback'
 
-    @patch('ckanext.userdatasets.logic.auth.update.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.update.get_resource_object')
-    def test_resource_update(self, mock_get_resource, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.update.get_package_ownership')
+    def test_package_update_already_authorised(self, mock_get_ownership):
+        """
+        Test ckanext.userdatasets.logic.auth.update.package_update.
+
+        Ensure the decision recorded by the package_update action is used once, and
+        only for the package it was made for.
+        """
+        mock_get_ownership.return_value = MagicMock(user_owns_package=False)
+        mock_default_auth = MagicMock(return_value='fallback')
+        context = {'auth_user_obj': 1, PACKAGE_UPDATE_AUTHORISED: 'carrot'}
+
+        result = package_update(mock_default_auth, context, {'id': 'beetroot'})
+        assert result == 'fallback'
+        assert PACKAGE_UPDATE_AUTHORISED not in context
+
+        context[PACKAGE_UPDATE_AUTHORISED] = 'carrot'
+        result = package_update(mock_default_auth, context, {'id': 'carrot'})
+        assert result == {'success': True}
+        assert mock_get_ownership.call_count == 1
+
+        result = package_update(mock_default_auth, context, {'id': 'carrot'})
+        assert result == 'fallback'
+
+    @patch('ckanext.userdatasets.logic.auth.update.get_resource_ownership')
+    def test_resource_update(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_update.
 
@@ -299,21 +344,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_resource.return_value = MagicMock(package=1)
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             assert (
                 resource_update(mock_default_auth, {'auth_user_obj': 1}, {})
                 == t['result']
             )
 
-    @patch('ckanext.userdatasets.logic.auth.update.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.update.get_resource_object')
-    @patch('ckanext.userdatasets.logic.auth.update.get_resource_view_object')
-    def test_resource_view_update(
-        self, mock_get_resource_view, mock_get_resource, mock_user_owns
-    ):
+    @patch('ckanext.userdatasets.logic.auth.update.get_resource_view_ownership')
+    def test_resource_view_update(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_view_update.
 
@@ -324,36 +366,33 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_resource_view.return_value = MagicMock(resource_id=1)
-        mock_get_resource.return_value = MagicMock(package=1)
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = resource_view_update(
                 mock_default_auth, {'auth_user_obj': 1}, {'resource_id': 1}
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.delete.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.delete.get_package_object')
-    def test_package_delete(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.delete.get_package_ownership')
+    def test_package_delete(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.delete.package_delete.
 
         Ensure both success and failure routes are tested.
         """
-        mock_get_package.return_value = 1
-        mock_user_owns.return_value = True
+        mock_get_ownership.return_value = MagicMock(user_owns_package=True)
         mock_default_auth = MagicMock(return_value='fallback')
         assert package_delete(mock_default_auth, {'auth_user_obj': 1}, {}) == {
             'success': True
         }
-        mock_user_owns.return_value = False
+        mock_get_ownership.return_value = MagicMock(user_owns_package=False)
         assert package_delete(mock_default_auth, {'auth_user_obj': 1}, {}) == 'fallback'
 
-    @patch('ckanext.userdatasets.logic.auth.delete.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.delete.get_resource_object')
-    def test_resource_delete(self, mock_get_resource, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.delete.get_resource_ownership')
+    def test_resource_delete(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_delete.
 
@@ -364,24 +403,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_resource.return_value = MagicMock(package=1)
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             assert (
                 resource_delete(mock_default_auth, {'auth_user_obj': 1}, {})
                 == t['result']
             )
 
-    @patch('ckanext.userdatasets.logic.auth.delete.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.delete.get_resource_object')
-    @patch('ckanext.userdatasets.logic.auth.delete.get_resource_view_object')
-    def test_resource_view_delete(
-        self,
-        mock_get_resource_view,
-        mock_get_resource,
-        mock_user_owns,
-    ):
+    @patch('ckanext.userdatasets.logic.auth.delete.get_resource_view_ownership')
+    def test_resource_view_delete(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.create.resource_view_delete.
 
@@ -392,19 +425,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_resource_view.return_value = MagicMock(resource_id=1)
-        mock_get_resource.return_value = MagicMock(package=1)
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = resource_view_delete(
                 mock_default_auth, {'auth_user_obj': 1}, {'resource_id': 1}
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.delete.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.delete.get_package_object')
-    def test_package_collaborator_delete(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.delete.get_package_ownership')
+    def test_package_collaborator_delete(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.delete.package_collaborator_delete.
 
@@ -415,18 +447,18 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_package.return_value = 1
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = package_collaborator_delete(
                 mock_default_auth, {'auth_user_obj': 1}, MagicMock()
             )
             assert result == t['result']
 
-    @patch('ckanext.userdatasets.logic.auth.get.user_owns_package_as_member')
-    @patch('ckanext.userdatasets.logic.auth.get.get_package_object')
-    def test_package_collaborator_list(self, mock_get_package, mock_user_owns):
+    @patch('ckanext.userdatasets.logic.auth.get.get_package_ownership')
+    def test_package_collaborator_list(self, mock_get_ownership):
         """
         Test ckanext.userdatasets.logic.auth.get.package_collaborator_list.
 
@@ -437,9 +469,10 @@ class TestAuthActionsUnit(object):
             {'user_owns': False, 'user_is_member': True, 'result': 'fallback'},
             {'user_owns': False, 'user_is_member': False, 'result': 'fallback'},
         ]
-        mock_get_package.return_value = 1
         for t in tests:
-            mock_user_owns.return_value = t['user_owns']
+            mock_get_ownership.return_value = MagicMock(
+                user_owns_package=t['user_owns']
+            )
             mock_default_auth = MagicMock(return_value='fallback')
             result = package_collaborator_list(
                 mock_default_auth, {'auth_user_obj': 1}, MagicMock()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock
+
+from ckan.plugins import toolkit
+from flask import Flask
+
+from ckanext.userdatasets.lib.auth_memo import (
+    SKIP_AUTH_MEMO,
+    clear_auth_memo,
+    memoise,
+    not_memoised,
+)
+
+
+def make_auth(result, chained=True):
+    calls = []
+
+    def auth_function(*args):
+        calls.append(args)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    auth_function.calls = calls
+    if chained:
+        auth_function.chained_auth_function = True
+    return auth_function
+
+
+class TestAuthMemo(object):
+    def test_memoised_in_request(self):
+        function = make_auth({'success': True})
+        wrapped = memoise('package_update', function)
+        # CKAN needs this to chain the function
+        assert wrapped.chained_auth_function
+        next_auth = MagicMock()
+        context = {'user': 'turtle'}
+
+        with Flask(__name__).app_context():
+            for _ in range(3):
+                assert wrapped(next_auth, context, {'id': 'pkg'}) == {'success': True}
+            assert len(function.calls) == 1
+
+            # different objects, users and opted out contexts aren't memoised
+            wrapped(next_auth, context, {'id': 'another-pkg'})
+            wrapped(next_auth, {'user': 'tortoise'}, {'id': 'pkg'})
+            wrapped(next_auth, {'user': 'turtle', SKIP_AUTH_MEMO: True}, {'id': 'pkg'})
+            assert len(function.calls) == 4
+
+            # writes clear the memo
+            clear_auth_memo()
+            wrapped(next_auth, context, {'id': 'pkg'})
+            assert len(function.calls) == 5
+
+        # nothing is memoised outside a request
+        wrapped(next_auth, context, {'id': 'pkg'})
+        wrapped(next_auth, context, {'id': 'pkg'})
+        assert len(function.calls) == 7
+
+    def test_only_object_id_memoised(self):
+        function = make_auth({'success': True})
+        wrapped = memoise('package_update', function)
+        next_auth = MagicMock()
+        context = {'user': 'turtle'}
+
+        with Flask(__name__).app_context():
+            wrapped(next_auth, context, {'id': 'pkg'})
+            # a later call with more to check, e.g. groups to add the dataset to, is
+            # evaluated again rather than answered by the memoised decision
+            groups = {'id': 'pkg', 'groups': [{'name': 'carrot'}]}
+            wrapped(next_auth, context, groups)
+            wrapped(next_auth, context, groups)
+            assert len(function.calls) == 3
+            assert function.calls[-1][2] == groups
+
+    def test_plain_function(self):
+        function = make_auth({'success': False}, chained=False)
+        wrapped = memoise('userdatasets_thing', function)
+        with Flask(__name__).app_context():
+            wrapped({'user': 'turtle'}, {'id': 'pkg'})
+            wrapped({'user': 'turtle'}, {'id': 'pkg'})
+        assert function.calls == [({'user': 'turtle'}, {'id': 'pkg'})]
+
+    def test_exceptions_not_memoised(self):
+        function = make_auth(toolkit.ObjectNotFound())
+        wrapped = memoise('package_update', function)
+        with Flask(__name__).app_context():
+            for _ in range(2):
+                try:
+                    wrapped(MagicMock(), {'user': 'turtle'}, {'id': 'pkg'})
+                except toolkit.ObjectNotFound:
+                    pass
+        assert len(function.calls) == 2
+
+    def test_not_memoised(self):
+        function = not_memoised(make_auth({'success': True}))
+        assert memoise('package_create', function) is function
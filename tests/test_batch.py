@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ckan import authz
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.logic.action.get import userdatasets_check_access_batch
+from ckanext.userdatasets.logic.auth.auth import PackageOwnership
+from ckanext.userdatasets.logic.auth.batch import BatchDecider, check_access_batch
+
+
+def make_user(user_id='turtle-id', name='turtle'):
+    user = MagicMock(id=user_id)
+    user.name = name
+    user.is_deleted.return_value = False
+    return user
+
+
+@pytest.fixture
+def ownerships():
+    return {
+        # created by the user, who is a member
+        'mine': PackageOwnership('mine', 'carrot', 'turtle-id', 'turtle-id', 'member'),
+        # created by someone else in an org the user is a member of
+        'theirs': PackageOwnership('theirs', 'carrot', 'other', 'turtle-id', 'member'),
+        # created by someone else in an org the user is an editor of
+        'edited': PackageOwnership(
+            'edited', 'beetroot', 'other', 'turtle-id', 'editor'
+        ),
+        # created by the user in an org they have since left
+        'left': PackageOwnership('left', 'parsnip', 'turtle-id', 'turtle-id', None),
+    }
+
+
+@pytest.mark.usefixtures('ckan_config')
+@patch('ckanext.userdatasets.logic.auth.batch.authz.is_sysadmin', return_value=False)
+@patch('ckanext.userdatasets.logic.auth.batch._get_collaborator_capacities')
+@patch('ckanext.userdatasets.logic.auth.batch.get_package_ownerships')
+class TestCheckAccessBatch(object):
+    @pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', False)
+    def test_update(self, mock_get_ownerships, mock_collaborators, _, ownerships):
+        mock_get_ownerships.return_value = ownerships
+        ids = ['mine', 'theirs', 'edited', 'left', 'missing']
+        result = check_access_batch({}, make_user(), ids, 'update')
+        assert result == {
+            'mine': True,
+            'theirs': False,
+            'edited': True,
+            'left': False,
+            'missing': False,
+        }
+        assert mock_get_ownerships.call_count == 1
+        assert not mock_collaborators.called
+
+    @pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', True)
+    def test_update_collaborator(
+        self, mock_get_ownerships, mock_collaborators, _, ownerships
+    ):
+        mock_get_ownerships.return_value = ownerships
+        mock_collaborators.return_value = {'theirs': 'editor', 'left': 'member'}
+        result = check_access_batch({}, make_user(), ['theirs', 'left'], 'delete')
+        assert result == {'theirs': True, 'left': False}
+        assert mock_collaborators.call_count == 1
+
+    @pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', False)
+    def test_collaborator(self, mock_get_ownerships, mock_collaborators, _, ownerships):
+        mock_get_ownerships.return_value = ownerships
+        mock_collaborators.return_value = {}
+        ids = ['mine', 'theirs', 'edited']
+        result = check_access_batch({}, make_user(), ids, 'collaborator')
+        # editors can't manage collaborators, only admins
+        assert result == {'mine': True, 'theirs': False, 'edited': False}
+        # the decisions are always bools, even when they come from config options
+        assert all(type(allowed) is bool for allowed in result.values())
+
+    def test_sysadmin(self, mock_get_ownerships, _, mock_is_sysadmin):
+        mock_is_sysadmin.return_value = True
+        result = check_access_batch({}, make_user(), ['a', 'b'], 'update')
+        assert result == {'a': True, 'b': True}
+        assert not mock_get_ownerships.called
+
+
+@pytest.mark.parametrize(
+    'owner_org,creator,role,capacity',
+    [
+        # an admin collaborator on a dataset which doesn't belong to an organisation
+        (None, 'other', None, 'admin'),
+        # an admin collaborator when allow_admin_collaborators isn't set
+        ('carrot', 'other', 'member', 'admin'),
+        (None, 'turtle-id', None, None),
+        (None, 'other', None, 'editor'),
+        ('carrot', 'other', 'admin', None),
+        ('carrot', 'other', 'editor', 'editor'),
+    ],
+)
+@pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', True)
+@pytest.mark.ckan_config('ckan.auth.allow_admin_collaborators', False)
+@pytest.mark.usefixtures('ckan_config')
+def test_collaborator_matches_core(owner_org, creator, role, capacity):
+    user = make_user()
+    ownership = PackageOwnership('pkg-id', owner_org, creator, user.id, role)
+    collaborators = {'pkg-id': capacity} if capacity else {}
+    decider = BatchDecider(user, collaborators)
+
+    package = MagicMock(id='pkg-id', owner_org=owner_org, creator_user_id=creator)
+    admin_roles = authz.get_roles_with_permission('membership')
+    with patch('ckan.authz.model') as model, patch(
+        'ckan.authz.has_user_permission_for_group_or_org',
+        side_effect=lambda org, _, permission: bool(org) and role in admin_roles,
+    ), patch(
+        'ckan.authz.user_is_collaborator_on_dataset',
+        side_effect=lambda _, package_id, capacity: (
+            collaborators.get(package_id) == capacity
+        ),
+    ):
+        model.Package.get.return_value = package
+        expected = authz.can_manage_collaborators('pkg-id', user.id)
+
+    assert decider.decide(ownership, 'collaborator') is expected
+
+
+@pytest.mark.ckan_config('ckanext.userdatasets.bulk.max_size', '2')
+@pytest.mark.usefixtures('ckan_config')
+def test_max_size():
+    context = {'model': MagicMock(), 'auth_user_obj': make_user()}
+    with patch('ckanext.userdatasets.logic.action.get.check_access_batch') as check:
+        with pytest.raises(toolkit.ValidationError):
+            userdatasets_check_access_batch(context, ['a', 'b', 'c'])
+        assert not check.called
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, PropertyMock, patch
+
+import pytest
+from ckan.plugins import toolkit
+from sqlalchemy.exc import IntegrityError
+
+from ckanext.userdatasets.logic.action.create import userdatasets_package_create_bulk
+from ckanext.userdatasets.logic.action.update import userdatasets_resource_bulk
+
+MODULE = 'ckanext.userdatasets.logic.action.create'
+
+
+def fake_create(context, data_dict):
+    if data_dict['name'] == 'clash':
+        raise IntegrityError('insert', {}, Exception('duplicate key'))
+    return f'{data_dict["name"]}-id'
+
+
+def fake_validate(plugin, context, data_dict, schema, action):
+    if data_dict['name'] == 'invalid':
+        return data_dict, {'name': ['That URL is already in use.']}
+    return data_dict, {}
+
+
+def fake_check_access(name, context, data_dict):
+    if data_dict.get('owner_org') == 'not-my-org':
+        raise toolkit.NotAuthorized('not a member')
+
+
+@pytest.fixture
+def context():
+    return {'model': MagicMock(), 'user': 'turtle', 'auth_user_obj': MagicMock()}
+
+
+@pytest.fixture
+def create():
+    with patch(f'{MODULE}.get_package_schema', return_value={}) as get_schema, patch(
+        f'{MODULE}.toolkit.check_access', side_effect=fake_check_access
+    ) as check_access, patch(f'{MODULE}.toolkit.get_action') as get_action, patch(
+        f'{MODULE}.lib_plugins.plugin_validate', side_effect=fake_validate
+    ), patch(f'{MODULE}.lib_plugins.lookup_package_plugin'), patch(
+        f'{MODULE}.search'
+    ) as search:
+        get_action.return_value.side_effect = fake_create
+        yield get_action.return_value, check_access, get_schema, search
+
+
+def test_partial_failures(context, create):
+    package_create, check_access, get_schema, search = create
+    datasets = [
+        {'name': 'one', 'owner_org': 'my-org'},
+        {'name': 'invalid', 'owner_org': 'my-org'},
+        {'name': 'two', 'owner_org': 'not-my-org'},
+        {'name': 'clash', 'owner_org': 'my-org'},
+        {'name': 'three', 'owner_org': 'my-org', 'groups': [{'name': 'g'}]},
+        {'name': 'four', 'owner_org': 'not-my-org'},
+    ]
+
+    result = userdatasets_package_create_bulk(context, datasets, chunk_size=10)
+
+    assert result['created'] == 2
+    assert result['failed'] == 4
+    assert [r['success'] for r in result['results']] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert result['results'][0]['id'] == 'one-id'
+    assert result['results'][1]['error'] == {'name': ['That URL is already in use.']}
+    # every dataset is checked in full before it's validated
+    assert [call.args[2]['name'] for call in check_access.call_args_list] == [
+        'one',
+        'invalid',
+        'two',
+        'clash',
+        'three',
+        'four',
+    ]
+    get_schema.assert_called_once_with(None, 'create')
+    # datasets which fail the checks or validation are never created
+    contexts = [call.args[0] for call in package_create.call_args_list]
+    assert len(contexts) == 3
+    assert not any(c.get('ignore_auth') for c in contexts)
+    assert all(c['defer_commit'] for c in contexts)
+    savepoint = context['model'].Session.begin_nested.return_value
+    assert savepoint.rollback.call_count == 1
+    context['model'].repo.commit.assert_called_once_with()
+    # the created datasets are indexed once they're committed
+    search.rebuild.assert_called_once_with(
+        package_ids=['one-id', 'three-id'], defer_commit=True
+    )
+    search.commit.assert_called_once_with()
+
+
+def test_outer_rollback(context, create):
+    package_create = create[0]
+    # package_create can still roll back the whole transaction, e.g. if a plugin's
+    # validation differs, taking the chunk's earlier datasets with it
+    package_create.side_effect = [
+        'one-id',
+        toolkit.ValidationError({'name': ['Nope']}),
+        'three-id',
+    ]
+    savepoint = context['model'].Session.begin_nested.return_value
+    type(savepoint).is_active = PropertyMock(side_effect=[False])
+    datasets = [{'name': name, 'owner_org': 'my-org'} for name in ('a', 'b', 'c')]
+
+    result = userdatasets_package_create_bulk(context, datasets, chunk_size=10)
+
+    assert [r['success'] for r in result['results']] == [False, False, True]
+    assert 'message' in result['results'][0]['error']
+    assert result['results'][1]['error'] == {'name': ['Nope']}
+    # the closed savepoint isn't rolled back again
+    savepoint.rollback.assert_not_called()
+
+
+def test_commits_in_chunks(context, create):
+    search = create[3]
+    datasets = [{'name': f'dataset-{i}', 'owner_org': 'my-org'} for i in range(5)]
+    result = userdatasets_package_create_bulk(context, datasets, chunk_size=2)
+    assert result['created'] == 5
+    assert context['model'].repo.commit.call_count == 3
+    assert [
+        len(call.kwargs['package_ids']) for call in search.rebuild.call_args_list
+    ] == [
+        2,
+        2,
+        1,
+    ]
+
+
+def test_failed_commit_fails_chunk(context, create):
+    context['model'].repo.commit.side_effect = [None, IntegrityError('', {}, None)]
+    datasets = [{'name': f'dataset-{i}', 'owner_org': 'my-org'} for i in range(3)]
+    result = userdatasets_package_create_bulk(context, datasets, chunk_size=2)
+    assert [r['success'] for r in result['results']] == [True, True, False]
+    context['model'].Session.rollback.assert_called_once_with()
+    # only the committed chunk is indexed
+    assert create[3].rebuild.call_count == 1
+
+
+def test_max_size(context, create):
+    with pytest.raises(toolkit.ValidationError):
+        userdatasets_package_create_bulk(context, [{}] * 1001)
+
+
+class TestResourceBulk(object):
+    MODULE = 'ckanext.userdatasets.logic.action.update'
+
+    def call(self, context, **kwargs):
+        pkg_dict = {
+            'id': 'pkg-id',
+            'resources': [
+                {'id': 'res-1', 'url': 'http://a', 'datastore_active': True},
+                {'id': 'res-2', 'url': 'http://b'},
+            ],
+        }
+        actions = {
+            'package_show': MagicMock(return_value=pkg_dict),
+            'package_update': MagicMock(
+                side_effect=lambda context, data_dict: {
+                    'resources': [
+                        dict(resource, id=resource.get('id', f'new-{i}'))
+                        for i, resource in enumerate(data_dict['resources'])
+                    ]
+                }
+            ),
+        }
+        with patch(f'{self.MODULE}.toolkit.check_access') as check_access, patch(
+            f'{self.MODULE}.toolkit.get_action', side_effect=actions.get
+        ):
+            result = userdatasets_resource_bulk(context, 'pkg', **kwargs)
+        return result, check_access, actions['package_update']
+
+    def test_single_package_update(self, context):
+        result, check_access, package_update = self.call(
+            context,
+            create=[{'url': 'http://c'}, {'url': 'http://d'}],
+            update=[{'id': 'res-1', 'url': 'http://e'}],
+        )
+
+        assert [r['url'] for r in result['created']] == ['http://c', 'http://d']
+        assert [r['id'] for r in result['created']] == ['new-2', 'new-3']
+        assert result['updated'] == [
+            {'id': 'res-1', 'url': 'http://e', 'datastore_active': True}
+        ]
+        assert [call.args[0] for call in check_access.call_args_list] == [
+            'resource_create',
+            'package_update',
+        ]
+        package_update.assert_called_once()
+        assert len(package_update.call_args.args[1]['resources']) == 4
+
+    def test_update_must_belong_to_package(self, context):
+        with pytest.raises(toolkit.ValidationError):
+            self.call(context, update=[{'id': 'not-in-this-dataset'}])
+
+    def test_max_size(self, context):
+        with pytest.raises(toolkit.ValidationError) as e:
+            self.call(context, create=[{}] * 1000, update=[{'id': 'res-1'}])
+        assert set(e.value.error_dict) == {'create', 'update'}
+
+    def test_duplicate_updates(self, context):
+        with pytest.raises(toolkit.ValidationError) as e:
+            self.call(context, update=[{'id': 'res-1'}, {'id': 'res-1'}])
+        assert e.value.error_dict == {
+            'update': ['Resource res-1 is updated more than once']
+        }
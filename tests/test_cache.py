@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.userdatasets.lib import membership
+from ckanext.userdatasets.lib.cache import LRUCache
+from ckanext.userdatasets.logic.utils import org_role_is_valid
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(object):
+    def test_get_set(self):
+        cache = LRUCache(10, 0)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_eviction(self):
+        cache = LRUCache(2, 0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # use a so that b is the least recently used
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.evictions == 1
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(10, 5, clock=clock)
+        cache.set('a', 1)
+        clock.now = 4
+        assert cache.get('a') == 1
+        clock.now = 5
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_invalidate(self):
+        cache = LRUCache(10, 0)
+        cache.set(('carrot', 'turtle'), 'member')
+        cache.set(('carrot', 'tortoise'), 'member')
+        cache.invalidate(lambda key: key[1] == 'turtle')
+        assert cache.get(('carrot', 'turtle')) is None
+        assert cache.get(('carrot', 'tortoise')) == 'member'
+
+
+class TestMembershipCache(object):
+    def setup_method(self):
+        membership.configure(
+            {
+                'ckanext.userdatasets.membership_cache.enabled': 'true',
+                'ckanext.userdatasets.membership_cache.size': '100',
+            }
+        )
+
+    def teardown_method(self):
+        membership.configure({})
+
+    def test_disabled(self):
+        membership.configure({})
+        assert membership.get_membership_cache() is None
+
+    @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
+    def test_cached(self, mock_users_role):
+        mock_users_role.return_value = 'member'
+        assert org_role_is_valid('carrot', 'turtle')
+        assert org_role_is_valid('carrot', 'turtle')
+        assert mock_users_role.call_count == 1
+
+    @patch('ckanext.userdatasets.lib.membership.model')
+    @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
+    def test_invalidate_user(self, mock_users_role, mock_model):
+        user = MagicMock(id='turtle-id')
+        # name is a special argument to the MagicMock constructor so set it separately
+        user.name = 'turtle'
+        mock_model.User.get.return_value = user
+        mock_users_role.return_value = 'member'
+        assert org_role_is_valid('carrot', 'turtle')
+        assert org_role_is_valid('carrot', 'tortoise')
+
+        # invalidate using the user's ID rather than the name they were cached under
+        membership.invalidate_user('turtle-id')
+        mock_users_role.return_value = None
+        assert not org_role_is_valid('carrot', 'turtle')
+        assert org_role_is_valid('carrot', 'tortoise')
+        assert mock_users_role.call_count == 3
+
+
+class TestRedisMembershipCache(object):
+    def setup_method(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        self.redis = fakeredis.FakeStrictRedis()
+        self.patcher = patch(
+            'ckanext.userdatasets.lib.membership.connect_to_redis',
+            return_value=self.redis,
+        )
+        self.patcher.start()
+        membership.configure(
+            {
+                'ckanext.userdatasets.membership_cache.enabled': 'true',
+                'ckanext.userdatasets.membership_cache.backend': 'redis',
+                'ckanext.userdatasets.membership_cache.ttl': '60',
+            }
+        )
+
+    def teardown_method(self):
+        self.patcher.stop()
+        membership.configure({})
+
+    def test_get_set(self):
+        cache = membership.get_membership_cache()
+        assert cache.get('carrot', 'turtle', default='missing') == 'missing'
+        cache.set('carrot', 'turtle', 'editor')
+        cache.set('beetroot', 'turtle', None)
+        assert cache.get('carrot', 'turtle') == 'editor'
+        assert cache.get('beetroot', 'turtle', default='missing') is None
+        assert 0 < self.redis.ttl('ckanext-userdatasets:default:roles:turtle') <= 60
+
+    @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
+    def test_shared_between_workers(self, mock_users_role):
+        mock_users_role.return_value = 'member'
+        assert org_role_is_valid('carrot', 'turtle')
+
+        # a cache created in another process uses the same keys
+        other_cache = membership.RedisMembershipCache(
+            60, 'ckanext-userdatasets:default'
+        )
+        assert other_cache.get('carrot', 'turtle') == 'member'
+
+        # and invalidating in that process affects this one
+        other_cache.invalidate_user('turtle')
+        mock_users_role.return_value = None
+        assert not org_role_is_valid('carrot', 'turtle')
+        assert mock_users_role.call_count == 2
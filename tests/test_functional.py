@@ -107,6 +107,133 @@ class TestFuncDatasets(object):
                 {'user': member_1['name']}, {'owner_org': another_org['id']}
             )
 
+    def test_members_can_create_datasets_in_bulk(self, org, member_1):
+        another_org = factories.Organization()
+        result = toolkit.get_action('userdatasets_package_create_bulk')(
+            {'user': member_1['name']},
+            {
+                'datasets': [
+                    {'name': 'bulk-one', 'owner_org': org['id']},
+                    {'name': 'bulk-two', 'owner_org': another_org['id']},
+                    {'name': 'bulk-one', 'owner_org': org['id']},
+                    {'name': 'bulk-three', 'owner_org': org['id']},
+                ],
+                'chunk_size': 1,
+            },
+        )
+        assert [r['success'] for r in result['results']] == [True, False, False, True]
+        package = call_action('package_show', id='bulk-three')
+        assert package['creator_user_id'] == member_1['id']
+
+    def test_bulk_create_failure_keeps_rest_of_chunk(self, org, member_1):
+        result = toolkit.get_action('userdatasets_package_create_bulk')(
+            {'user': member_1['name']},
+            {
+                'datasets': [
+                    {'name': 'bulk-one', 'owner_org': org['id']},
+                    {'name': 'bulk-two', 'owner_org': org['id']},
+                    # fails validation in the middle of the chunk
+                    {'name': 'bulk-one', 'owner_org': org['id']},
+                    {'name': 'bulk-three', 'owner_org': org['id']},
+                ],
+                'chunk_size': 10,
+            },
+        )
+        assert [r['success'] for r in result['results']] == [True, True, False, True]
+        assert 'name' in result['results'][2]['error']
+
+        names = {'bulk-one', 'bulk-two', 'bulk-three'}
+        for name in names:
+            package = call_action('package_show', id=name)
+            assert package['creator_user_id'] == member_1['id']
+        found = call_action('package_search', fq=f'owner_org:{org["id"]}')
+        assert {package['name'] for package in found['results']} == names
+
+    @pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', 'true')
+    def test_batch_collaborator_matches_check_access(self, org, member_1, member_2):
+        unowned = create_package(user=member_2)
+        owned = create_package(org, member_2)
+        for package in (unowned, owned):
+            call_action(
+                'package_collaborator_create',
+                id=package['id'],
+                user_id=member_1['id'],
+                capacity='admin',
+            )
+
+        ids = [unowned['id'], owned['id']]
+        result = toolkit.get_action('userdatasets_check_access_batch')(
+            {'user': member_1['name']}, {'ids': ids, 'permission': 'collaborator'}
+        )
+        for package_id in ids:
+            try:
+                toolkit.check_access(
+                    'package_collaborator_list',
+                    {'user': member_1['name']},
+                    {'id': package_id},
+                )
+                allowed = True
+            except toolkit.NotAuthorized:
+                allowed = False
+            assert result[package_id] is allowed
+        # admin collaborators can manage collaborators even on datasets without an
+        # organisation, and without allow_admin_collaborators
+        assert all(result.values())
+
+    def test_members_can_list_own_datasets(self, org, member_1, member_2):
+        own = [create_package(org, member_1) for _ in range(3)]
+        create_package(org, member_2)
+        # datasets in organisations the user isn't a member of aren't theirs to edit
+        create_package(factories.Organization(), member_1)
+
+        list_action = toolkit.get_action('userdatasets_owned_package_list')
+        context = {'user': member_1['name']}
+        first = list_action(context, {'limit': 2})
+        second = list_action(
+            dict(context), {'limit': 2, 'cursor': first['next_cursor']}
+        )
+
+        assert second['next_cursor'] is None
+        listed = first['results'] + second['results']
+        assert [p['id'] for p in listed] == [p['id'] for p in reversed(own)]
+        assert set(listed[0]) == {'id', 'name', 'metadata_modified'}
+
+        with pytest.raises(toolkit.NotAuthorized):
+            list_action({'user': member_2['name']}, {'user': member_1['name']})
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'userdatasets')
+@pytest.mark.usefixtures('clean_db', 'with_plugins', 'with_request_context')
+class TestFuncOrganisations(object):
+    def test_light_org_list_matches_core(self, org, member_1):
+        factories.Organization()
+        context = {'user': member_1['name']}
+        data_dict = {'permission': 'create_dataset'}
+
+        orgs = toolkit.get_action('organization_list_for_user')(context, data_dict)
+        light_orgs = toolkit.get_action('userdatasets_organization_list_for_user')(
+            context, data_dict
+        )
+        assert [o['id'] for o in orgs] == [org['id']]
+        assert light_orgs == [{'id': org['id'], 'name': org['name']}]
+
+    @pytest.mark.ckan_config('ckanext.userdatasets.org_list_cache.enabled', 'true')
+    def test_cached_org_list_is_invalidated(self, org, member_1):
+        context = {'user': member_1['name']}
+        data_dict = {'permission': 'create_dataset'}
+        orgs = toolkit.get_action('organization_list_for_user')(context, data_dict)
+        assert [o['id'] for o in orgs] == [org['id']]
+
+        another_org = factories.Organization()
+        call_action(
+            'organization_member_create',
+            id=another_org['id'],
+            username=member_1['name'],
+            role='member',
+        )
+        orgs = toolkit.get_action('organization_list_for_user')(context, data_dict)
+        assert {o['id'] for o in orgs} == {org['id'], another_org['id']}
+
 
 @pytest.mark.ckan_config('ckan.plugins', 'userdatasets')
 @pytest.mark.usefixtures('clean_db', 'with_plugins', 'with_request_context')
@@ -151,8 +278,31 @@ class TestFuncResources(object):
                 context, {'package_id': package['id'], 'description': 'beans!'}
             )
 
+    def test_members_can_change_own_resources_in_bulk(self, org, member_1, member_2):
+        package = create_package(org, member_1)
+        resource = factories.Resource(package_id=package['id'])
+        data_dict = {
+            'package_id': package['id'],
+            'create': [{'url': f'http://example.com/{i}'} for i in range(3)],
+            'update': [{'id': resource['id'], 'url': 'http://example.com/updated'}],
+        }
+
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('userdatasets_resource_bulk')(
+                {'user': member_2['name']}, dict(data_dict)
+            )
+
+        result = toolkit.get_action('userdatasets_resource_bulk')(
+            {'user': member_1['name']}, data_dict
+        )
+        assert len(result['created']) == 3
+        assert result['updated'][0]['url'] == 'http://example.com/updated'
+        package = call_action('package_show', id=package['id'])
+        assert len(package['resources']) == 4
+
 
-# the ResourceView factory requires the use of the image_view plugin for default functionality
+# the ResourceView factory requires the use of the image_view plugin for default
+# functionality
 @pytest.mark.ckan_config('ckan.plugins', 'userdatasets image_view')
 @pytest.mark.usefixtures('clean_db', 'with_plugins', 'with_request_context')
 class TestFuncResourceViews(object):
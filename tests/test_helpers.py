@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ckan.plugins import toolkit
+from flask import Flask, g
+
+from ckanext.userdatasets.lib.helpers import userdatasets_editable_ids
+
+
+class TestEditableIds(object):
+    def test_anonymous(self):
+        with Flask(__name__).app_context():
+            g.userobj = None
+            assert userdatasets_editable_ids([{'id': 'a'}]) == set()
+
+    @pytest.mark.ckan_config('ckanext.userdatasets.editable_ids.batch_only', 'true')
+    @pytest.mark.usefixtures('ckan_config')
+    @patch('ckanext.userdatasets.lib.helpers.check_access_batch')
+    def test_editable_ids(self, mock_check_access_batch):
+        mock_check_access_batch.side_effect = lambda context, user, ids, perm: {
+            package_id: package_id.startswith('mine') for package_id in ids
+        }
+        with Flask(__name__).app_context():
+            g.userobj = MagicMock(id='turtle-id')
+            packages = [{'id': 'mine-1'}, {'id': 'theirs'}, {'id': 'mine-2'}]
+            assert userdatasets_editable_ids(packages) == {'mine-1', 'mine-2'}
+            assert mock_check_access_batch.call_count == 1
+
+            # only the package which hasn't been seen before is checked
+            assert userdatasets_editable_ids(['mine-1', 'mine-3']) == {
+                'mine-1',
+                'mine-3',
+            }
+            assert mock_check_access_batch.call_count == 2
+            assert mock_check_access_batch.call_args[0][2] == ['mine-3']
+
+    @patch('ckanext.userdatasets.lib.helpers.toolkit.check_access')
+    @patch('ckanext.userdatasets.lib.helpers.check_access_batch')
+    def test_denials_checked_again(self, mock_check_access_batch, mock_check_access):
+        mock_check_access_batch.side_effect = lambda context, user, ids, perm: {
+            package_id: package_id == 'mine' for package_id in ids
+        }
+
+        # e.g. another plugin allows editing datasets the batch check doesn't know of
+        def check_access(auth_function, context, data_dict):
+            if data_dict['package_id'] != 'plugin':
+                raise toolkit.NotAuthorized()
+
+        mock_check_access.side_effect = check_access
+        with Flask(__name__).app_context():
+            g.userobj = MagicMock(id='turtle-id')
+            editable = userdatasets_editable_ids(
+                ['mine', 'plugin', 'theirs'], 'resource_create'
+            )
+        assert editable == {'mine', 'plugin'}
+        # only the denials are checked again
+        assert [call.args[2] for call in mock_check_access.call_args_list] == [
+            {'package_id': 'plugin'},
+            {'package_id': 'theirs'},
+        ]
+        assert mock_check_access.call_args.args[0] == 'resource_create'
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import json
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from ckanext.userdatasets.lib import instrumentation
+from ckanext.userdatasets.lib.instrumentation import instrument
+from ckanext.userdatasets.logic.action.get import userdatasets_query_stats
+
+
+@pytest.fixture
+def engine():
+    instrumentation.configure(
+        {
+            'ckanext.userdatasets.instrumentation.enabled': 'true',
+            'ckanext.userdatasets.instrumentation.query_threshold': '3',
+            'ckanext.userdatasets.instrumentation.time_threshold': '0',
+        }
+    )
+    yield create_engine('sqlite://')
+    instrumentation.configure({})
+
+
+def make_function(engine, queries, inner=None):
+    def function(context, data_dict):
+        with engine.connect() as conn:
+            for _ in range(queries):
+                conn.execute(text('select 1'))
+        if inner is not None:
+            inner(context, data_dict)
+        return {'success': True}
+
+    function.chained_auth_function = True
+    return function
+
+
+def test_queries_attributed_to_innermost_function(engine):
+    auth = instrument('auth:package_update', make_function(engine, 2))
+    action = instrument('action:package_update', make_function(engine, 1, auth))
+    untracked = make_function(engine, 5)
+
+    assert auth.chained_auth_function
+    action({}, {})
+    action({}, {})
+    untracked({}, {})
+
+    totals = instrumentation.get_query_stats().get_totals()
+    assert totals['auth:package_update']['calls'] == 2
+    assert totals['auth:package_update']['queries'] == 4
+    assert totals['action:package_update']['queries'] == 2
+    assert totals['action:package_update']['max_queries'] == 1
+    assert len(totals) == 2
+
+
+def test_unsampled_calls_are_skipped(engine):
+    instrumentation.get_query_stats().sample_rate = 0
+    auth = instrument('auth:package_update', make_function(engine, 2))
+    action = instrument('action:package_update', make_function(engine, 1, auth))
+    action({}, {})
+    assert instrumentation.get_query_stats().get_totals() == {}
+
+
+def test_calls_over_threshold_are_logged(engine, caplog):
+    instrument('auth:package_update', make_function(engine, 2))({}, {})
+    with caplog.at_level(logging.WARNING, logger='ckanext.userdatasets'):
+        instrument('auth:package_delete', make_function(engine, 3))({}, {})
+
+    assert len(caplog.records) == 1
+    record = json.loads(caplog.records[0].getMessage())
+    assert record['function'] == 'auth:package_delete'
+    assert record['queries'] == 3
+    totals = instrumentation.get_query_stats().get_totals()
+    assert totals['auth:package_delete']['slow_calls'] == 1
+    assert totals['auth:package_update']['slow_calls'] == 0
+
+
+def test_stats_action(engine):
+    instrument('auth:package_update', make_function(engine, 1))({}, {})
+    instrument('action:package_update', make_function(engine, 1))({}, {})
+    stats = userdatasets_query_stats({}, function='auth:')
+    assert stats['enabled']
+    assert list(stats['functions']) == ['auth:package_update']
+    instrumentation.configure({})
+    assert userdatasets_query_stats({}) == {'enabled': False}
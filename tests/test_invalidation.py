@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ckan.plugins import toolkit
+from flask import Flask
+from redis.exceptions import ConnectionError
+
+from ckanext.userdatasets.lib import (
+    invalidation,
+    membership,
+    negative,
+    org_list,
+    packages,
+    snapshot,
+)
+from ckanext.userdatasets.lib.packages import PackageRecord
+
+from .test_snapshot import make_snapshot
+
+KEY = 'ckanext-userdatasets:default:invalidations'
+
+
+@pytest.fixture
+def redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeStrictRedis()
+    with patch(
+        'ckanext.userdatasets.lib.invalidation.connect_to_redis', return_value=client
+    ):
+        invalidation.configure({})
+        yield client
+    invalidation.configure({'ckanext.userdatasets.invalidation.enabled': 'false'})
+
+
+@pytest.fixture
+def handler():
+    apply, reset = MagicMock(), MagicMock()
+    invalidation.register('test', apply, reset)
+    yield apply, reset
+    del invalidation._handlers['test']
+
+
+def other_process():
+    """
+    Creates a channel as another process would.
+    """
+    return invalidation.InvalidationChannel(KEY, 10000)
+
+
+@pytest.mark.usefixtures('redis')
+class TestInvalidationChannel(object):
+    def test_applies_other_processes_events(self, handler):
+        apply, reset = handler
+        channel = invalidation.get_invalidation_channel()
+        # the first sync clears the caches as nothing has been seen yet
+        channel.sync()
+        assert reset.call_count == 1
+
+        other_process().publish('test', 'a', 'b')
+        other_process().publish('unknown', 'c')
+        other_process().publish('test', 'd')
+        channel.sync()
+        assert [call.args for call in apply.call_args_list] == [('a', 'b'), ('d',)]
+        assert reset.call_count == 1
+
+        # events are only applied once
+        channel.sync()
+        assert apply.call_count == 2
+
+    def test_missed_events_reset(self, redis, handler):
+        apply, reset = handler
+        channel = invalidation.get_invalidation_channel()
+        channel.sync()
+        other = other_process()
+        for ref in 'abcde':
+            other.publish('test', ref)
+        # trimming is approximate, so trim it exactly to lose the earlier events
+        redis.xtrim(KEY, 2, approximate=False)
+        channel.sync()
+        assert reset.call_count == 2
+
+        # it carries on from the latest event
+        other.publish('test', 'f')
+        channel.sync()
+        assert apply.call_args.args == ('f',)
+
+    def test_redis_errors_reset(self, redis, handler):
+        apply, reset = handler
+        channel = invalidation.get_invalidation_channel()
+        channel.sync()
+        with patch.object(redis, 'xrange', side_effect=ConnectionError):
+            channel.sync()
+        assert reset.call_count == 2
+        assert channel.last_id is None
+
+    def test_published_again_after_commit(self, redis):
+        session = MagicMock(info={})
+        with patch('ckanext.userdatasets.lib.invalidation.model') as model:
+            model.Session.return_value = session
+            invalidation.publish('test', 'a')
+        assert redis.xlen(KEY) == 1
+        invalidation._after_commit(session)
+        assert redis.xlen(KEY) == 2
+        assert invalidation.PENDING not in session.info
+
+    def test_synced_once_per_request(self):
+        channel = invalidation.get_invalidation_channel()
+        with patch.object(channel, 'sync') as sync:
+            with Flask(__name__).app_context():
+                invalidation.sync_invalidations()
+                invalidation.sync_invalidations()
+            assert sync.call_count == 1
+            # outside a request every call syncs
+            invalidation.sync_invalidations()
+            assert sync.call_count == 2
+
+
+@pytest.mark.usefixtures('redis')
+class TestPackageRecordInvalidation(object):
+    def setup_method(self):
+        packages.configure({'ckanext.userdatasets.package_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        packages.configure({})
+
+    def test_invalidated_by_other_process(self):
+        cache = packages.get_package_record_cache()
+        cache.set(PackageRecord('pkg-id', 'pkg', 'carrot', 'turtle-id'))
+
+        other_process().publish(packages.PACKAGE_EVENT, 'pkg-id')
+        cache = packages.get_package_record_cache()
+        assert cache.get('pkg') is None
+        # invalidation doesn't count as a lookup
+        assert cache.cache.hits == 0
+
+
+@pytest.mark.usefixtures('redis')
+class TestOrgListInvalidation(object):
+    def setup_method(self):
+        org_list.configure({'ckanext.userdatasets.org_list_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        org_list.configure({})
+
+    def test_cleared_by_other_process(self):
+        cache = org_list.get_org_list_cache()
+        cache.set(('turtle', False, 'read'), [{'id': 'carrot'}])
+
+        other_process().publish(org_list.ORG_LISTS_EVENT)
+        cache = org_list.get_org_list_cache()
+        assert cache.get(('turtle', False, 'read')) is None
+
+    def test_clear_published(self, redis):
+        with patch('ckanext.userdatasets.lib.invalidation.model'):
+            org_list.clear_org_lists()
+        assert redis.xlen(KEY) == 1
+
+
+@pytest.mark.usefixtures('redis')
+class TestNegativeCacheInvalidation(object):
+    def setup_method(self):
+        negative.configure({'ckanext.userdatasets.negative_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        negative.configure({})
+
+    def test_created_by_other_process(self):
+        # the first sync clears the cache
+        negative.get_negative_cache()
+        negative.not_found(negative.PACKAGE, 'pkg')
+        negative.not_found(negative.RESOURCE, 'pkg')
+        with pytest.raises(toolkit.ObjectNotFound):
+            negative.check_missing(negative.PACKAGE, 'pkg')
+
+        other_process().publish(f'{negative.MISSING_EVENT}:{negative.PACKAGE}', 'pkg')
+        negative.check_missing(negative.PACKAGE, 'pkg')
+        # only the type of object that was created is forgotten
+        with pytest.raises(toolkit.ObjectNotFound):
+            negative.check_missing(negative.RESOURCE, 'pkg')
+
+    def test_discard_published(self, redis):
+        with patch('ckanext.userdatasets.lib.invalidation.model'):
+            negative.discard_missing(negative.RESOURCE_VIEW, 'view-id', None)
+            # nothing is published if there's nothing to discard
+            negative.discard_missing(negative.RESOURCE_VIEW, None)
+        assert redis.xlen(KEY) == 1
+
+
+@pytest.mark.usefixtures('redis')
+class TestMembershipInvalidation(object):
+    def setup_method(self):
+        membership.configure({'ckanext.userdatasets.membership_cache.enabled': 'true'})
+        org_list.configure({'ckanext.userdatasets.org_list_cache.enabled': 'true'})
+        snapshot.configure({'ckanext.userdatasets.membership_snapshot.enabled': 'true'})
+
+    def teardown_method(self):
+        membership.configure({})
+        org_list.configure({})
+        snapshot.configure({})
+
+    def test_invalidated_by_other_process(self):
+        # the first sync clears the caches
+        invalidation.sync_invalidations()
+        roles = membership.get_membership_cache()
+        roles.set('ocean-id', 'turtle', 'editor')
+        org_list.get_org_list_cache().set(('turtle', False, 'read'), [])
+        manager = snapshot.get_snapshot_manager()
+        manager.snapshot = make_snapshot()
+        manager.loaded_at = manager.clock()
+
+        other_process().publish(invalidation.USER_EVENT, 'turtle', 'turtle-id')
+        assert membership.get_membership_cache().get('ocean-id', 'turtle') is None
+        assert org_list.get_org_list_cache().get(('turtle', False, 'read')) is None
+        # the user's roles are reloaded before the snapshot is next used
+        assert manager.dirty == {'turtle', 'turtle-id'}
+        manager.dirty.clear()
+
+        other_process().publish(snapshot.ORG_EVENT, 'river')
+        assert snapshot.get_snapshot_role('river-id', 'turtle', 'default') == 'default'
+
+    def test_missed_events_reload_snapshot(self, redis):
+        invalidation.sync_invalidations()
+        manager = snapshot.get_snapshot_manager()
+        manager.snapshot = make_snapshot()
+        with patch.object(redis, 'xrange', side_effect=ConnectionError):
+            invalidation.sync_invalidations()
+        assert manager.snapshot is None
+
+    def test_invalidation_published(self, redis):
+        with patch('ckanext.userdatasets.lib.invalidation.model'):
+            membership.invalidate_user_refs({'turtle'})
+        [(_, fields)] = redis.xrevrange(KEY, count=1)
+        assert fields == {b'kind': b'user', b'refs': b'["turtle"]'}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import patch
+
+import pytest
+from ckan.plugins import toolkit
+from redis.exceptions import ConnectionError
+
+from ckanext.userdatasets.lib import metrics, negative
+from ckanext.userdatasets.lib.metrics import timed_action, timed_auth
+
+
+@pytest.fixture
+def enabled():
+    metrics.configure({'ckanext.userdatasets.metrics.enabled': 'true'})
+    negative.configure({'ckanext.userdatasets.negative_cache.enabled': 'true'})
+    yield metrics.get_metrics()
+    metrics.configure({})
+    negative.configure({})
+
+
+def make_auth(success, call_next=False):
+    def auth(next_auth, context, data_dict):
+        if call_next:
+            return next_auth(context, data_dict)
+        return {'success': success}
+
+    auth.chained_auth_function = True
+    return auth
+
+
+def test_auth_decisions(enabled):
+    allow = timed_auth('package_update', make_auth(True))
+    deny = timed_auth('package_update', make_auth(False))
+    fall_through = timed_auth('package_update', make_auth(True, call_next=True))
+
+    def next_auth(context, data_dict):
+        return {'success': True}
+
+    def raises(next_auth, context, data_dict):
+        raise toolkit.ObjectNotFound()
+
+    raises.chained_auth_function = True
+
+    assert allow.chained_auth_function
+    allow(next_auth, {}, {})
+    allow(next_auth, {}, {})
+    deny(next_auth, {}, {})
+    assert fall_through(next_auth, {}, {}) == {'success': True}
+    with pytest.raises(toolkit.ObjectNotFound):
+        timed_auth('package_update', raises)(next_auth, {}, {})
+
+    assert enabled.decisions == {
+        ('package_update', 'allow'): 2,
+        ('package_update', 'deny'): 1,
+        ('package_update', 'next'): 1,
+        ('package_update', 'error'): 1,
+    }
+    assert sum(enabled.histograms[('auth', 'package_update')].counts) == 5
+
+
+def test_render(enabled):
+    timed_action('package_create', lambda context, data_dict: {})({}, {})
+    timed_auth('package_create', make_auth(True))(None, {}, {})
+    cache = negative.get_negative_cache()
+    negative.not_found(negative.PACKAGE, 'missing')
+    cache.is_missing(negative.PACKAGE, 'missing')
+    cache.is_missing(negative.PACKAGE, 'other')
+
+    text = metrics.render()
+    lines = text.splitlines()
+    assert '# TYPE userdatasets_auth_duration_seconds histogram' in lines
+    action = 'action="package_create"'
+    assert (
+        f'userdatasets_action_duration_seconds_bucket{{{action},le="+Inf"}} 1' in lines
+    )
+    assert (
+        'userdatasets_action_duration_seconds_count{action="package_create"} 1' in lines
+    )
+    function = 'function="package_create"'
+    assert (
+        f'userdatasets_auth_decisions_total{{{function},decision="allow"}} 1' in lines
+    )
+    assert 'userdatasets_cache_hits_total{cache="negative"} 1' in lines
+    assert 'userdatasets_cache_misses_total{cache="negative"} 1' in lines
+    assert 'userdatasets_negative_cache_avoided_queries_total 1' in lines
+    assert text.endswith('\n')
+
+
+@pytest.fixture
+def shared(enabled):
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeStrictRedis()
+    with patch(
+        'ckanext.userdatasets.lib.metrics.connect_to_redis', return_value=client
+    ):
+        metrics.configure(
+            {
+                'ckanext.userdatasets.metrics.enabled': 'true',
+                'ckanext.userdatasets.metrics.shared': 'true',
+            }
+        )
+        yield client
+
+
+def test_shared_totals(shared):
+    allow = timed_auth('package_update', make_auth(True))
+    negative.get_negative_cache().is_missing(negative.PACKAGE, 'missing')
+    allow(None, {}, {})
+    # another worker's counts and gauges
+    metrics._shared.flush()
+    metrics._metrics = metrics.Metrics()
+    metrics._shared = metrics.SharedMetrics('ckanext-userdatasets:default:metrics', 10)
+    allow(None, {}, {})
+    timed_auth('package_delete', make_auth(False))(None, {}, {})
+    shared.hset(
+        'ckanext-userdatasets:default:metrics:gauges:other-host:1',
+        '["userdatasets_cache_entries", "", "cache=\\"negative\\""]',
+        3,
+    )
+
+    lines = metrics.render().splitlines()
+    function = 'function="package_update"'
+    assert (
+        f'userdatasets_auth_decisions_total{{{function},decision="allow"}} 2' in lines
+    )
+    function = 'function="package_delete"'
+    assert f'userdatasets_auth_decisions_total{{{function},decision="deny"}} 1' in lines
+    assert 'userdatasets_cache_entries{cache="negative"} 3' in lines
+    # both workers report the (shared, in this test) negative cache's miss
+    assert 'userdatasets_cache_misses_total{cache="negative"} 2' in lines
+
+    # scraping again doesn't count anything twice
+    assert metrics.render().splitlines() == lines
+
+
+def test_shared_redis_down(shared):
+    timed_auth('package_update', make_auth(True))(None, {}, {})
+    with patch.object(shared, 'pipeline', side_effect=ConnectionError), patch.object(
+        shared, 'hgetall', side_effect=ConnectionError
+    ):
+        lines = metrics.render().splitlines()
+    function = 'function="package_update"'
+    assert (
+        f'userdatasets_auth_decisions_total{{{function},decision="allow"}} 1' in lines
+    )
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import pytest
+from ckan import model
+from ckan.tests import factories
+from ckan.tests.helpers import call_action
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from ckanext.userdatasets.lib.owned import (
+    build_owned_packages_query,
+    query_owned_packages,
+)
+from ckanext.userdatasets.lib.search import build_org_roles_query, get_org_roles
+from ckanext.userdatasets.lib.transfer import build_transfer_query
+from ckanext.userdatasets.logic.auth.auth import query_ownership
+
+MEMBER_INDEX = 'idx_userdatasets_member_user_active'
+PACKAGE_INDEX = 'idx_userdatasets_package_owner_org_creator'
+CREATOR_INDEX = 'idx_userdatasets_package_creator_modified'
+
+
+@pytest.fixture
+def indexes(migrate_db_for):
+    if model.Session.bind.dialect.name != 'postgresql':
+        pytest.skip('The indexes are only checked on PostgreSQL')
+    migrate_db_for('userdatasets')
+    yield
+    migrate_db_for('userdatasets', 'base', False)
+
+
+def explain(query):
+    sql = query.statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}
+    )
+    # the test tables are tiny, so make sure the planner doesn't just scan them
+    model.Session.execute(text('SET LOCAL enable_seqscan = off'))
+    rows = model.Session.execute(text(f'EXPLAIN {sql}'))
+    return '\n'.join(row[0] for row in rows)
+
+
+@pytest.mark.ckan_config('ckan.plugins', 'userdatasets')
+@pytest.mark.usefixtures('clean_db', 'with_plugins', 'indexes')
+class TestOwnershipIndexes(object):
+    def test_query_plans(self):
+        org = factories.Organization()
+        user = factories.User()
+        call_action(
+            'organization_member_create',
+            id=org['id'],
+            username=user['name'],
+            role='member',
+        )
+        package = factories.Dataset(owner_org=org['id'], user=user)
+        user_obj = model.User.get(user['id'])
+        context = {'model': model}
+
+        # the ownership query used by the auth functions
+        plan = explain(
+            query_ownership(context, user_obj).filter(model.Package.id == package['id'])
+        )
+        assert MEMBER_INDEX in plan
+
+        # the user's organisation roles, used by the editable_by_me search filter
+        assert MEMBER_INDEX in explain(build_org_roles_query(user_obj))
+        assert get_org_roles(user_obj) == {org['id']: 'member'}
+
+        # the datasets a user created in an organisation, which are transferred
+        assert PACKAGE_INDEX in explain(build_transfer_query(user_obj.id, [org['id']]))
+
+        # the datasets a user owns, listed from the most recently modified
+        assert CREATOR_INDEX in explain(build_owned_packages_query(user_obj, limit=10))
+        packages, _ = query_owned_packages(user_obj)
+        assert [p['id'] for p in packages] == [package['id']]
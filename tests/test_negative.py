@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import negative
+from ckanext.userdatasets.logic.auth.auth import (
+    get_resource_ownership,
+    get_resource_view_ownership,
+)
+
+
+class TestNegativeCache(object):
+    def setup_method(self):
+        negative.configure({'ckanext.userdatasets.negative_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        negative.configure({})
+
+    def test_missing_resource_is_remembered(self):
+        model = MagicMock()
+        query = model.Session.query.return_value
+        query = query.outerjoin.return_value.join.return_value.filter.return_value
+        query.first.return_value = None
+        context = {'model': model}
+        user = MagicMock(id='turtle-id')
+
+        for _ in range(3):
+            with pytest.raises(toolkit.ObjectNotFound):
+                get_resource_ownership(context, user, 'not-a-resource')
+
+        assert model.Session.query.call_count == 1
+        assert negative.get_negative_cache().avoided == 2
+
+    def test_missing_view_is_remembered(self):
+        model = MagicMock()
+        query = model.Session.query.return_value.outerjoin.return_value
+        query = query.join.return_value.join.return_value.filter.return_value
+        query.first.return_value = None
+        user = MagicMock(id='turtle-id')
+
+        for _ in range(3):
+            with pytest.raises(toolkit.ObjectNotFound):
+                # a new context each time, as each auth call would have
+                get_resource_view_ownership({'model': model}, user, {'id': 'no-view'})
+
+        assert model.Session.query.call_count == 1
+        assert negative.get_negative_cache().avoided == 2
+
+    def test_discarded_when_created(self):
+        negative.not_found(negative.PACKAGE, 'pkg')
+        negative.not_found(negative.RESOURCE, 'res-id')
+        with pytest.raises(toolkit.ObjectNotFound):
+            negative.check_missing(negative.PACKAGE, 'pkg')
+
+        negative.discard_missing_package(
+            {'id': 'pkg-id', 'name': 'pkg', 'resources': [{'id': 'res-id'}]}
+        )
+        negative.check_missing(negative.PACKAGE, 'pkg')
+        negative.check_missing(negative.RESOURCE, 'res-id')
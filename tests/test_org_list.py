@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.userdatasets.lib import membership, org_list
+from ckanext.userdatasets.logic.action.get import organization_list_for_user
+
+
+@patch(
+    'ckanext.userdatasets.logic.action.get.authz.is_sysadmin',
+    MagicMock(return_value=False),
+)
+@patch('ckanext.userdatasets.logic.action.get.toolkit.check_access')
+class TestOrgListCache(object):
+    def setup_method(self):
+        org_list.configure({'ckanext.userdatasets.org_list_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        org_list.configure({})
+
+    def test_cached(self, mock_check_access):
+        next_action = MagicMock(return_value=[{'id': 'carrot', 'capacity': 'member'}])
+        context = {'user': 'turtle'}
+        data_dict = {'permission': 'create_dataset'}
+
+        orgs = organization_list_for_user(next_action, context, data_dict)
+        assert orgs == [{'id': 'carrot', 'capacity': 'member'}]
+        # modifying the returned list doesn't affect the cache
+        orgs[0]['capacity'] = 'admin'
+        orgs = organization_list_for_user(next_action, context, data_dict)
+        assert orgs == [{'id': 'carrot', 'capacity': 'member'}]
+
+        # the permission was swapped for read before calling core
+        assert next_action.call_count == 1
+        assert next_action.call_args[0][1]['permission'] == 'read'
+        # access is still checked on every call
+        assert mock_check_access.call_count == 2
+
+        # a different permission means a different list
+        organization_list_for_user(next_action, context, {'permission': 'manage_group'})
+        assert next_action.call_count == 2
+
+    @pytest.mark.parametrize(
+        'option', ['include_dataset_count', 'include_member_count']
+    )
+    def test_counts_not_cached(self, mock_check_access, option):
+        next_action = MagicMock(return_value=[])
+        context = {'user': 'turtle'}
+        organization_list_for_user(next_action, context, {option: 'true'})
+        organization_list_for_user(next_action, context, {option: 'true'})
+        assert next_action.call_count == 2
+
+    def test_sysadmin_change(self, mock_check_access):
+        next_action = MagicMock(return_value=[])
+        context = {'user': 'turtle'}
+        organization_list_for_user(next_action, context, {})
+        with patch(
+            'ckanext.userdatasets.logic.action.get.authz.is_sysadmin',
+            return_value=True,
+        ):
+            organization_list_for_user(next_action, context, {})
+        assert next_action.call_count == 2
+
+    @patch('ckanext.userdatasets.lib.membership.model')
+    def test_invalidation(self, mock_model, _):
+        user = MagicMock(id='turtle-id')
+        user.name = 'turtle'
+        mock_model.User.get.return_value = user
+        next_action = MagicMock(return_value=[])
+        context = {'user': 'turtle'}
+
+        organization_list_for_user(next_action, context, {})
+        membership.invalidate_user('turtle-id')
+        organization_list_for_user(next_action, context, {})
+        org_list.clear_org_lists()
+        organization_list_for_user(next_action, context, {})
+        assert next_action.call_count == 3
+
+    def test_disabled(self, mock_check_access):
+        org_list.configure({})
+        next_action = MagicMock(return_value=[])
+        organization_list_for_user(next_action, {'user': 'turtle'}, {})
+        organization_list_for_user(next_action, {'user': 'turtle'}, {})
+        assert next_action.call_count == 2
+        # core checks access itself
+        assert not mock_check_access.called
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib.owned import decode_cursor, encode_cursor
+from ckanext.userdatasets.logic.action.get import userdatasets_owned_package_list
+from ckanext.userdatasets.logic.auth.get import (
+    userdatasets_owned_package_list as owned_auth,
+)
+
+MODULE = 'ckanext.userdatasets.logic.action.get'
+
+
+class TestCursor(object):
+    @pytest.mark.parametrize(
+        'modified',
+        [datetime(2026, 10, 18, 9, 30, 1, 123456), datetime(2026, 10, 18, 9, 30)],
+    )
+    def test_round_trip(self, modified):
+        cursor = encode_cursor(modified, 'package-id')
+        assert decode_cursor(cursor) == (modified, 'package-id')
+
+    @pytest.mark.parametrize('cursor', ['nonsense', 'W10=', 'WyJub3QgYSBkYXRlIiwgMV0='])
+    def test_invalid(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+class TestOwnedPackageList(object):
+    @pytest.fixture
+    def context(self):
+        model = MagicMock()
+        model.User.get.side_effect = {'other': MagicMock(id='other-id')}.get
+        model.Group.get.return_value = MagicMock(id='org-id', is_organization=True)
+        return {'model': model, 'auth_user_obj': MagicMock(id='user-id')}
+
+    @pytest.fixture
+    def query(self):
+        with patch(
+            f'{MODULE}.query_owned_packages', return_value=([], 'cursor')
+        ) as query:
+            yield query
+
+    def test_defaults(self, context, query):
+        result = userdatasets_owned_package_list(context)
+        assert result == {'results': [], 'next_cursor': 'cursor'}
+        query.assert_called_once_with(
+            context['auth_user_obj'],
+            None,
+            ('id', 'name', 'metadata_modified'),
+            100,
+            None,
+        )
+
+    def test_options(self, context, query):
+        userdatasets_owned_package_list(
+            context,
+            user='other',
+            owner_org='org',
+            fields=['id', 'title'],
+            limit=5000,
+            cursor='abc',
+        )
+        user, owner_org_id, fields, limit, cursor = query.call_args.args
+        assert user.id == 'other-id'
+        assert owner_org_id == 'org-id'
+        assert fields == ['id', 'title']
+        # the limit is capped
+        assert limit == 1000
+        assert cursor == 'abc'
+
+    def test_unknown_fields(self, context, query):
+        with pytest.raises(toolkit.ValidationError):
+            userdatasets_owned_package_list(context, fields=['id', 'notes'])
+        query.assert_not_called()
+
+    def test_invalid_cursor(self, context, query):
+        query.side_effect = ValueError('Invalid cursor: nonsense')
+        with pytest.raises(toolkit.ValidationError):
+            userdatasets_owned_package_list(context, cursor='nonsense')
+
+    @pytest.mark.parametrize(
+        'data_dict,success',
+        [({}, True), ({'user': 'user-id'}, True), ({'user': 'other'}, False)],
+    )
+    def test_auth(self, data_dict, success):
+        user = MagicMock(id='user-id')
+        user.name = 'user'
+        result = owned_auth({'auth_user_obj': user}, data_dict)
+        assert result['success'] is success
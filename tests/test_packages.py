@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+from ckanext.userdatasets.lib import packages
+from ckanext.userdatasets.lib.packages import PackageRecord, PackageRecordCache
+from ckanext.userdatasets.logic.action.update import package_owner_org_update
+from ckanext.userdatasets.logic.auth.auth import get_package_ownership
+
+
+class TestPackageRecordCache(object):
+    def test_id_and_name(self):
+        cache = PackageRecordCache(10, 0)
+        record = PackageRecord('pkg-id', 'pkg', 'carrot', 'turtle-id')
+        cache.set(record)
+        assert cache.get('pkg-id') is record
+        assert cache.get('pkg') is record
+
+        # invalidating by either ref removes both entries
+        cache.invalidate('pkg')
+        assert cache.get('pkg-id') is None
+        assert cache.get('pkg') is None
+
+    def test_slots(self):
+        record = PackageRecord('pkg-id', 'pkg', 'carrot', 'turtle-id')
+        assert not hasattr(record, '__dict__')
+
+
+class TestPackageOwnershipFromCache(object):
+    def setup_method(self):
+        packages.configure({'ckanext.userdatasets.package_cache.enabled': 'true'})
+
+    def teardown_method(self):
+        packages.configure({})
+
+    @patch('ckanext.userdatasets.logic.auth.auth.get_role')
+    def test_cache_hit(self, mock_get_role):
+        mock_get_role.return_value = 'member'
+        packages.get_package_record_cache().set(
+            PackageRecord('pkg-id', 'pkg', 'carrot', 'turtle-id')
+        )
+        user = MagicMock(id='turtle-id')
+        user.name = 'turtle'
+        context = {'model': MagicMock()}
+
+        ownership = get_package_ownership(context, user, 'pkg')
+        assert ownership.user_owns_package
+        assert not context['model'].Session.query.called
+
+        # after an update the package is queried again
+        packages.invalidate_package({'id': 'pkg-id', 'name': 'pkg'})
+        assert packages.get_package_record_cache().get('pkg') is None
+
+    def test_owner_org_update(self):
+        packages.get_package_record_cache().set(
+            PackageRecord('pkg-id', 'pkg', 'carrot', 'turtle-id')
+        )
+        next_action = MagicMock()
+        # moving a package to another organisation doesn't call the package hooks
+        package_owner_org_update(
+            next_action, {}, {'id': 'pkg', 'organization_id': 'beetroot'}
+        )
+        assert next_action.called
+        assert packages.get_package_record_cache().get('pkg-id') is None
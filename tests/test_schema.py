@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+from ckan.logic.validators import owner_org_validator as default_owner_org_validator
+
+from ckanext.userdatasets.logic.schema import (
+    clear_schema_cache,
+    get_package_schema,
+)
+from ckanext.userdatasets.logic.validators import owner_org_validator
+
+
+def other_validator():
+    pass
+
+
+class TestPackageSchemaCache(object):
+    def setup_method(self):
+        clear_schema_cache()
+
+    def teardown_method(self):
+        clear_schema_cache()
+
+    @patch('ckanext.userdatasets.logic.schema.lib_plugins.lookup_package_plugin')
+    def test_patched_and_cached(self, mock_lookup):
+        package_plugin = MagicMock()
+        package_plugin.create_package_schema.side_effect = lambda: {
+            'owner_org': [other_validator, default_owner_org_validator],
+            'resources': {'url': [other_validator]},
+        }
+        mock_lookup.return_value = package_plugin
+
+        schema = get_package_schema('dataset', 'create')
+        assert schema['owner_org'] == [other_validator, owner_org_validator]
+
+        # modifying the returned schema doesn't affect the cached one
+        schema['owner_org'].append(other_validator)
+        schema['resources']['url'].clear()
+        schema = get_package_schema('dataset', 'create')
+        assert schema['owner_org'] == [other_validator, owner_org_validator]
+        assert schema['resources']['url'] == [other_validator]
+
+        assert package_plugin.create_package_schema.call_count == 1
+        assert package_plugin.update_package_schema.call_count == 0
+
+        # after clearing, the schema is rebuilt
+        clear_schema_cache()
+        get_package_schema('dataset', 'create')
+        assert package_plugin.create_package_schema.call_count == 2
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from flask import Flask, g
+
+from ckanext.userdatasets.lib.search import (
+    MATCH_NOTHING,
+    apply_editable_filter,
+    build_editable_filter,
+)
+
+
+def make_user():
+    user = MagicMock(id='turtle-id')
+    user.name = 'turtle'
+    user.is_deleted.return_value = False
+    return user
+
+
+@pytest.mark.usefixtures('ckan_config')
+@pytest.mark.ckan_config('ckan.auth.create_unowned_dataset', False)
+@pytest.mark.ckan_config('ckan.auth.allow_dataset_collaborators', False)
+@patch(
+    'ckanext.userdatasets.logic.auth.batch.authz.has_user_permission_for_some_org',
+    return_value=False,
+)
+@patch('ckanext.userdatasets.lib.search.authz.is_sysadmin', return_value=False)
+@patch('ckanext.userdatasets.lib.search.get_org_roles')
+class TestEditableFilter(object):
+    def test_roles(self, mock_get_org_roles, *_):
+        mock_get_org_roles.return_value = {'carrot': 'member', 'beetroot': 'editor'}
+        fq = build_editable_filter(make_user())
+        assert fq == (
+            '(creator_user_id:"turtle-id" AND owner_org:("beetroot" OR "carrot"))'
+            ' OR owner_org:("beetroot")'
+        )
+
+    def test_no_orgs(self, mock_get_org_roles, *_):
+        mock_get_org_roles.return_value = {}
+        assert build_editable_filter(make_user()) == MATCH_NOTHING
+
+    def test_anonymous(self, mock_get_org_roles, *_):
+        assert build_editable_filter(None) == MATCH_NOTHING
+        assert not mock_get_org_roles.called
+
+    def test_sysadmin(self, mock_get_org_roles, mock_is_sysadmin, _):
+        mock_is_sysadmin.return_value = True
+        assert build_editable_filter(make_user()) is None
+
+    def test_search_params(self, mock_get_org_roles, *_):
+        mock_get_org_roles.return_value = {'carrot': 'member'}
+        with Flask(__name__).app_context():
+            g.userobj = make_user()
+            params = apply_editable_filter(
+                {'q': 'beans', 'fq': 'tags:"x"', 'editable_by_me': 'true'}
+            )
+            extras_params = apply_editable_filter(
+                {'extras': {'ext_editable_by_me': 'true'}}
+            )
+            untouched = apply_editable_filter({'q': 'beans'})
+        fq = '(creator_user_id:"turtle-id" AND owner_org:("carrot"))'
+        assert params == {
+            'q': 'beans',
+            'fq': f'tags:"x" +({fq})',
+            'include_private': True,
+        }
+        assert extras_params['fq'] == f'+({fq})'
+        assert untouched == {'q': 'beans'}
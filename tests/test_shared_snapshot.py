@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import fcntl
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.userdatasets.lib import shared_snapshot
+from ckanext.userdatasets.lib.shared_snapshot import (
+    LOCK_FILE,
+    MappedSnapshot,
+    OverriddenSnapshot,
+    SharedSnapshotManager,
+    write_snapshot,
+)
+
+from .test_snapshot import make_snapshot
+
+
+def test_mapped_snapshot_matches(tmp_path):
+    members = make_snapshot()
+    path = str(tmp_path / 'snapshot')
+    write_snapshot(members, path, 3, 7.5)
+    mapped = MappedSnapshot(path)
+
+    assert (mapped.generation, mapped.built_at) == (3, 7.5)
+    assert len(mapped) == len(members)
+    for org in ('ocean-id', 'ocean', 'river-id', 'river', 'lake-id', None):
+        for user in ('turtle-id', 'turtle', 'crab-id', 'crab', 'heron', None):
+            assert mapped.get_role(org, user, 'default') == members.get_role(
+                org, user, 'default'
+            )
+
+
+def wait_for_build(manager):
+    """
+    Start a build if the manager needs one, wait for it to finish, and return the
+    manager's snapshot.
+    """
+    manager.get_snapshot()
+    if manager._builder is not None:
+        manager._builder.join()
+    return manager.get_snapshot()
+
+
+@patch.object(shared_snapshot, 'BUILD_RETRY_INTERVAL', 0)
+class TestSharedSnapshotManager(object):
+    @pytest.fixture
+    def clock(self):
+        now = [100]
+        clock = MagicMock(side_effect=lambda: now[0])
+        clock.now = now
+        return clock
+
+    def test_workers_share_published_snapshot(self, tmp_path, clock):
+        builder = SharedSnapshotManager(str(tmp_path), 0, clock)
+        worker = SharedSnapshotManager(str(tmp_path), 0, clock)
+        with patch.object(
+            shared_snapshot, 'load_snapshot', side_effect=make_snapshot
+        ) as load:
+            # the snapshot is built in the background rather than during the lookup
+            assert builder.get_snapshot() is None
+            assert wait_for_build(builder).get_role('ocean', 'turtle') == 'editor'
+            assert wait_for_build(worker).generation == 1
+        assert load.call_count == 1
+
+    def test_changes_publish_new_generation(self, tmp_path, clock):
+        builder = SharedSnapshotManager(str(tmp_path), 0, clock)
+        worker = SharedSnapshotManager(str(tmp_path), 0, clock)
+        with patch.object(
+            shared_snapshot, 'load_snapshot', side_effect=make_snapshot
+        ) as load:
+            wait_for_build(builder)
+            wait_for_build(worker)
+            clock.now[0] = 101
+            # each worker is told about the change through the invalidation stream
+            builder.mark_dirty('turtle')
+            worker.mark_dirty('turtle')
+            clock.now[0] = 102
+            assert wait_for_build(builder).generation == 2
+            # the worker drops its override once a snapshot built after it is published
+            assert worker.get_snapshot().generation == 2
+            assert not worker.dirty_users
+
+            clock.now[0] = 103
+            builder.mark_dirty('crab')
+            clock.now[0] = 104
+            assert wait_for_build(builder).generation == 3
+        assert load.call_count == 3
+        # only the current and previous generations are kept
+        assert sorted(name for name in os.listdir(tmp_path) if 'snapshot' in name) == [
+            'snapshot-2',
+            'snapshot-3',
+        ]
+
+    def test_previous_generation_used_while_rebuilding(self, tmp_path, clock):
+        manager = SharedSnapshotManager(str(tmp_path), 0, clock)
+        with patch.object(shared_snapshot, 'load_snapshot', side_effect=make_snapshot):
+            wait_for_build(manager)
+            clock.now[0] = 101
+            manager.mark_dirty('turtle')
+            with open(tmp_path / LOCK_FILE, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                snapshot = wait_for_build(manager)
+            # only the changed user falls back to the database
+            assert isinstance(snapshot, OverriddenSnapshot)
+            assert snapshot.snapshot.generation == 1
+            assert snapshot.get_role('ocean', 'turtle', 'default') == 'default'
+            assert snapshot.get_role('river', 'crab', 'default') is None
+            clock.now[0] = 102
+            assert wait_for_build(manager).generation == 2
+
+    def test_discarded_orgs(self, tmp_path, clock):
+        manager = SharedSnapshotManager(str(tmp_path), 0, clock)
+        with patch.object(shared_snapshot, 'load_snapshot', side_effect=make_snapshot):
+            wait_for_build(manager)
+            manager.discard_orgs('ocean-id', 'ocean')
+            snapshot = manager.get_snapshot()
+            manager._builder.join()
+        assert snapshot.get_role('ocean', 'turtle', 'default') == 'default'
+        assert snapshot.get_role('river', 'turtle') == 'member'
+
+    def test_reset_until_rebuilt(self, tmp_path, clock):
+        manager = SharedSnapshotManager(str(tmp_path), 0, clock)
+        with patch.object(shared_snapshot, 'load_snapshot', side_effect=make_snapshot):
+            wait_for_build(manager)
+            clock.now[0] = 101
+            manager.reset()
+            assert manager.get_snapshot() is None
+            manager._builder.join()
+            assert manager.get_snapshot().generation == 2
+
+    def test_expired_snapshot_used_while_rebuilding(self, tmp_path, clock):
+        manager = SharedSnapshotManager(str(tmp_path), 300, clock)
+        with patch.object(shared_snapshot, 'load_snapshot', side_effect=make_snapshot):
+            wait_for_build(manager)
+            clock.now[0] = 400
+            assert manager.get_snapshot().generation == 1
+            manager._builder.join()
+            assert manager.get_snapshot().generation == 2
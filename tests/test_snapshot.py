@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+from ckanext.userdatasets.lib import snapshot
+from ckanext.userdatasets.lib.snapshot import MembershipSnapshot, SnapshotManager
+from ckanext.userdatasets.logic.action.update import organization_update
+from ckanext.userdatasets.logic.utils import org_role_is_valid
+
+
+def make_snapshot():
+    members = MembershipSnapshot()
+    members.add_users([('turtle-id', 'turtle'), ('crab-id', 'crab')])
+    members.add_orgs([('ocean-id', 'ocean'), ('river-id', 'river')])
+    members.set_memberships(
+        [
+            ('turtle-id', 'ocean-id', 'editor'),
+            ('turtle-id', 'river-id', 'member'),
+            ('crab-id', 'river-id', 'fisherman'),
+        ]
+    )
+    return members
+
+
+class TestMembershipSnapshot(object):
+    def test_get_role(self):
+        members = make_snapshot()
+        assert members.get_role('ocean-id', 'turtle-id') == 'editor'
+        assert members.get_role('river', 'turtle') == 'member'
+        # roles the snapshot doesn't hold are treated as no role
+        assert members.get_role('river-id', 'crab') is None
+        assert members.get_role('ocean', 'crab-id') is None
+        assert len(members) == 2
+
+    def test_unknown_refs_return_default(self):
+        members = make_snapshot()
+        assert members.get_role('lake-id', 'turtle', 'default') == 'default'
+        assert members.get_role('ocean-id', 'heron', 'default') == 'default'
+
+    def test_set_memberships_replaces_user_rows(self):
+        members = make_snapshot()
+        members.set_memberships([('turtle-id', 'lake-id', 'admin')], ['turtle-id'])
+        assert members.get_role('lake-id', 'turtle') == 'admin'
+        assert members.get_role('ocean-id', 'turtle') is None
+        members.set_memberships([], ['crab-id'])
+        assert members.get_role('river-id', 'crab') is None
+
+    def test_discard_orgs(self):
+        members = make_snapshot()
+        members.discard_orgs('ocean')
+        assert members.get_role('ocean-id', 'turtle', 'default') == 'default'
+        assert members.get_role('river-id', 'turtle') == 'member'
+
+
+class TestSnapshotManager(object):
+    def test_reloads_after_interval(self):
+        now = [0]
+        manager = SnapshotManager(300, clock=lambda: now[0])
+        with patch.object(snapshot, 'load_snapshot', side_effect=make_snapshot) as load:
+            first = manager.get_snapshot()
+            assert manager.get_snapshot() is first
+            now[0] = 301
+            assert manager.get_snapshot() is not first
+        assert load.call_count == 2
+
+    def test_refreshes_dirty_users(self):
+        manager = SnapshotManager(0)
+        with patch.object(snapshot, 'load_snapshot', side_effect=make_snapshot):
+            manager.get_snapshot()
+        manager.mark_dirty('turtle')
+        with patch.object(SnapshotManager, '_refresh_dirty') as refresh:
+            manager.get_snapshot()
+        refresh.assert_called_once_with()
+
+    @patch('ckanext.userdatasets.lib.snapshot.model')
+    def test_refresh_forgets_old_names(self, mock_model):
+        manager = SnapshotManager(0)
+        manager.snapshot = make_snapshot()
+        manager.loaded_at = manager.clock()
+        # turtle has been renamed and has no memberships
+        users = mock_model.Session.query.return_value.filter.return_value.all
+        users.return_value = [('turtle-id', 'tortoise')]
+        manager.mark_dirty('turtle', 'turtle-id', 'tortoise')
+        members = manager.get_snapshot()
+        assert members.get_role('ocean-id', 'turtle', 'default') == 'default'
+        assert members.get_role('ocean-id', 'tortoise', 'default') is None
+
+
+class TestOrgRoleIsValid(object):
+    def setup_method(self):
+        snapshot.configure({'ckanext.userdatasets.membership_snapshot.enabled': 'true'})
+        manager = snapshot.get_snapshot_manager()
+        manager.snapshot = make_snapshot()
+        manager.loaded_at = manager.clock()
+
+    def teardown_method(self):
+        snapshot.configure({})
+
+    @patch('ckanext.userdatasets.logic.utils.get_role')
+    def test_answered_from_snapshot(self, get_role):
+        assert org_role_is_valid('ocean-id', 'turtle')
+        assert not org_role_is_valid('ocean-id', 'crab')
+        get_role.assert_not_called()
+
+    @patch('ckanext.userdatasets.logic.utils.get_role', return_value='admin')
+    def test_falls_back_for_unknown_orgs(self, get_role):
+        assert org_role_is_valid('lake-id', 'turtle')
+        get_role.assert_called_once_with('lake-id', 'turtle')
+
+    @patch(
+        'ckanext.userdatasets.logic.action.update.get_org_member_refs',
+        MagicMock(return_value=set()),
+    )
+    @patch('ckanext.userdatasets.logic.action.update.clear_org_lists', MagicMock())
+    def test_renamed_orgs_discarded(self):
+        model = MagicMock()
+        model.Group.get.return_value.name = 'ocean'
+        next_action = MagicMock(return_value={'id': 'ocean-id', 'name': 'sea'})
+        organization_update(next_action, {'model': model}, {'id': 'ocean'})
+        # another organisation could now be called ocean
+        assert snapshot.get_snapshot_role('ocean', 'turtle', 'default') == 'default'
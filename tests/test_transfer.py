@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.userdatasets.lib import audit
+from ckanext.userdatasets.lib.transfer import PROGRESS, transfer_ownership
+from ckanext.userdatasets.logic.action.get import (
+    userdatasets_transfer_ownership_status,
+)
+from ckanext.userdatasets.logic.action.update import userdatasets_transfer_ownership
+from ckanext.userdatasets.logic.auth.get import (
+    userdatasets_transfer_ownership_status as status_auth,
+)
+
+MODULE = 'ckanext.userdatasets.lib.transfer'
+
+
+def query_chunks(model, chunks):
+    """
+    Make the package ID queries return each of the given lists of IDs in turn and
+    return the mock the updates are made on.
+    """
+    # the keyset condition only needs to build, the chunks stand in for its results
+    model.Package.id.__gt__.return_value = MagicMock()
+    packages = MagicMock()
+    packages.count.return_value = sum(map(len, chunks))
+    results = iter(chunks + [[]])
+    limit = packages.filter.return_value.order_by.return_value.limit
+    limit.side_effect = lambda size: [(package_id,) for package_id in next(results)]
+    updates = MagicMock()
+    query = MagicMock()
+    query.filter.return_value = packages
+    model.Session.query.side_effect = lambda entity: (
+        query if entity is model.Package.id else updates
+    )
+    return updates
+
+
+class TestTransferOwnership(object):
+    @pytest.fixture
+    def job(self):
+        job = MagicMock(meta={PROGRESS: {'requested_by': 'admin-id'}})
+        with patch(f'{MODULE}.model') as model, patch(
+            f'{MODULE}.search'
+        ) as search, patch(f'{MODULE}.get_current_job', return_value=job), patch(
+            f'{MODULE}.invalidate_packages'
+        ) as invalidate_packages:
+            yield model, search, invalidate_packages, job
+
+    def test_transfers_in_chunks(self, job):
+        model, search, invalidate_packages, current_job = job
+        updates = query_chunks(model, [['a', 'b'], ['c']])
+
+        with patch(f'{MODULE}.record_ownership_transfer') as record:
+            assert transfer_ownership('old-id', 'new-id', 'org-id', chunk_size=2) == 3
+
+        update = updates.filter.return_value.update
+        assert update.call_count == 2
+        update.assert_called_with(
+            {'creator_user_id': 'new-id'}, synchronize_session=False
+        )
+        # each chunk is committed and reindexed before the next is read
+        assert model.Session.commit.call_count == 2
+        assert [
+            call.kwargs['package_ids'] for call in search.rebuild.call_args_list
+        ] == [
+            ['a', 'b'],
+            ['c'],
+        ]
+        assert search.commit.call_count == 2
+        assert [call.args for call in invalidate_packages.call_args_list] == [
+            ('a', 'b'),
+            ('c',),
+        ]
+        assert [call.args for call in record.call_args_list] == [
+            ('admin-id', 'old-id', 'new-id', 'org-id', ['a', 'b']),
+            ('admin-id', 'old-id', 'new-id', 'org-id', ['c']),
+        ]
+        assert current_job.meta[PROGRESS] == {
+            'requested_by': 'admin-id',
+            'total': 3,
+            'transferred': 3,
+        }
+
+    def test_nothing_to_transfer(self, job):
+        model, search, invalidate_packages, current_job = job
+        query_chunks(model, [])
+        assert transfer_ownership('old-id', 'new-id', 'org-id') == 0
+        model.Session.commit.assert_not_called()
+        search.rebuild.assert_not_called()
+        assert current_job.meta[PROGRESS]['total'] == 0
+
+    def test_all_member_orgs(self, job):
+        model = job[0]
+        query_chunks(model, [])
+        with patch(
+            f'{MODULE}.get_member_org_ids', return_value=['org-1', 'org-2']
+        ) as get_org_ids:
+            transfer_ownership('old-id', 'new-id')
+        get_org_ids.assert_called_once_with('new-id')
+        model.Package.owner_org.in_.assert_called_once_with(['org-1', 'org-2'])
+
+    def test_audited(self, job, tmp_path):
+        model = job[0]
+        query_chunks(model, [['a', 'b'], ['c']])
+        path = tmp_path / 'audit.jsonl'
+        audit.configure(
+            {
+                'ckanext.userdatasets.audit.enabled': 'true',
+                'ckanext.userdatasets.audit.path': str(path),
+            }
+        )
+        try:
+            transfer_ownership('old-id', 'new-id', chunk_size=2)
+            # the events are written before the job finishes
+            events = [json.loads(line) for line in path.read_text().splitlines()]
+        finally:
+            audit.configure({})
+        assert [event['package_ids'] for event in events] == [['a', 'b'], ['c']]
+        assert events[0]['action'] == 'userdatasets_transfer_ownership'
+        assert events[0]['user_id'] == 'admin-id'
+        assert events[0]['owner_org'] is None
+
+
+class TestTransferAction(object):
+    MODULE = 'ckanext.userdatasets.logic.action.update'
+
+    @pytest.fixture
+    def context(self):
+        model = MagicMock()
+        users = {
+            'old': MagicMock(id='old-id'),
+            'new': MagicMock(id='new-id'),
+        }
+        model.User.get.side_effect = users.get
+        model.Group.get.return_value = MagicMock(id='org-id', is_organization=True)
+        return {'model': model, 'auth_user_obj': MagicMock(id='admin-id')}
+
+    def test_enqueues_job(self, context):
+        with patch(f'{self.MODULE}.org_role_is_valid', return_value=True), patch(
+            f'{self.MODULE}.toolkit.enqueue_job'
+        ) as enqueue_job:
+            enqueue_job.return_value.id = 'job-id'
+            result = userdatasets_transfer_ownership(
+                context, 'old', 'new', owner_org='org'
+            )
+
+        assert result == {'job_id': 'job-id'}
+        args = enqueue_job.call_args
+        assert args.args == (transfer_ownership, ['old-id', 'new-id', 'org-id', 500])
+        assert args.kwargs['rq_kwargs']['meta'] == {
+            PROGRESS: {'requested_by': 'admin-id'}
+        }
+
+    def test_new_creator_must_be_member(self, context):
+        with patch(f'{self.MODULE}.org_role_is_valid', return_value=False), patch(
+            f'{self.MODULE}.toolkit.enqueue_job'
+        ) as enqueue_job:
+            with pytest.raises(toolkit.ValidationError):
+                userdatasets_transfer_ownership(context, 'old', 'new', owner_org='org')
+        enqueue_job.assert_not_called()
+
+    def test_missing_user(self, context):
+        with pytest.raises(toolkit.ObjectNotFound):
+            userdatasets_transfer_ownership(context, 'old', 'nobody')
+
+
+class TestTransferStatus(object):
+    @pytest.fixture
+    def job(self):
+        job = MagicMock(
+            meta={PROGRESS: {'requested_by': 'admin-id', 'total': 10, 'transferred': 4}}
+        )
+        job.get_status.return_value = 'started'
+        return job
+
+    def test_status(self, job):
+        with patch(
+            'ckanext.userdatasets.logic.action.get.job_from_id', return_value=job
+        ):
+            result = userdatasets_transfer_ownership_status({}, 'job-id')
+        assert result == {'status': 'started', 'total': 10, 'transferred': 4}
+
+    def test_missing_job(self):
+        with patch(
+            'ckanext.userdatasets.logic.action.get.job_from_id', side_effect=KeyError
+        ):
+            with pytest.raises(toolkit.ObjectNotFound):
+                userdatasets_transfer_ownership_status({}, 'job-id')
+
+    @pytest.mark.parametrize('user_id,success', [('admin-id', True), ('other', False)])
+    def test_only_requester_can_see(self, job, user_id, success):
+        context = {'auth_user_obj': MagicMock(id=user_id)}
+        with patch('ckanext.userdatasets.logic.auth.get.job_from_id', return_value=job):
+            result = status_auth(context, {'job_id': 'job-id'})
+        assert result['success'] is success
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# This file is part of ckanext-userdatasets
+# Created by the Natural History Museum in London, UK
+
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+from ckanext.userdatasets.lib import membership
+from ckanext.userdatasets.lib.memo import get_request_memo
+from ckanext.userdatasets.logic.action.delete import organization_delete
+from ckanext.userdatasets.logic.utils import (
+    ROLE_MEMO,
+    is_member_of_some_org,
+    org_role_is_valid,
+)
+
+
+class TestRoleMemo(object):
+    """
+    Tests for the request-scoped memoisation of role lookups.
+    """
+
+    @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
+    def test_no_app_context(self, mock_users_role):
+        mock_users_role.return_value = 'member'
+        assert org_role_is_valid('carrot', 'turtle')
+        assert org_role_is_valid('carrot', 'turtle')
+        assert mock_users_role.call_count == 2
+
+    @patch('ckanext.userdatasets.logic.utils.users_role_for_group_or_org')
+    def test_memoised_in_app_context(self, mock_users_role):
+        mock_users_role.return_value = None
+        with Flask(__name__).app_context():
+            assert not org_role_is_valid('carrot', 'turtle')
+            assert not org_role_is_valid('carrot', 'turtle')
+            assert not org_role_is_valid('carrot', 'tortoise')
+            assert mock_users_role.call_count == 2
+
+            memo = get_request_memo(ROLE_MEMO)
+            assert memo.hits == 1
+            assert memo.misses == 2
+
+        # a new context gets a new memo
+        with Flask(__name__).app_context():
+            assert not org_role_is_valid('carrot', 'turtle')
+            assert mock_users_role.call_count == 3
+
+
+class TestIsMemberOfSomeOrg(object):
+    def teardown_method(self):
+        membership.configure({})
+
+    @patch('ckanext.userdatasets.logic.utils._query_any_org_role')
+    def test_sysadmin(self, mock_query):
+        assert is_member_of_some_org(MagicMock(sysadmin=True))
+        assert not mock_query.called
+
+    @patch('ckanext.userdatasets.lib.membership.model')
+    @patch('ckanext.userdatasets.logic.utils._query_any_org_role')
+    def test_cached_until_membership_changes(self, mock_query, mock_model):
+        membership.configure({'ckanext.userdatasets.membership_cache.enabled': 'true'})
+        user = MagicMock(id='turtle-id', sysadmin=False)
+        user.name = 'turtle'
+        mock_model.User.get.return_value = user
+
+        mock_query.return_value = None
+        assert not is_member_of_some_org(user)
+        assert not is_member_of_some_org(user)
+        assert mock_query.call_count == 1
+
+        membership.invalidate_user('turtle')
+        mock_query.return_value = 'member'
+        assert is_member_of_some_org(user)
+        assert mock_query.call_count == 2
+
+    @patch('ckanext.userdatasets.logic.action.delete.clear_org_lists', MagicMock())
+    @patch('ckanext.userdatasets.lib.membership.model')
+    @patch('ckanext.userdatasets.logic.utils._query_any_org_role')
+    def test_invalidated_when_org_deleted(self, mock_query, mock_model):
+        membership.configure({'ckanext.userdatasets.membership_cache.enabled': 'true'})
+        user = MagicMock(id='turtle-id', sysadmin=False)
+        user.name = 'turtle'
+        # the organisation's members, whichever state their membership is in
+        mock_model.Session.query.return_value.join.return_value = [
+            ('turtle-id', 'turtle')
+        ]
+
+        mock_query.return_value = 'member'
+        assert is_member_of_some_org(user)
+
+        organization_delete(MagicMock(), {}, {'id': 'carrot'})
+        mock_query.return_value = None
+        assert not is_member_of_some_org(user)
+        assert mock_query.call_count == 2